@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+#
+# ceph_log_analyzer.py
+#
+# Incrementally analyze the cluster log (ceph.log) on a mon.
+#
+# Every run reads only the bytes appended since the previous run: the inode, the
+# first line and the byte offset of the log are kept in a state file, so that after
+# a rotation the rest of the rotated file (plain, .gz or .bz2) is read before the new one.
+# Every line is classified in one pass into slow request, OSD state, election and
+# warning/error events, which are added to per-minute counters kept for a rolling
+# window in the same state file.
+#
+# Usage:
+#
+#   ceph_log_analyzer.py [--report SECONDS] [--metrics FILE] [--json]
+#
+# Example usage:
+#
+#   ./ceph_log_analyzer.py --quiet                  # just catch up, e.g. hourly on every mon
+#   ./ceph_log_analyzer.py --report 3600            # the ceph-health-cron report of the last hour
+#   ./ceph_log_analyzer.py --metrics /var/lib/node_exporter/textfile/ceph_log.prom
+#
+
+from collections import defaultdict
+from optparse import OptionParser
+import bz2
+import glob
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+from prometheus import render
+
+logger = logging.getLogger(__name__)
+
+# date, hh:mm, seconds, who, level and message of a cluster log line, e.g.
+#   2020-04-20 10:00:00.123456 osd.12 osd.12 10.0.0.1:6800/1234 123 : cluster [WRN] 3 slow requests, ...
+#   2020-04-20 10:00:00.123456 mon.a (mon.0) 1234 : cluster [INF] osd.12 marked down after ...
+#   2020-04-20T10:00:00.123456+0200 mon.a (mon.0) 1234 : cluster [DBG] ...
+LINE_RE = re.compile(r'^(\d{4}-\d\d-\d\d[ T]\d\d:\d\d):(\d\d)\S* (\S+) .*? : \S+ \[(\w+)\] (.*)$')
+
+SLOW_OSD_RE = re.compile(r'(\d+) slow requests, .*oldest blocked for > ([\d.]+) secs')
+SLOW_OP_RE = re.compile(r'slow request ([\d.]+) seconds old')
+SLOW_HEALTH_RE = re.compile(r'(\d+) slow requests are blocked > ([\d.]+) sec')
+SLOW_OPS_RE = re.compile(r'(\d+) slow ops, oldest one blocked for ([\d.]+) sec')
+SLOW_PG_RE = re.compile(r'osd_op\(\S+ (\d+\.[0-9a-f]+)')
+IMPLICATED_RE = re.compile(r'(?:Implicated osds |daemons \[)([\w.,]+)')
+OSD_RES = (
+    ('osd_boot', re.compile(r'osd\.(\d+) \S+ boot')),
+    ('osd_down', re.compile(r'osd\.(\d+) marked (?:itself )?down')),
+    ('osd_failed', re.compile(r'osd\.(\d+) failed \(')),
+    ('osd_out', re.compile(r'osd\.(\d+) (?:marked )?out\b')),
+)
+ELECTION_RE = re.compile(r'calling (?:new )?monitor election|is new leader')
+
+OSD_EVENTS = [kind for kind, _ in OSD_RES]
+LEVELS = ('DBG', 'INF', 'SEC', 'WRN', 'ERR')
+EVENT_KINDS = ('osd', 'slow', 'election')
+
+READ_SIZE = 1 << 20
+HEAD_SIZE = 256
+
+# 'YYYY-mm-dd HH:MM' -> epoch
+EPOCHS = {}
+
+
+def osd_ids(text):
+    """ '1,2,osd.3' -> [1, 2, 3] """
+    return [int(osd.replace('osd.', '')) for osd in text.split(',') if osd.replace('osd.', '').isdigit()]
+
+
+def log_epoch(minute):
+    """ Log timestamps are local time; converting one per minute keeps strptime out of the loop """
+    try:
+        return EPOCHS[minute]
+    except KeyError:
+        t = int(time.mktime(time.strptime(minute.replace('T', ' '), '%Y-%m-%d %H:%M')))
+        EPOCHS[minute] = t
+        return t
+
+
+def parse_slow(who, msg):
+    """ (oldest age, implicated OSD ids, PG or None) of a slow request message, or None """
+    m = SLOW_OSD_RE.search(msg) or SLOW_HEALTH_RE.search(msg) or SLOW_OPS_RE.search(msg)
+    if m:
+        age = float(m.group(2))
+    else:
+        m = SLOW_OP_RE.search(msg)
+        if not m:
+            return None
+        age = float(m.group(1))
+    implicated = IMPLICATED_RE.search(msg)
+    osds = osd_ids(implicated.group(1) if implicated else who)
+    pg = SLOW_PG_RE.search(msg)
+    return age, osds, pg.group(1) if pg else None
+
+
+class Minute(object):
+    """ Counters of the log lines of one minute """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.levels = defaultdict(int, data.get('levels', {}))
+        self.osd_events = defaultdict(int, data.get('osd_events', {}))
+        self.slow = data.get('slow', 0)
+        self.slow_max_age = data.get('slow_max_age', 0.0)
+        self.slow_osds = defaultdict(int, data.get('slow_osds', {}))
+        self.elections = data.get('elections', 0)
+
+    def add(self, other):
+        for level, count in other.levels.iteritems():
+            self.levels[level] += count
+        for kind, count in other.osd_events.iteritems():
+            self.osd_events[kind] += count
+        for osd, count in other.slow_osds.iteritems():
+            self.slow_osds[osd] += count
+        self.slow += other.slow
+        self.slow_max_age = max(self.slow_max_age, other.slow_max_age)
+        self.elections += other.elections
+
+    def to_json(self):
+        return {
+            'levels': self.levels,
+            'osd_events': self.osd_events,
+            'slow': self.slow,
+            'slow_max_age': self.slow_max_age,
+            'slow_osds': self.slow_osds,
+            'elections': self.elections,
+        }
+
+
+class LogAnalyzer(object):
+    """ Classify cluster log lines into per-minute counters and a bounded list of notable lines. """
+
+    def __init__(self, window=86400, max_events=10000, minutes=None, events=None):
+        self.window = window
+        self.max_events = max_events
+        self.minutes = dict((int(t), Minute(data)) for t, data in (minutes or {}).iteritems())
+        self.events = events or []
+        self.n_lines = 0
+        self.n_unparsed = 0
+
+    def epoch(self, minute):
+        return log_epoch(minute)
+
+    def add_line(self, line):
+        self.n_lines += 1
+        m = LINE_RE.match(line)
+        if not m:
+            self.n_unparsed += 1
+            return
+        minute, seconds, who, level, msg = m.groups()
+        t = self.epoch(minute)
+        counters = self.minutes.get(t)
+        if counters is None:
+            counters = self.minutes[t] = Minute()
+        counters.levels[level] += 1
+
+        kind = None
+        if 'slow' in msg:
+            slow = parse_slow(who, msg)
+            if slow:
+                kind = 'slow'
+                age, osds, _ = slow
+                counters.slow += 1
+                counters.slow_max_age = max(counters.slow_max_age, age)
+                for osd in osds:
+                    counters.slow_osds[str(osd)] += 1
+        elif 'osd.' in msg and 'pgmap' not in msg:
+            for osd_kind, regex in OSD_RES:
+                if regex.search(msg):
+                    kind = 'osd'
+                    counters.osd_events[osd_kind] += 1
+                    break
+        elif 'election' in msg or 'leader' in msg:
+            if ELECTION_RE.search(msg):
+                kind = 'election'
+                counters.elections += 1
+
+        if kind:
+            self.events.append([t + int(seconds), kind, line])
+
+    def expire(self, now=None):
+        """ Drop what is older than the window, and the oldest events beyond max_events """
+        oldest = (now or time.time()) - self.window
+        for t in [t for t in self.minutes if t < oldest]:
+            del self.minutes[t]
+        self.events = [event for event in self.events if event[0] >= oldest][-self.max_events:]
+
+    def summary(self, since):
+        """ The counters and events of the minutes starting at or after since """
+        total = Minute()
+        for t, counters in self.minutes.iteritems():
+            if t >= since - 59:
+                total.add(counters)
+        events = dict((kind, []) for kind in EVENT_KINDS)
+        for t, kind, line in self.events:
+            if t >= since:
+                events[kind].append(line)
+        return total, events
+
+
+def open_log(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.BZ2File(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_head(path):
+    """ The first line identifies a log file across renames and compression """
+    try:
+        f = open_log(path)
+        try:
+            return f.readline(HEAD_SIZE)
+        finally:
+            f.close()
+    except (IOError, EOFError):
+        return ''
+
+
+def read_lines(path, offset, final, align=False):
+    """ Yield (lines, offset after them) from offset on, in chunks.
+
+        Unless the file is final, an unterminated last line is left for the next run.
+        With align, the partial line at offset is skipped.
+    """
+    f = open_log(path)
+    try:
+        if align and offset > 0:
+            f.seek(offset - 1)
+            f.readline()
+            yield [], f.tell()
+        else:
+            f.seek(offset)
+        carry = ''
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            data = carry + data
+            end = data.rfind('\n')
+            if end < 0:
+                carry = data
+                continue
+            carry = data[end + 1:]
+            yield data[:end].split('\n'), f.tell() - len(carry)
+        if carry and final:
+            yield [carry], f.tell()
+    finally:
+        f.close()
+
+
+def pending_sources(path, checkpoint, first_run_bytes):
+    """ [(path, offset, final, align)] still to be read, oldest first """
+    st = os.stat(path)
+    head = read_head(path)
+    if not checkpoint:
+        return [(path, max(0, st.st_size - first_run_bytes), False, True)]
+    if checkpoint['inode'] == st.st_ino and checkpoint['head'] == head and st.st_size >= checkpoint['offset']:
+        return [(path, checkpoint['offset'], False, False)]
+
+    # rotated (renamed, maybe compressed) or truncated after a copy: find the file
+    # we were reading, then read everything that was rotated after it
+    sources = []
+    if checkpoint['head']:
+        rotated = sorted(glob.glob(path + '[.-]*'), key=os.path.getmtime)
+        for i, candidate in enumerate(rotated):
+            if read_head(candidate) == checkpoint['head']:
+                sources.append((candidate, checkpoint['offset'], True, False))
+                sources.extend((newer, 0, True, False) for newer in rotated[i + 1:])
+                break
+        else:
+            logger.warning("%s was rotated and the previous file was not found, some lines were missed", path)
+    sources.append((path, 0, False, False))
+    return sources
+
+
+def load_state(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except IOError:
+        return {}
+    except ValueError:
+        logger.warning("Ignoring the corrupt state file %s", filename)
+        return {}
+
+
+def save_state(filename, state):
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.rename(tmp, filename)
+
+
+def update(path, state, analyzer, first_run_bytes):
+    """ Feed the new lines of path to analyzer; returns the new checkpoint and the number of bytes read """
+    checkpoint = state.get('log')
+    n_bytes = 0
+    for source, offset, final, align in pending_sources(path, checkpoint, first_run_bytes):
+        logger.debug("Reading %s from %d", source, offset)
+        end = offset
+        for lines, end in read_lines(source, offset, final, align):
+            for line in lines:
+                analyzer.add_line(line)
+        n_bytes += max(0, end - offset)
+        if not final:
+            checkpoint = {'path': path, 'inode': os.stat(path).st_ino, 'head': read_head(path), 'offset': end}
+    return checkpoint, n_bytes
+
+
+def report(total, events, max_lines=50):
+    """ The hourly ceph-health-cron report """
+    out = []
+
+    def lines(title, kind):
+        if events[kind]:
+            out.append(title)
+            out.extend(events[kind][:max_lines])
+            if len(events[kind]) > max_lines:
+                out.append('... and %d more' % (len(events[kind]) - max_lines))
+            out.append('')
+
+    warnings = sum(count for level, count in total.levels.iteritems() if level != 'INF')
+    if warnings:
+        out.append('Warnings in ceph.log: %d (%s)' % (warnings, ', '.join(
+            '%s %d' % (level, total.levels[level]) for level in LEVELS if level != 'INF' and total.levels.get(level))))
+        out.append('')
+    if total.osd_events:
+        out.append('OSD events: %s' % ', '.join(
+            '%s %d' % (kind, total.osd_events[kind]) for kind in OSD_EVENTS if total.osd_events.get(kind)))
+    lines('Out/Down/Failed/Booted OSDs:', 'osd')
+    if total.slow:
+        top = sorted(total.slow_osds.iteritems(), key=lambda item: -item[1])[:10]
+        out.append('Slow requests: %d warnings, oldest blocked for %.1fs, most implicated: %s' % (
+            total.slow, total.slow_max_age, ', '.join('osd.%s (%d)' % item for item in top) or 'none'))
+    lines('Slow Requests:', 'slow')
+    lines('Monitor Elections:', 'election')
+    return '\n'.join(out)
+
+
+def metrics(total, n_bytes, n_lines, lag):
+    samples = [('ceph_log_messages', {'level': level}, total.levels.get(level, 0)) for level in LEVELS]
+    samples += [('ceph_log_osd_events', {'event': kind[4:]}, total.osd_events.get(kind, 0)) for kind in OSD_EVENTS]
+    samples += [
+        ('ceph_log_slow_request_warnings', {}, total.slow),
+        ('ceph_log_slow_request_oldest_seconds', {}, total.slow_max_age),
+        ('ceph_log_elections', {}, total.elections),
+    ]
+    samples += [('ceph_log_slow_request_warnings_by_osd', {'osd': 'osd.%s' % osd}, count)
+                for osd, count in sorted(total.slow_osds.iteritems(), key=lambda item: int(item[0]))]
+    samples += [
+        ('ceph_log_analyzer_bytes_read', {}, n_bytes),
+        ('ceph_log_analyzer_lines_read', {}, n_lines),
+        ('ceph_log_analyzer_lag_seconds', {}, '%.3f' % lag),
+    ]
+    return render(samples)
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-l", "--log", dest="log", default="/var/log/ceph/ceph.log",
+                      help="The cluster log (default: %default)")
+    parser.add_option("-s", "--state", dest="state", default="/var/lib/ceph/ceph-log-analyzer.json",
+                      help="Checkpoint and rolling counters (default: %default)")
+    parser.add_option("-w", "--window", dest="window", type="int", default=86400,
+                      help="Seconds of counters and notable lines to keep (default: %default)")
+    parser.add_option("--max-events", dest="max_events", type="int", default=10000,
+                      help="Notable lines to keep (default: %default)")
+    parser.add_option("--first-run-bytes", dest="first_run_bytes", type="int", default=64 << 20,
+                      help="Without a checkpoint, start this many bytes before the end of the log (default: %default)")
+    parser.add_option("-r", "--report", dest="report", type="int", metavar="SECONDS",
+                      help="Print the report of the last SECONDS")
+    parser.add_option("--json", dest="json", default=False, action="store_true",
+                      help="Print the counters and notable lines of the last --report seconds as JSON")
+    parser.add_option("-m", "--metrics", dest="metrics", metavar="FILE",
+                      help="Write Prometheus metrics of the last --metrics-window seconds to FILE, - for stdout")
+    parser.add_option("--metrics-window", dest="metrics_window", type="int", default=3600,
+                      help="(default: %default)")
+    parser.add_option("-q", "--quiet", dest="quiet", default=False, action="store_true",
+                      help="Only update the state")
+    parser.add_option("-v", "--verbose", dest="verbose", default=False, action="store_true")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if options.verbose else logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    start = time.time()
+    state = load_state(options.state)
+    analyzer = LogAnalyzer(options.window, options.max_events, state.get('minutes'), state.get('events'))
+    checkpoint, n_bytes = update(options.log, state, analyzer, options.first_run_bytes)
+    now = time.time()
+    analyzer.expire(now)
+    save_state(options.state, {
+        'log': checkpoint,
+        'minutes': dict((t, counters.to_json()) for t, counters in analyzer.minutes.iteritems()),
+        'events': analyzer.events,
+    })
+    logger.debug("Read %d bytes, %d lines (%d unparsed) in %.2fs",
+                 n_bytes, analyzer.n_lines, analyzer.n_unparsed, now - start)
+
+    if options.metrics:
+        total, _ = analyzer.summary(now - options.metrics_window)
+        text = metrics(total, n_bytes, analyzer.n_lines, now - start)
+        if options.metrics == '-':
+            sys.stdout.write(text)
+        else:
+            save_tmp = options.metrics + '.tmp'
+            with open(save_tmp, 'w') as f:
+                f.write(text)
+            os.rename(save_tmp, options.metrics)
+
+    if options.quiet:
+        sys.exit(0)
+    total, events = analyzer.summary(now - (options.report or 3600))
+    if options.json:
+        print json.dumps({'since': int(now - (options.report or 3600)), 'counters': total.to_json(),
+                          'events': events}, indent=2)
+    else:
+        text = report(total, events)
+        if text:
+            print text
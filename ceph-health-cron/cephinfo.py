@@ -0,0 +1 @@
+../cephinfo/cephinfo.py
\ No newline at end of file
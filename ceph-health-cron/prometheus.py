@@ -0,0 +1 @@
+../cephinfo/prometheus.py
\ No newline at end of file
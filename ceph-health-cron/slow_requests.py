@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+#
+# slow_requests.py
+#
+# Attribute the slow requests in the cluster log to OSDs, hosts, racks, disks and PGs.
+#
+# Slow request and blocked op warnings are parsed from ceph.log (incrementally, with the
+# same checkpoint handling as ceph_log_analyzer.py) or from any number of old, possibly
+# compressed, logs. Per OSD and per PG a decay-weighted score is kept, plus hourly
+# counters per OSD for the retention period, in one JSON store. Hosts and racks are
+# ranked by the summed scores of their OSDs, as placed by the current CRUSH tree.
+#
+# The warnings of old logs which are at or after the start of the followed ceph.log are
+# skipped, as they were already counted from it, and the other way round. An old log must
+# only be given once, its warnings are not recognised when it is read again.
+#
+# Chronic offenders (a high score, and slow in many distinct hours) can be written to a
+# suspect list for ceph-gentle-drain -f.
+#
+# Usage:
+#
+#   slow_requests.py [--suspects FILE] [old logfile[.gz] ...]
+#
+# Example usage:
+#
+#   ./slow_requests.py /var/log/ceph/ceph.log-2020*.gz     # backfill from months of logs
+#   ./slow_requests.py --devices --top 20                  # catch up with ceph.log and rank
+#   ./slow_requests.py --quiet --suspects /var/lib/ceph/slow-suspects
+#   ../tools/drain/ceph-gentle-drain -f /var/lib/ceph/slow-suspects -l 50 -b 30
+#
+
+from collections import defaultdict
+from optparse import OptionParser
+import json
+import logging
+import math
+import os
+import sys
+import time
+
+from ceph_log_analyzer import LINE_RE, log_epoch, load_state, parse_slow, read_lines, save_state, update
+import cephinfo
+
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+DAY = 86400
+
+
+class DecayedCounter(object):
+    """ Exponentially decayed scores per key; a weight added half_life ago counts for half.
+
+        Only the max_keys best scores are kept, so memory stays bounded however many
+        keys (e.g. PGs) are seen.
+    """
+
+    def __init__(self, half_life, max_keys=None, data=None):
+        self.half_life = float(half_life)
+        self.max_keys = max_keys
+        self.scores = dict((key, list(value)) for key, value in (data or {}).iteritems())
+
+    def add(self, key, t, weight=1.0):
+        try:
+            entry = self.scores[key]
+        except KeyError:
+            self.scores[key] = [weight, t]
+            if self.max_keys and len(self.scores) > 2 * self.max_keys:
+                self.prune(t)
+            return
+        score, last = entry
+        if t >= last:
+            entry[0] = score * math.pow(2, -(t - last) / self.half_life) + weight
+            entry[1] = t
+        else:
+            # lines from an older log read later
+            entry[0] = score + weight * math.pow(2, -(last - t) / self.half_life)
+
+    def value(self, key, now):
+        score, last = self.scores[key]
+        return score * math.pow(2, -max(0, now - last) / self.half_life)
+
+    def prune(self, now):
+        keep = sorted(self.scores, key=lambda key: -self.value(key, now))[:self.max_keys]
+        self.scores = dict((key, self.scores[key]) for key in keep)
+
+    def top(self, now, n=None):
+        ranked = sorted(((key, self.value(key, now)) for key in self.scores), key=lambda item: -item[1])
+        return ranked[:n] if n else ranked
+
+
+class SlowRequestStore(object):
+    """ Decayed scores per OSD and PG, and hourly [warnings, max age] per OSD
+
+        The followed log is counted from followed_since on, and old logs up to
+        backfilled_until: a warning is only counted from one of them.
+    """
+
+    def __init__(self, half_life=7 * DAY, retention=30 * DAY, max_pgs=10000, data=None):
+        data = data or {}
+        self.retention = retention
+        self.osds = DecayedCounter(half_life, data=dict(
+            (int(osd), value) for osd, value in data.get('osds', {}).iteritems()))
+        self.pgs = DecayedCounter(half_life, max_pgs, data.get('pgs'))
+        self.hours = dict((int(hour), dict((int(osd), value) for osd, value in osds.iteritems()))
+                          for hour, osds in data.get('hours', {}).iteritems())
+        self.latest = data.get('latest', 0)
+        self.followed_since = data.get('followed_since')
+        self.backfilled_until = data.get('backfilled_until', 0)
+        # set while reading old logs rather than following ceph.log
+        self.backfilling = False
+        self.n_warnings = 0
+        self.n_skipped = 0
+
+    def add_line(self, line):
+        if 'slow' not in line:
+            return
+        m = LINE_RE.match(line)
+        if not m:
+            return
+        minute, seconds, who, level, msg = m.groups()
+        slow = parse_slow(who, msg)
+        if not slow:
+            return
+        t = log_epoch(minute) + int(seconds)
+        if self.backfilling:
+            if self.followed_since is not None and t >= self.followed_since:
+                self.n_skipped += 1
+                return
+            self.backfilled_until = max(self.backfilled_until, t)
+        else:
+            if t <= self.backfilled_until:
+                self.n_skipped += 1
+                return
+            if self.followed_since is None:
+                self.followed_since = t
+        self.add(t, *slow)
+
+    def add(self, t, age, osds, pg=None):
+        self.n_warnings += 1
+        self.latest = max(self.latest, t)
+        hour = self.hours.setdefault(t - t % HOUR, {})
+        for osd in osds:
+            self.osds.add(osd, t)
+            counters = hour.setdefault(osd, [0, 0.0])
+            counters[0] += 1
+            counters[1] = max(counters[1], age)
+        if pg:
+            self.pgs.add(pg, t)
+
+    def expire(self):
+        oldest = self.latest - self.retention
+        for hour in [hour for hour in self.hours if hour < oldest]:
+            del self.hours[hour]
+        self.pgs.prune(self.latest)
+
+    def osd_history(self, since):
+        """ {osd: [warnings, distinct hours with warnings, max age]} since then """
+        history = defaultdict(lambda: [0, 0, 0.0])
+        for hour, osds in self.hours.iteritems():
+            if hour < since:
+                continue
+            for osd, (warnings, age) in osds.iteritems():
+                entry = history[osd]
+                entry[0] += warnings
+                entry[1] += 1
+                entry[2] = max(entry[2], age)
+        return history
+
+    def to_json(self):
+        return {
+            'latest': self.latest,
+            'followed_since': self.followed_since,
+            'backfilled_until': self.backfilled_until,
+            'osds': self.osds.scores,
+            'pgs': self.pgs.scores,
+            'hours': self.hours,
+        }
+
+
+def crush_locations(nodes):
+    """ {osd id: {bucket type: bucket name}} and {osd id: crush weight} from the osd tree nodes """
+    by_id = dict((node['id'], node) for node in nodes)
+    parents = {}
+    for node in nodes:
+        for child in node.get('children', []):
+            parents[child] = node['id']
+    locations = {}
+    weights = {}
+    for node in nodes:
+        if node['type'] != 'osd':
+            continue
+        location = {}
+        parent = parents.get(node['id'])
+        while parent is not None:
+            location[by_id[parent]['type']] = by_id[parent]['name']
+            parent = parents.get(parent)
+        locations[node['id']] = location
+        weights[node['id']] = float(node.get('crush_weight', 0))
+    return locations, weights
+
+
+def get_devices():
+    """ {osd id: 'host:device'} from the OSD metadata index """
+    index = cephinfo.get_osd_index()
+    return dict((osd, '%s:%s' % (metadata.get('hostname', '?'), ','.join(cephinfo.osd_devices(metadata)) or '?'))
+                for osd, metadata in index.metadata.iteritems())
+
+
+def rank_buckets(osd_scores, locations, bucket_type):
+    scores = defaultdict(float)
+    for osd, score in osd_scores:
+        scores[locations.get(osd, {}).get(bucket_type, 'unknown')] += score
+    return sorted(scores.iteritems(), key=lambda item: -item[1])
+
+
+def rank_pools(pg_scores):
+    scores = defaultdict(float)
+    for pg, score in pg_scores:
+        scores[pg.split('.')[0]] += score
+    return sorted(scores.iteritems(), key=lambda item: -item[1])
+
+
+def find_suspects(store, weights, now, min_score, min_hours, max_suspects):
+    """ The chronic offenders: a high score, slow in many distinct hours, and not drained yet """
+    history = store.osd_history(now - store.retention)
+    suspects = []
+    for osd, score in store.osds.top(now):
+        if score < min_score or len(suspects) >= max_suspects:
+            break
+        if history.get(osd, [0, 0])[1] < min_hours or not weights.get(osd, 1.0):
+            continue
+        suspects.append((osd, score))
+    return suspects
+
+
+def write_suspects(filename, suspects, history, locations):
+    with open(filename + '.tmp', 'w') as f:
+        f.write('# suspect OSDs by slow requests, %s\n' % time.strftime('%Y-%m-%d %H:%M:%S'))
+        for osd, score in suspects:
+            f.write('osd.%d  # score %.1f, %d warnings in %d hours, host %s\n' % (
+                osd, score, history[osd][0], history[osd][1], locations.get(osd, {}).get('host', 'unknown')))
+    os.rename(filename + '.tmp', filename)
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.usage = "%prog [options] [old logfile[.gz] ...]"
+    parser.add_option("-l", "--log", dest="log", default="/var/log/ceph/ceph.log",
+                      help="The cluster log to follow when no files are given (default: %default)")
+    parser.add_option("-s", "--store", dest="store", default="/var/lib/ceph/slow-requests.json",
+                      help="Scores, hourly counters and the log checkpoint (default: %default)")
+    parser.add_option("--half-life", dest="half_life", type="float", default=7,
+                      help="Days after which a slow request counts half in the scores (default: %default)")
+    parser.add_option("--retention", dest="retention", type="float", default=30,
+                      help="Days of hourly counters to keep (default: %default)")
+    parser.add_option("--max-pgs", dest="max_pgs", type="int", default=10000,
+                      help="PG scores to keep (default: %default)")
+    parser.add_option("--first-run-bytes", dest="first_run_bytes", type="int", default=64 << 20,
+                      help="Without a checkpoint, start this many bytes before the end of the log (default: %default)")
+    parser.add_option("-n", "--top", dest="top", type="int", default=10,
+                      help="Rows per ranking (default: %default)")
+    parser.add_option("--devices", dest="devices", default=False, action="store_true",
+                      help="Show the disk of every OSD (from the cephinfo osd index)")
+    parser.add_option("--json", dest="json", default=False, action="store_true",
+                      help="Print the rankings as JSON")
+    parser.add_option("--suspects", dest="suspects", metavar="FILE",
+                      help="Write the suspect OSDs to FILE, for ceph-gentle-drain -f")
+    parser.add_option("--min-score", dest="min_score", type="float", default=50,
+                      help="Minimum score of a suspect (default: %default)")
+    parser.add_option("--min-hours", dest="min_hours", type="int", default=24,
+                      help="Minimum distinct hours with slow requests of a suspect, "
+                           "within the retention (default: %default)")
+    parser.add_option("--max-suspects", dest="max_suspects", type="int", default=4,
+                      help="(default: %default)")
+    parser.add_option("-q", "--quiet", dest="quiet", default=False, action="store_true",
+                      help="Do not print the rankings")
+    parser.add_option("-v", "--verbose", dest="verbose", default=False, action="store_true")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if options.verbose else logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    start = time.time()
+    state = load_state(options.store)
+    store = SlowRequestStore(options.half_life * DAY, options.retention * DAY, options.max_pgs, state)
+    checkpoint = state.get('log')
+    if args:
+        store.backfilling = True
+        for filename in args:
+            for lines, _ in read_lines(filename, 0, True):
+                for line in lines:
+                    store.add_line(line)
+                store.expire()
+        # old logs: rank as of their last warning
+        now = store.latest
+    else:
+        checkpoint, _ = update(options.log, state, store, options.first_run_bytes)
+        now = time.time()
+    store.expire()
+    data = store.to_json()
+    data['log'] = checkpoint
+    save_state(options.store, data)
+    logger.debug("Parsed %d slow request warnings in %.2fs, skipped %d already counted", store.n_warnings,
+                 time.time() - start, store.n_skipped)
+
+    cephinfo.init_crush()
+    locations, weights = crush_locations(cephinfo.crush_data['nodes'])
+    devices = get_devices() if options.devices else {}
+    history = store.osd_history(now - store.retention)
+    osd_scores = store.osds.top(now)
+    suspects = find_suspects(store, weights, now, options.min_score, options.min_hours, options.max_suspects)
+    if options.suspects:
+        write_suspects(options.suspects, suspects, history, locations)
+
+    if options.quiet:
+        sys.exit(0)
+
+    osds = [{
+        'osd': osd,
+        'score': score,
+        'warnings': history.get(osd, [0, 0, 0.0])[0],
+        'hours': history.get(osd, [0, 0, 0.0])[1],
+        'max_age': history.get(osd, [0, 0, 0.0])[2],
+        'host': locations.get(osd, {}).get('host', 'unknown'),
+        'rack': locations.get(osd, {}).get('rack', 'unknown'),
+        'device': devices.get(osd, ''),
+    } for osd, score in osd_scores[:options.top]]
+    rankings = [
+        ('host', rank_buckets(osd_scores, locations, 'host')[:options.top]),
+        ('rack', rank_buckets(osd_scores, locations, 'rack')[:options.top]),
+        ('pg', store.pgs.top(now, options.top)),
+        ('pool', rank_pools(store.pgs.top(now))[:options.top]),
+    ]
+
+    if options.json:
+        output = {'time': int(now), 'osds': osds, 'suspects': [suspect for suspect, _score in suspects]}
+        for kind, ranking in rankings:
+            output[kind + 's'] = [{kind: key, 'score': score} for key, score in ranking]
+        print json.dumps(output, indent=2)
+        sys.exit(0)
+
+    print "Slow requests as of %s (half-life %g days, last %g days of counters)" % (
+        time.strftime('%Y-%m-%d %H:%M', time.localtime(now)), options.half_life, options.retention)
+    print
+    print "%-10s %8s %8s %6s %8s  %-24s %-16s %s" % ('OSD', 'SCORE', 'WARN', 'HOURS', 'MAX_AGE', 'HOST', 'RACK', 'DEVICE')
+    for row in osds:
+        print "%-10s %8.1f %8d %6d %8.1f  %-24s %-16s %s" % (
+            'osd.%d' % row['osd'], row['score'], row['warnings'], row['hours'], row['max_age'],
+            row['host'], row['rack'], row['device'])
+    for kind, ranking in rankings:
+        print
+        print "%-32s %8s" % (kind.upper(), 'SCORE')
+        for key, score in ranking:
+            print "%-32s %8.1f" % (key, score)
+    print
+    print "Suspects: %s" % (', '.join('osd.%d' % suspect for suspect, _score in suspects) or 'none')
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tools are scripts, not a package: import them from their directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,68 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+from ceph_log_analyzer import EVENT_KINDS, LogAnalyzer, update
+
+
+def test_classify():
+    analyzer = LogAnalyzer()
+    for line in [
+        '2020-04-20 10:00:01.123456 osd.12 osd.12 10.0.0.1:6800/1234 5 : cluster [WRN] 3 slow requests, '
+        '1 included below; oldest blocked for > 30.123456 secs',
+        '2020-04-20 10:00:02.000000 osd.12 osd.12 10.0.0.1:6800/1234 6 : cluster [WRN] slow request 34.5 seconds old, '
+        'received at 2020-04-20 09:59:27.5: osd_op(client.1.0:1 4.3f rbd_data.1 [write 0~4096]) currently waiting',
+        '2020-04-20 10:00:03.000000 mon.a mon.0 10.0.0.2:6789/0 7 : cluster [WRN] Health check update: '
+        '5 slow requests are blocked > 32 sec. Implicated osds 3,12 (REQUEST_SLOW)',
+        '2020-04-20 10:01:00.000000 mon.a (mon.0) 8 : cluster [INF] osd.7 marked itself down',
+        '2020-04-20 10:01:01.000000 mon.a (mon.0) 9 : cluster [INF] osd.7 10.0.0.3:6800/99 boot',
+        '2020-04-20 10:01:02.000000 mon.a (mon.0) 10 : cluster [INF] osd.8 failed (root=default,host=x) '
+        '(2 reporters from different host after 20.0 >= grace 20.0)',
+        '2020-04-20 10:01:03.000000 mon.a (mon.0) 11 : cluster [DBG] pgmap v1: 10 pgs: osd.1 down',
+        '2020-04-20T10:02:00.000000+0200 mon.b (mon.1) 12 : cluster [INF] mon.b calling monitor election',
+        '2020-04-20 10:02:01.000000 mon.a (mon.0) 13 : cluster [ERR] Health check failed: 1 scrub errors (OSD_SCRUB_ERRORS)',
+        'garbage',
+    ]:
+        analyzer.add_line(line)
+    assert analyzer.n_lines == 10 and analyzer.n_unparsed == 1
+    total, events = analyzer.summary(0)
+    assert total.slow == 3 and total.slow_max_age == 34.5
+    assert total.slow_osds == {'12': 3, '3': 1}
+    assert total.osd_events == {'osd_down': 1, 'osd_boot': 1, 'osd_failed': 1}
+    assert total.elections == 1
+    assert total.levels == {'WRN': 3, 'INF': 4, 'DBG': 1, 'ERR': 1}
+    assert [len(events[kind]) for kind in EVENT_KINDS] == [3, 3, 1]
+    start = analyzer.epoch('2020-04-20 10:01')
+    total, events = analyzer.summary(start)
+    assert total.slow == 0 and len(events['osd']) == 3
+
+
+def test_rotation():
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'ceph.log')
+        line = '2020-04-20 10:00:%02d.000000 mon.a (mon.0) 1 : cluster [WRN] line %d\n'
+        with open(path, 'w') as f:
+            f.write(line % (0, 0) + line % (1, 1) + 'partial')
+        state = {}
+        analyzer = LogAnalyzer(window=1e12)
+        state['log'], _ = update(path, state, analyzer, 1 << 20)
+        assert analyzer.n_lines == 2
+
+        # the partial line is completed, then the log is rotated and compressed
+        with open(path, 'a') as f:
+            f.write(' line\n' + line % (2, 2))
+        with open(path) as f, gzip.open(path + '.1.gz', 'wb') as gz:
+            gz.write(f.read())
+        os.unlink(path)
+        with open(path, 'w') as f:
+            f.write(line % (3, 3))
+        state['log'], _ = update(path, state, analyzer, 1 << 20)
+        assert analyzer.n_lines == 5
+        assert analyzer.summary(0)[0].levels['WRN'] == 4
+
+        state['log'], n_bytes = update(path, state, analyzer, 1 << 20)
+        assert analyzer.n_lines == 5 and n_bytes == 0
+    finally:
+        shutil.rmtree(tmp)
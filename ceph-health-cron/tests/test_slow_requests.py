@@ -0,0 +1,62 @@
+import json
+
+from ceph_log_analyzer import log_epoch
+from slow_requests import DAY, DecayedCounter, HOUR, SlowRequestStore, crush_locations, find_suspects
+
+
+def test_decayed_counter():
+    counter = DecayedCounter(10, max_keys=2)
+    counter.add('a', 0)
+    counter.add('a', 10)
+    assert counter.value('a', 10) == 1.5
+    assert counter.value('a', 20) == 0.75
+    counter.add('a', 0)
+    assert counter.value('a', 10) == 2.0
+    for key in 'bcde':
+        counter.add(key, 100)
+    assert len(counter.scores) == 2 and 'a' not in counter.scores
+
+
+def test_store():
+    store = SlowRequestStore(half_life=DAY, retention=2 * HOUR)
+    store.add_line('2020-04-20 10:00:01.1 osd.1 osd.1 1.2.3.4:6800/1 5 : cluster [WRN] 3 slow requests, '
+                   '1 included below; oldest blocked for > 30.1 secs')
+    store.add_line('2020-04-20 10:00:02.1 osd.1 osd.1 1.2.3.4:6800/1 6 : cluster [WRN] slow request 31.0 seconds old, '
+                   'received at x: osd_op(client.1.0:1 4.3f rbd_data.1 [write 0~4096]) currently waiting')
+    store.add_line('2020-04-20 12:30:00.0 mon.a (mon.0) 7 : cluster [WRN] Health check update: 5 slow requests '
+                   'are blocked > 32 sec. Implicated osds 1,2 (REQUEST_SLOW)')
+    store.add_line('2020-04-20 12:30:01.0 mon.a (mon.0) 8 : cluster [INF] osd.3 boot')
+    assert store.n_warnings == 3
+    assert [osd for osd, _ in store.osds.top(store.latest)] == [1, 2]
+    assert store.pgs.scores.keys() == ['4.3f']
+    history = store.osd_history(0)
+    assert history[1] == [3, 2, 32.0] and history[2] == [1, 1, 32.0]
+    store.expire()
+    assert store.osd_history(0)[1] == [1, 1, 32.0]
+    store = SlowRequestStore(data=json.loads(json.dumps(store.to_json())))
+    assert store.osd_history(0)[1] == [1, 1, 32.0] and store.osds.scores[1][0] > 2
+
+    # an old log overlapping the followed one only adds the warnings before it
+    store = SlowRequestStore(half_life=DAY, retention=30 * DAY)
+    followed = '2020-04-20 %s osd.1 osd.1 1.2.3.4:6800/1 5 : cluster [WRN] 3 slow requests, ' \
+        '1 included below; oldest blocked for > 30.1 secs'
+    store.add_line(followed % '10:00:01.1')
+    store.backfilling = True
+    for t in ('09:00:01.1', '10:00:01.1', '10:30:01.1'):
+        store.add_line(followed % t)
+    assert store.n_warnings == 2 and store.n_skipped == 2
+    # and the other way round, from a state which was only backfilled
+    store = SlowRequestStore(data=json.loads(json.dumps({'backfilled_until': store.backfilled_until})))
+    store.add_line(followed % '09:00:01.1')
+    store.add_line(followed % '11:00:01.1')
+    assert store.n_warnings == 1 and store.followed_since == log_epoch('2020-04-20 11:00') + 1
+
+    locations, weights = crush_locations([
+        {'id': -1, 'name': 'default', 'type': 'root', 'children': [-2]},
+        {'id': -2, 'name': 'rack1', 'type': 'rack', 'children': [-3]},
+        {'id': -3, 'name': 'host1', 'type': 'host', 'children': [1, 2]},
+        {'id': 1, 'name': 'osd.1', 'type': 'osd', 'crush_weight': 1.0},
+        {'id': 2, 'name': 'osd.2', 'type': 'osd', 'crush_weight': 0.0},
+    ])
+    assert locations[1] == {'host': 'host1', 'rack': 'rack1', 'root': 'default'}
+    assert find_suspects(store, weights, store.latest, 0.5, 1, 10) == [(1, store.osds.value(1, store.latest))]
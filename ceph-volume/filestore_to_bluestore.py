@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+#
+# filestore_to_bluestore.py
+#
+# Convert filestore OSDs created by ceph-disk to bluestore OSDs made by ceph-volume,
+# across many hosts at once, within a cluster-wide safety budget.
+#
+# The unit of work is a group: one OSD, or all the OSDs sharing a journal SSD (the SSD can
+# only be repartitioned for their block.db once all of them are destroyed). A group goes
+#
+#   planned -> draining (marked out) -> destroying -> creating -> done (marked in)
+#
+# New groups are only marked out while the OSDs not yet back in stay within --max-down,
+# the groups span at most --max-hosts hosts, nothing is degraded, and backfilling and
+# misplaced objects are below --max-backfilling and --max-misplaced. One
+# 'ceph osd safe-to-destroy' call checks every draining OSD each round. The stop, zap and
+# create steps run on the OSD hosts over ssh on a pool of workers, so some groups are
+# recreated while others are still draining. A journal SSD is only wiped when ceph-disk
+# lists nothing else on it than the journals of its group: a group whose SSD also holds
+# the journal of an OSD not being converted is refused.
+#
+# The progress is saved in --state after every change, down to every OSD destroyed or
+# created, and a run picks up where the last one stopped: the OSDs already destroyed or
+# created are skipped, and a journal SSD checked before its first OSD was destroyed is not
+# checked again (its journals no longer resolve to their OSDs once those are zapped). A failed step stops new groups from starting until it is fixed by hand
+# and --retry is given.
+#
+# Usage:
+#
+#   filestore_to_bluestore.py [--host HOST ...] [--bucket TYPE=NAME ...] [--max-down N] [--really]
+#
+# Example usage:
+#
+#   ./filestore_to_bluestore.py --bucket rack=RA09              # show the plan
+#   ./filestore_to_bluestore.py --bucket rack=RA09 --max-down 48 --max-hosts 6 --really
+#   ./filestore_to_bluestore.py --host $(hostname -s) --really   # this host only, like the old scripts
+#
+
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+import commands
+import json
+import logging
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from cephinfo import cephinfo
+
+logger = logging.getLogger(__name__)
+
+PLANNED, DRAINING, DESTROYING, CREATING, DONE, FAILED = \
+    'planned', 'draining', 'destroying', 'creating', 'done', 'failed'
+# the states in which the OSDs of a group are out of the cluster
+DOWN_STATES = (DRAINING, DESTROYING, CREATING, FAILED)
+
+LOCAL_HOSTS = set([None, 'localhost', socket.gethostname(), socket.gethostname().split('.')[0]])
+
+
+def run(cmd, host=None, ssh='ssh -o BatchMode=yes', really=True):
+    """ (exit status, output) of a shell command, over ssh unless host is this host """
+    if host not in LOCAL_HOSTS:
+        cmd = '%s %s%s' % (ssh, host, commands.mkarg(cmd))
+    if not really:
+        logger.info("Would run: %s", cmd)
+        return 0, ''
+    logger.info("Running: %s", cmd)
+    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    return process.returncode, output
+
+
+def parent_device(path):
+    """ /dev/sda1 -> /dev/sda, /dev/nvme0n1p2 -> /dev/nvme0n1 """
+    m = re.match(r'(.*\d+n\d+)p\d+$', path)
+    if m:
+        return m.group(1)
+    return re.sub(r'(\D)\d+$', r'\1', path)
+
+
+def partition_path(device, number):
+    if re.search(r'\d$', device):
+        return '%sp%d' % (device, number)
+    return '%s%d' % (device, number)
+
+
+def host_osds(ceph_disk_list):
+    """ {osd id: (data disk, journal disk or None)} from 'ceph-disk list --format json' """
+    osds = {}
+    for device in ceph_disk_list:
+        for partition in device.get('partitions', []):
+            if partition.get('type') != 'data' or 'whoami' not in partition:
+                continue
+            data = parent_device(partition['path'])
+            journal = partition.get('journal_dev')
+            if journal:
+                journal = parent_device(journal)
+                if journal == data:
+                    journal = None
+            osds[int(partition['whoami'])] = (data, journal)
+    return osds
+
+
+def journal_users(ceph_disk_list):
+    """ {disk: [the OSD id of each journal partition, or the path of any other partition]} """
+    whoami = {}
+    for device in ceph_disk_list:
+        for partition in device.get('partitions', []):
+            if partition.get('type') == 'data' and 'whoami' in partition:
+                whoami[partition['path']] = int(partition['whoami'])
+    users = {}
+    for device in ceph_disk_list:
+        users[device['path']] = [whoami.get(partition.get('journal_for'), partition['path'])
+                                 if partition.get('type') == 'journal' else partition['path']
+                                 for partition in device.get('partitions', [])]
+    return users
+
+
+def foreign_users(group, users):
+    """ What else than the journals of the group is on its journal SSD """
+    return [user for user in users.get(group['journal'], []) if str(user) not in group['osds']]
+
+
+def make_groups(host, filestore_osds, devices, users):
+    """ One group per journal SSD, and one per OSD without a separate journal
+
+        A journal SSD also holding the journal of an OSD which is not converted, or
+        anything else, cannot be wiped: its group is refused (failed) right away.
+    """
+    groups = []
+    by_journal = defaultdict(dict)
+    for osd in sorted(filestore_osds):
+        if osd not in devices:
+            logger.warning("osd.%d is not in ceph-disk list on %s, skipping it", osd, host)
+            continue
+        data, journal = devices[osd]
+        if journal:
+            by_journal[journal][str(osd)] = data
+        else:
+            groups.append({'host': host, 'journal': None, 'osds': {str(osd): data}, 'state': PLANNED})
+    for journal in sorted(by_journal):
+        group = {'host': host, 'journal': journal, 'osds': by_journal[journal], 'state': PLANNED}
+        foreign = foreign_users(group, users)
+        if foreign:
+            group['state'] = FAILED
+            group['error'] = '%s also holds %s' % (journal, ', '.join(
+                'the journal of osd.%d' % user if isinstance(user, int) else user for user in foreign))
+            logger.error("Refusing to convert the OSDs of %s on %s: %s", journal, host, group['error'])
+        groups.append(group)
+    return groups
+
+
+def plan(index, criteria, hosts, ssh):
+    """ The groups of the filestore OSDs matching the criteria, by host """
+    osds = index.select(objectstore='filestore', **criteria)
+    by_host = defaultdict(set)
+    for osd in osds:
+        by_host[index.metadata[osd].get('hostname')].add(osd)
+    groups = []
+    for host in sorted(by_host):
+        if hosts and host not in hosts:
+            continue
+        status, output = run('ceph-disk list --format json', host, ssh)
+        try:
+            ceph_disk_list = json.loads(output)
+        except ValueError:
+            logger.error("ceph-disk list failed on %s, skipping it: %s", host, output.strip())
+            continue
+        groups.extend(make_groups(host, by_host[host], host_osds(ceph_disk_list), journal_users(ceph_disk_list)))
+    return groups
+
+
+def safe_to_destroy(osds):
+    """ The subset of osds which can be destroyed without reducing data durability, in one call """
+    if not osds:
+        return set()
+    status, output = run('ceph osd safe-to-destroy %s --format=json 2>/dev/null' % ' '.join(str(osd) for osd in osds))
+    try:
+        return set(json.loads(output).get('safe_to_destroy', [])) & set(osds)
+    except ValueError:
+        # luminous has no JSON here: all or nothing
+        return set(osds) if status == 0 else set()
+
+
+def recovery_load():
+    """ (PGs backfilling, misplaced ratio, degraded ratio) from the status pgmap """
+    pgmap = json.loads(commands.getoutput('ceph status --format=json 2>/dev/null'))['pgmap']
+    backfilling = sum(state['count'] for state in pgmap.get('pgs_by_state', [])
+                      if 'backfilling' in state['state_name'].split('+'))
+    return backfilling, pgmap.get('misplaced_ratio', 0.0), pgmap.get('degraded_ratio', 0.0)
+
+
+def destroy_group(group, ssh, really, progress=lambda: None):
+    """ Stop, destroy and zap every OSD of the group, then partition its journal SSD for block.db
+
+        Every step done is recorded in the group and saved with progress(), so that an
+        interrupted attempt is resumed rather than repeated.
+    """
+    host = group['host']
+    if group['journal'] and really and not group.get('journal_checked'):
+        # the SSD is wiped below: check again that it only holds the journals of the group
+        status, output = run('ceph-disk list --format json', host, ssh)
+        try:
+            foreign = foreign_users(group, journal_users(json.loads(output)))
+        except ValueError:
+            raise RuntimeError('ceph-disk list failed on %s: %s' % (host, output.strip()))
+        if foreign:
+            raise RuntimeError('%s also holds %s, not wiping it' % (group['journal'], ', '.join(map(str, foreign))))
+        group['journal_checked'] = True
+        progress()
+    for osd, data in sorted(group['osds'].items()):
+        if osd in group.get('destroyed', []):
+            continue
+        for cmd, where in [
+                ('systemctl stop ceph-osd@%s' % osd, host),
+                ('if mountpoint -q /var/lib/ceph/osd/ceph-%s; then umount /var/lib/ceph/osd/ceph-%s; fi' % (osd, osd), host),
+                ('ceph osd destroy %s --yes-i-really-mean-it' % osd, None),
+                ('ceph-volume lvm zap %s' % data, host)]:
+            status, output = run(cmd, where, ssh, really)
+            if status != 0:
+                raise RuntimeError('%s failed on %s: %s' % (cmd, where or 'this host', output.strip()))
+        group.setdefault('destroyed', []).append(osd)
+        progress()
+    if group['journal'] and not group.get('partitioned'):
+        ssd = group['journal']
+        n = len(group['osds'])
+        cmds = ['dd if=/dev/zero of=%s bs=1M count=10' % ssd, 'parted -s %s mklabel gpt' % ssd]
+        cmds += ['parted -s -a optimal %s mkpart primary %d%% %d%%' % (ssd, i * 100 / n, (i + 1) * 100 / n)
+                 for i in range(n)]
+        status, output = run(' && '.join(cmds), host, ssh, really)
+        if status != 0:
+            raise RuntimeError('partitioning %s failed on %s: %s' % (ssd, host, output.strip()))
+        group['partitioned'] = True
+        progress()
+
+
+def is_converted(osd):
+    """ Whether the OSD was already recreated as bluestore and is up """
+    try:
+        metadata = json.loads(commands.getoutput('ceph osd metadata %s --format=json 2>/dev/null' % osd))
+        osd_dump = json.loads(commands.getoutput('ceph osd dump --format=json 2>/dev/null'))
+    except ValueError:
+        return False
+    up = [o['up'] for o in osd_dump['osds'] if o['osd'] == int(osd)]
+    return metadata.get('osd_objectstore') == 'bluestore' and bool(up and up[0])
+
+
+def create_group(group, ssh, really, progress=lambda: None):
+    """ Recreate every OSD of the group as bluestore with the same id, and mark it in
+
+        The OSDs created by an earlier, interrupted attempt are only marked in again, as
+        'ceph-volume lvm create --osd-id' fails once the id is no longer destroyed.
+    """
+    host = group['host']
+    for i, (osd, data) in enumerate(sorted(group['osds'].items(), key=lambda item: int(item[0]))):
+        if osd in group.get('created', []) or (really and is_converted(osd)):
+            logger.info("osd.%s was already recreated", osd)
+        else:
+            cmd = 'ceph-volume lvm create --bluestore --osd-id %s --data %s' % (osd, data)
+            if group['journal']:
+                cmd += ' --block.db %s' % partition_path(group['journal'], i + 1)
+            status, output = run(cmd, host, ssh, really)
+            if status != 0:
+                raise RuntimeError('%s failed on %s: %s' % (cmd, host, output.strip()))
+            group.setdefault('created', []).append(osd)
+            progress()
+        status, output = run('ceph osd in %s' % osd, None, ssh, really)
+        if status != 0:
+            raise RuntimeError('ceph osd in %s failed: %s' % (osd, output.strip()))
+
+
+class Orchestrator(object):
+
+    def __init__(self, groups, state_file, options):
+        self.groups = groups
+        self.state_file = state_file
+        self.options = options
+        self.workers = ThreadPool(options.parallel)
+        self.running = {}
+        # the steps save their progress from the workers
+        self.lock = threading.Lock()
+
+    def save(self):
+        if not self.state_file:
+            return
+        with self.lock:
+            with open(self.state_file + '.tmp', 'w') as f:
+                json.dump(self.groups, f, indent=1)
+            os.rename(self.state_file + '.tmp', self.state_file)
+
+    def set_state(self, group, state, error=None):
+        logger.info("%s %s: %s -> %s", group['host'], ','.join('osd.%s' % osd for osd in sorted(group['osds'])),
+                    group['state'], state)
+        group['state'] = state
+        group.setdefault('times', {})[state] = time.time()
+        if error:
+            group['error'] = error
+            logger.error("%s: %s", group['host'], error)
+        self.save()
+
+    def is_down(self, group):
+        """ Groups refused by the plan are failed, but never had their OSDs out """
+        return group['state'] in DOWN_STATES and DRAINING in group.get('times', {})
+
+    def n_down(self):
+        return sum(len(group['osds']) for group in self.groups if self.is_down(group))
+
+    def active_hosts(self):
+        return set(group['host'] for group in self.groups if self.is_down(group))
+
+    def start_groups(self):
+        """ Mark out the next planned groups, as far as the budget allows """
+        if any(group['state'] == FAILED and self.is_down(group) for group in self.groups):
+            return
+        backfilling, misplaced, degraded = recovery_load()
+        if degraded > 0 or backfilling > self.options.max_backfilling or misplaced > self.options.max_misplaced:
+            logger.info("Recovery load too high to start more: %d PGs backfilling, %.1f%% misplaced, %.1f%% degraded",
+                        backfilling, misplaced * 100, degraded * 100)
+            return
+        n_down = self.n_down()
+        hosts = self.active_hosts()
+        started = []
+        for group in self.groups:
+            if group['state'] != PLANNED:
+                continue
+            if n_down + len(group['osds']) > self.options.max_down:
+                break
+            if group['host'] not in hosts and len(hosts) >= self.options.max_hosts:
+                continue
+            started.append(group)
+            n_down += len(group['osds'])
+            hosts.add(group['host'])
+        if not started:
+            return
+        osds = [osd for group in started for osd in sorted(group['osds'])]
+        status, output = run('ceph osd out %s' % ' '.join(osds), None, self.options.ssh, self.options.really)
+        if status != 0:
+            logger.error("ceph osd out failed: %s", output.strip())
+            return
+        for group in started:
+            self.set_state(group, DRAINING)
+
+    def check_draining(self):
+        draining = [group for group in self.groups if group['state'] == DRAINING]
+        osds = [int(osd) for group in draining for osd in group['osds']]
+        safe = safe_to_destroy(osds) if self.options.really else set(osds)
+        for group in draining:
+            if all(int(osd) in safe for osd in group['osds']):
+                self.set_state(group, DESTROYING)
+                self.submit(group, destroy_group)
+
+    def submit(self, group, step):
+        # the keys the step records its progress in exist before it runs, so that saving
+        # the groups never sees a dict changing size
+        for key, default in (('journal_checked', False), ('destroyed', []), ('partitioned', False),
+                             ('created', [])):
+            group.setdefault(key, default)
+        self.running[id(group)] = (group, step, self.workers.apply_async(
+            step, (group, self.options.ssh, self.options.really, self.save)))
+
+    def collect(self):
+        for key, (group, step, result) in self.running.items():
+            if not result.ready():
+                continue
+            del self.running[key]
+            try:
+                result.get()
+            except Exception as e:
+                self.set_state(group, FAILED, str(e))
+                continue
+            if step is destroy_group:
+                self.set_state(group, CREATING)
+                self.submit(group, create_group)
+            else:
+                self.set_state(group, DONE)
+
+    def resume(self):
+        """ Steps interrupted by the last run are resumed from their last saved progress """
+        for group in self.groups:
+            if group['state'] == DESTROYING:
+                self.submit(group, destroy_group)
+            elif group['state'] == CREATING:
+                self.submit(group, create_group)
+
+    def run(self):
+        self.resume()
+        while True:
+            self.collect()
+            self.check_draining()
+            self.start_groups()
+            counts = defaultdict(int)
+            for group in self.groups:
+                counts[group['state']] += len(group['osds'])
+            logger.info("OSDs: %s", ', '.join('%s %d' % (state, counts[state])
+                                             for state in (PLANNED, DRAINING, DESTROYING, CREATING, DONE, FAILED)
+                                             if counts[state]))
+            if counts[PLANNED] + counts[DRAINING] + counts[DESTROYING] + counts[CREATING] == 0:
+                return counts[FAILED] == 0
+            if not self.running and counts[DRAINING] == 0 and \
+                    any(group['state'] == FAILED and self.is_down(group) for group in self.groups):
+                return False
+            time.sleep(self.options.interval)
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("--host", dest="hosts", action="append", default=[],
+                      help="Only convert the OSDs of this host, may be repeated")
+    parser.add_option("-b", "--bucket", dest="buckets", action="append", default=[], metavar="TYPE=NAME",
+                      help="Only convert the OSDs under this CRUSH bucket, e.g. rack=RA09")
+    parser.add_option("-c", "--class", dest="device_class", help="Only convert OSDs of this device class")
+    parser.add_option("--max-down", dest="max_down", type="int", default=12,
+                      help="OSDs out of the cluster at once, across all hosts (default: %default)")
+    parser.add_option("--max-hosts", dest="max_hosts", type="int", default=2,
+                      help="Hosts converting at once (default: %default)")
+    parser.add_option("--max-backfilling", dest="max_backfilling", type="int", default=100,
+                      help="Do not mark more OSDs out while more PGs are backfilling (default: %default)")
+    parser.add_option("--max-misplaced", dest="max_misplaced", type="float", default=0.05,
+                      help="Nor while more than this ratio of objects is misplaced (default: %default)")
+    parser.add_option("-p", "--parallel", dest="parallel", type="int", default=8,
+                      help="Groups destroyed or created at once (default: %default)")
+    parser.add_option("-i", "--interval", dest="interval", type="float", default=30,
+                      help="Seconds between rounds (default: %default)")
+    parser.add_option("--ssh", dest="ssh", default="ssh -o BatchMode=yes",
+                      help="Command to run a command on an OSD host (default: %default)")
+    parser.add_option("--state", dest="state", default="/var/lib/ceph/filestore-to-bluestore.json",
+                      help="Progress of the conversion, to resume it (default: %default)")
+    parser.add_option("--retry", dest="retry", default=False, action="store_true",
+                      help="Retry the failed groups from the step that failed")
+    parser.add_option("-r", "--really", dest="really", default=False, action="store_true",
+                      help="Really convert; without it only the plan is shown")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    groups = None
+    if os.path.exists(options.state):
+        with open(options.state) as f:
+            groups = json.load(f)
+        logger.info("Resuming the conversion of %d groups from %s", len(groups), options.state)
+        if options.retry:
+            for group in groups:
+                if group['state'] == FAILED:
+                    # a group refused by the plan is planned again; destroy_group checks its SSD again
+                    failed = max([(t, state) for state, t in group.get('times', {}).iteritems()
+                                  if state != FAILED] or [(0, PLANNED)])[1]
+                    group['state'] = failed
+                    group.pop('error', None)
+    else:
+        criteria = {}
+        for bucket in options.buckets:
+            bucket_type, _, name = bucket.partition('=')
+            criteria[bucket_type] = name
+        if options.device_class:
+            criteria['device_class'] = options.device_class
+        groups = plan(cephinfo.get_osd_index(cache=None), criteria, options.hosts, options.ssh)
+
+    for group in groups:
+        print "%-24s %-10s %-16s %s" % (group['host'], group['state'], group['journal'] or '-',
+                                        ' '.join('osd.%s:%s' % item for item in sorted(group['osds'].items())))
+    print "%d OSDs in %d groups on %d hosts" % (sum(len(group['osds']) for group in groups), len(groups),
+                                               len(set(group['host'] for group in groups)))
+    if not options.really:
+        print "Not converting anything without --really"
+        sys.exit(0)
+
+    orchestrator = Orchestrator(groups, options.state, options)
+    orchestrator.save()
+    sys.exit(0 if orchestrator.run() else 1)
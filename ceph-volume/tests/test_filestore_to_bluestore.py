@@ -0,0 +1,108 @@
+import json
+
+import filestore_to_bluestore
+from filestore_to_bluestore import DONE, DRAINING, FAILED, PLANNED, Orchestrator, create_group, destroy_group, \
+    foreign_users, host_osds, journal_users, make_groups, parent_device, partition_path
+
+
+def fake_run(ran, output=''):
+    return lambda cmd, host=None, ssh=None, really=True: ran.append(cmd) or (0, output)
+
+
+def ceph_disk_list():
+    """ Two OSDs with their journals on an NVMe, and one with its journal on its own disk """
+    return [
+        {'path': '/dev/sda', 'partitions': [
+            {'type': 'data', 'whoami': '1', 'path': '/dev/sda1', 'journal_dev': '/dev/nvme0n1p1'}]},
+        {'path': '/dev/sdb', 'partitions': [
+            {'type': 'data', 'whoami': '2', 'path': '/dev/sdb1', 'journal_dev': '/dev/nvme0n1p2'}]},
+        {'path': '/dev/sdc', 'partitions': [
+            {'type': 'data', 'whoami': '3', 'path': '/dev/sdc1', 'journal_dev': '/dev/sdc2'},
+            {'type': 'journal', 'path': '/dev/sdc2', 'journal_for': '/dev/sdc1'}]},
+        {'path': '/dev/nvme0n1', 'partitions': [
+            {'type': 'journal', 'path': '/dev/nvme0n1p1', 'journal_for': '/dev/sda1'},
+            {'type': 'journal', 'path': '/dev/nvme0n1p2', 'journal_for': '/dev/sdb1'}]},
+    ]
+
+
+def test_devices():
+    assert parent_device('/dev/sda1') == '/dev/sda'
+    assert parent_device('/dev/sdab12') == '/dev/sdab'
+    assert parent_device('/dev/nvme0n1p2') == '/dev/nvme0n1'
+    assert partition_path('/dev/sdc', 2) == '/dev/sdc2'
+    assert partition_path('/dev/nvme0n1', 2) == '/dev/nvme0n1p2'
+    disks = ceph_disk_list()
+    devices = host_osds(disks)
+    assert devices == {1: ('/dev/sda', '/dev/nvme0n1'), 2: ('/dev/sdb', '/dev/nvme0n1'), 3: ('/dev/sdc', None)}
+    users = journal_users(disks)
+    assert users['/dev/nvme0n1'] == [1, 2]
+    groups = make_groups('h1', [1, 2, 3, 4], devices, users)
+    assert [(group['journal'], sorted(group['osds']), group['state']) for group in groups] == \
+        [(None, ['3'], PLANNED), ('/dev/nvme0n1', ['1', '2'], PLANNED)]
+    # osd.2 is not converted (filtered out, or not filestore): its journal must survive
+    groups = make_groups('h1', [1, 3], devices, users)
+    assert groups[1]['state'] == FAILED and 'osd.2' in groups[1]['error']
+    # an LVM OSD or anything else on the SSD is not a journal of ceph-disk
+    disks[3]['partitions'].append({'type': 'other', 'path': '/dev/nvme0n1p3'})
+    assert foreign_users(groups[1], journal_users(disks)) == [2, '/dev/nvme0n1p3']
+
+
+def test_create_resumed(monkeypatch):
+    # osd.1 was created before the last attempt failed: only osd.2 is created again
+    ran = []
+    monkeypatch.setattr(filestore_to_bluestore, 'run', fake_run(ran))
+    group = {'host': 'h1', 'journal': '/dev/nvme0n1', 'osds': {'1': '/dev/sda', '2': '/dev/sdb'}, 'created': ['1']}
+    create_group(group, 'ssh', False)
+    assert ran == ['ceph osd in 1',
+                   'ceph-volume lvm create --bluestore --osd-id 2 --data /dev/sdb --block.db /dev/nvme0n1p2',
+                   'ceph osd in 2']
+    assert group['created'] == ['1', '2']
+
+
+def test_destroy_resumed(monkeypatch):
+    # osd.1 was zapped: its journal no longer resolves to it, but the SSD was checked
+    # before, so osd.2 is destroyed and the SSD partitioned without checking again
+    disks = ceph_disk_list()
+    disks[3]['partitions'][0].pop('journal_for')
+    del disks[0]['partitions'][:]
+    ran = []
+    monkeypatch.setattr(filestore_to_bluestore, 'run', fake_run(ran, json.dumps(disks)))
+    group = {'host': 'h1', 'journal': '/dev/nvme0n1', 'osds': {'1': '/dev/sda', '2': '/dev/sdb'}}
+    try:
+        destroy_group(group, 'ssh', True)
+        assert False, 'foreign partitions were wiped'
+    except RuntimeError as e:
+        assert '/dev/nvme0n1p1' in str(e)
+    del ran[:]
+    saved_groups = []
+    group.update({'journal_checked': True, 'destroyed': ['1']})
+    destroy_group(group, 'ssh', True, lambda: saved_groups.append(json.dumps(group)))
+    assert ran[:4] == ['systemctl stop ceph-osd@2',
+                       'if mountpoint -q /var/lib/ceph/osd/ceph-2; then umount /var/lib/ceph/osd/ceph-2; fi',
+                       'ceph osd destroy 2 --yes-i-really-mean-it', 'ceph-volume lvm zap /dev/sdb']
+    assert len(ran) == 5 and 'parted' in ran[-1]
+    assert group['destroyed'] == ['1', '2'] and group['partitioned'] and len(saved_groups) == 2
+
+
+def test_budget(monkeypatch):
+    class Options(object):
+        max_down = 3
+        max_hosts = 2
+        max_backfilling = 10
+        max_misplaced = 0.05
+        parallel = 1
+        interval = 0
+        ssh = 'ssh'
+        really = False
+    monkeypatch.setattr(filestore_to_bluestore, 'recovery_load', lambda: (0, 0.0, 0.0))
+    groups = [{'host': host, 'journal': None, 'osds': dict((str(osd), '/dev/sdx') for osd in osds),
+               'state': PLANNED} for host, osds in (('h1', [1]), ('h2', [2]), ('h3', [3]), ('h1', [4, 5]))]
+    # refused by the plan: neither down nor stopping the others
+    groups.append({'host': 'h4', 'journal': '/dev/sdy', 'osds': {'6': '/dev/sdx'}, 'state': FAILED})
+    orchestrator = Orchestrator(groups, None, Options())
+    orchestrator.start_groups()
+    # h3 would be a third host, and 4,5 would make 4 OSDs down
+    assert [group['state'] for group in groups] == [DRAINING, DRAINING, PLANNED, PLANNED, FAILED]
+    orchestrator.check_draining()
+    assert not orchestrator.run()
+    assert [group['state'] for group in groups] == [DONE] * 4 + [FAILED]
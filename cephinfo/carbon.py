@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#
+# carbon.py
+#
+# Buffered Graphite/carbon metrics emitter with a persistent connection
+#
+
+import errno
+import logging
+import os
+import cPickle as pickle
+import socket
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+PLAINTEXT = 'plaintext'
+PICKLE = 'pickle'
+UDP = 'udp'
+PROTOCOLS = (PLAINTEXT, PICKLE, UDP)
+
+# keep datagrams below a typical ethernet MTU
+MAX_UDP_PAYLOAD = 1400
+
+
+class CarbonClient(object):
+    """ Queue metrics and send them to carbon in bounded batches over one connection.
+
+        On connection failures the client backs off exponentially and appends the
+        pending metrics to the spool file, which is replayed on the next successful
+        connection.
+    """
+
+    def __init__(self, server, port=2003, protocol=PLAINTEXT, batch_size=1000,
+                 timeout=5, max_backoff=300, spool=None, max_spool_bytes=100 * 1024 * 1024):
+        if protocol not in PROTOCOLS:
+            raise ValueError('unknown carbon protocol %s' % protocol)
+        self.server = server
+        self.port = port
+        self.protocol = protocol
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.spool = spool
+        self.max_spool_bytes = max_spool_bytes
+        self.pending = []
+        self.sock = None
+        self.backoff = 0
+        self.retry_at = 0
+        self.n_sent = 0
+        self.n_spooled = 0
+
+    def send(self, key, value, timestamp=None):
+        """ Queue one metric, flushing once a full batch is pending. """
+        if timestamp is None:
+            timestamp = int(time.time())
+        self.pending.append((key, value, timestamp))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Send everything pending; spool it if carbon can't be reached. """
+        if not self.pending:
+            return
+        metrics = self.pending
+        self.pending = []
+        if not self._connect():
+            self._spool(metrics)
+            return
+        self._replay_spool()
+        if self.sock is None:
+            self._spool(metrics)
+            return
+        for i in range(0, len(metrics), self.batch_size):
+            if not self._send_batch(metrics[i:i + self.batch_size]):
+                self._spool(metrics[i:])
+                return
+
+    def close(self):
+        self.flush()
+        self._disconnect()
+
+    def _connect(self):
+        if self.sock is not None:
+            return True
+        if time.time() < self.retry_at:
+            return False
+        try:
+            if self.protocol == UDP:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            else:
+                sock = socket.create_connection((self.server, self.port), self.timeout)
+                sock.settimeout(self.timeout)
+        except (socket.error, socket.timeout) as e:
+            self._failed('connect', e)
+            return False
+        self.sock = sock
+        return True
+
+    def _disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+
+    def _failed(self, what, error):
+        self._disconnect()
+        self.backoff = min(self.max_backoff, max(1, self.backoff * 2))
+        self.retry_at = time.time() + self.backoff
+        logger.warning("carbon %s to %s:%s failed (%s), retrying in %ss",
+                       what, self.server, self.port, error, self.backoff)
+
+    def _send_batch(self, metrics):
+        try:
+            if self.protocol == UDP:
+                for datagram in self._datagrams(metrics):
+                    self.sock.sendto(datagram, (self.server, self.port))
+            elif self.protocol == PICKLE:
+                payload = pickle.dumps([(key, (timestamp, value)) for key, value, timestamp in metrics], 2)
+                self.sock.sendall(struct.pack('!L', len(payload)) + payload)
+            else:
+                self.sock.sendall(''.join(format_line(*m) for m in metrics))
+        except (socket.error, socket.timeout) as e:
+            self._failed('send', e)
+            return False
+        self.backoff = 0
+        self.n_sent += len(metrics)
+        return True
+
+    def _datagrams(self, metrics):
+        lines = []
+        size = 0
+        for m in metrics:
+            line = format_line(*m)
+            if lines and size + len(line) > MAX_UDP_PAYLOAD:
+                yield ''.join(lines)
+                lines = []
+                size = 0
+            lines.append(line)
+            size += len(line)
+        if lines:
+            yield ''.join(lines)
+
+    def _spool(self, metrics):
+        if not self.spool:
+            logger.warning("carbon unavailable, dropping %s metrics", len(metrics))
+            return
+        try:
+            if os.path.exists(self.spool) and os.path.getsize(self.spool) > self.max_spool_bytes:
+                logger.warning("carbon spool %s is full, dropping %s metrics", self.spool, len(metrics))
+                return
+            with open(self.spool, 'a') as f:
+                f.write(''.join(format_line(*m) for m in metrics))
+            self.n_spooled += len(metrics)
+        except IOError:
+            logger.exception("could not spool %s metrics to %s", len(metrics), self.spool)
+
+    def _replay_spool(self):
+        if not self.spool:
+            return
+        replaying = self.spool + '.replay'
+        try:
+            os.rename(self.spool, replaying)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                logger.exception("could not replay carbon spool %s", self.spool)
+            return
+        logger.info("replaying carbon spool %s", self.spool)
+        with open(replaying) as f:
+            batch = []
+            for line in f:
+                try:
+                    batch.append(parse_line(line))
+                except ValueError:
+                    continue
+                if len(batch) >= self.batch_size:
+                    if not self._send_batch(batch):
+                        break
+                    batch = []
+            else:
+                if not batch or self._send_batch(batch):
+                    batch = None
+            if batch is not None:
+                # carbon went away again, keep whatever wasn't sent for next time
+                self._spool(batch)
+                with open(self.spool, 'a') as spool:
+                    for line in f:
+                        spool.write(line)
+        os.unlink(replaying)
+
+
+def format_line(key, value, timestamp):
+    return '%s %s %d\n' % (key, value, timestamp)
+
+
+def parse_line(line):
+    key, value, timestamp = line.split()
+    return key, value, int(timestamp)
@@ -10,11 +10,22 @@
 import commands
 import subprocess
 import json
+import math
+import os
 import string
 import sys
 import random
+import tempfile
 import time
 import logging
+import threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+try:
+    import rados
+except ImportError:
+    rados = None
 
 formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
 logger = logging.getLogger(__file__)
@@ -108,6 +119,21 @@ def get_osd_states():
     return osd_states
 
 
+def get_osd_perf():
+    """ {osd id: (commit latency ms, apply latency ms)} from 'osd perf' """
+    perf = json.loads(commands.getoutput('ceph osd perf --format=json 2>/dev/null'))
+    # nautilus nests the infos in osdstats
+    perf = perf.get('osdstats', perf)
+    return dict((info['id'], (info['perf_stats']['commit_latency_ms'], info['perf_stats']['apply_latency_ms']))
+                for info in perf['osd_perf_infos'])
+
+
+def get_osd_df():
+    """ the 'osd df' nodes by osd id, without the jq pass of init_osd """
+    df = json.loads(commands.getoutput('ceph osd df --format=json 2>/dev/null'))
+    return dict((node['id'], node) for node in df['nodes'])
+
+
 def get_pg_stats():
     return list(pg_data['pg_stats'])
 
@@ -188,10 +214,17 @@ def get_read_latency():
     return [float(x) for x in latency_ms]
 
 
-def rados_cleanup(prefix):
+def rados_cleanup(prefix, background=False):
     assert prefix
     cmd = ['rados', '-p', 'test', 'cleanup', 'benchmark_data', '--prefix', prefix]
     backoff = random.randint(0, 60)
+    if background:
+        # detached, so the backoff and cleanup outlive a caller which exits right away
+        logger.info("Running cmd: '%s' in the background after %s seconds", " ".join(cmd), backoff)
+        with open(os.devnull, 'w') as devnull:
+            subprocess.Popen("sleep %d; %s" % (backoff, " ".join(cmd)), stdout=devnull, stderr=devnull,
+                             shell=True, close_fds=True)
+        return ''
     logger.info("Running cmd: '%s' after %s seconds", " ".join(cmd), backoff)
     time.sleep(backoff)  # so we don't rune cleanup all at same time, trying to debug it failing across nodes
     p = subprocess.Popen(" ".join(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
@@ -203,41 +236,406 @@ def rados_cleanup(prefix):
     return stdout
 
 
-def get_n_openstack_volumes():
-    n = commands.getoutput('rbd ls -p volumes 2>/dev/null | wc -l')
-    return int(n)
+# seconds to keep image and object counts before asking the cluster again
+COUNT_TTL = 300
 
+# omap keys fetched per rbd_directory read
+OMAP_BATCH = 10000
 
-def get_n_openstack_images():
-    n = commands.getoutput('rbd ls -p images 2>/dev/null | wc -l')
-    return int(n)
+cluster = None
+cluster_lock = threading.Lock()
+count_cache = {}
 
 
-def get_smooth_activity(n):
-    sum_iops = 0
-    sum_read = 0
-    sum_write = 0
-    count = 0
-    for i in xrange(n):
+def get_cluster(conffile='/etc/ceph/ceph.conf'):
+    """ persistent rados connection shared by the librados based helpers """
+    global cluster
+    with cluster_lock:
+        if cluster is None:
+            cluster = rados.Rados(conffile=conffile)
+            cluster.connect()
+    return cluster
+
+
+def cached(kind, pool, ttl, func):
+    """ func(), remembered for ttl seconds in count_cache
+
+        The cache lives in this process only: a cron job or CLI which runs once per
+        invocation asks the cluster every time, only long running daemons (the SLS
+        exporter) benefit from the ttl.
+    """
+    now = time.time()
+    try:
+        expires, value = count_cache[(kind, pool)]
+        if expires > now:
+            return value
+    except KeyError:
+        pass
+    value = func()
+    count_cache[(kind, pool)] = (now + ttl, value)
+    return value
+
+
+def iter_omap_vals(ioctx, obj, filter_prefix='', batch=OMAP_BATCH):
+    """ page through the omap (key, value) pairs of an object, batch pairs per read """
+    start_after = ''
+    while True:
+        with rados.ReadOpCtx() as read_op:
+            it, ret = ioctx.get_omap_vals(read_op, start_after, filter_prefix, batch)
+            ioctx.operate_read_op(read_op, obj)
+            n = 0
+            for key, value in it:
+                n += 1
+                start_after = key
+                yield key, value
+        if n < batch:
+            return
+
+
+def iter_omap_keys(ioctx, obj, filter_prefix='', batch=OMAP_BATCH):
+    """ page through the omap keys of an object starting with filter_prefix, without transferring the values
+
+        get_omap_keys has no prefix filter, so the listing starts just before the prefix
+        and stops at the first key past it (omap keys are sorted).
+    """
+    start_after = filter_prefix[:-1] + chr(ord(filter_prefix[-1]) - 1) if filter_prefix else ''
+    while True:
+        with rados.ReadOpCtx() as read_op:
+            it, ret = ioctx.get_omap_keys(read_op, start_after, batch)
+            ioctx.operate_read_op(read_op, obj)
+            n = 0
+            for key, _ in it:
+                n += 1
+                start_after = key
+                if key.startswith(filter_prefix):
+                    yield key
+                elif key > filter_prefix:
+                    return
+        if n < batch:
+            return
+
+
+def count_omap_keys(ioctx, obj, batch=OMAP_BATCH):
+    """ count the omap keys of an object, batch keys per read, without transferring the values """
+    start_after = ''
+    total = 0
+    while True:
+        with rados.ReadOpCtx() as read_op:
+            it, ret = ioctx.get_omap_keys(read_op, start_after, batch)
+            ioctx.operate_read_op(read_op, obj)
+            n = 0
+            for key, _ in it:
+                n += 1
+                start_after = key
+        total += n
+        if n < batch:
+            return total
+
+
+def count_rbd_directory(pool):
+    """ count the name_ keys of a pool's rbd_directory without transferring the image list """
+    if rados is None:
+        return int(commands.getoutput('rbd ls -p %s 2>/dev/null | wc -l' % pool))
+    try:
+        ioctx = get_cluster().open_ioctx(pool)
+    except rados.ObjectNotFound:
+        return 0
+    try:
+        return sum(1 for _ in iter_omap_keys(ioctx, 'rbd_directory', 'name_'))
+    except rados.ObjectNotFound:
+        return 0
+    finally:
+        ioctx.close()
+
+
+def get_n_rbd_images(pool, ttl=COUNT_TTL):
+    """ number of rbd images in pool, counted at most once per ttl seconds by this process """
+    return cached('rbd_images', pool, ttl, lambda: count_rbd_directory(pool))
+
+
+def get_n_rbd_images_by_pool(pools, ttl=COUNT_TTL):
+    """ {pool: number of rbd images}, the pools are counted concurrently """
+    workers = ThreadPool(min(8, max(1, len(pools))))
+    try:
+        counts = workers.map(lambda pool: get_n_rbd_images(pool, ttl), pools)
+    finally:
+        workers.close()
+    return dict(zip(pools, counts))
+
+
+def get_n_objects_by_pool(pools=None, ttl=COUNT_TTL):
+    """ {pool: number of objects} from the 'ceph df' pool stats, for all pools by default """
+    def objects():
+        init_df()
+        return dict((pool['name'], pool['stats']['objects']) for pool in df_data['pools'])
+    counts = cached('objects', None, ttl, objects)
+    if pools is None:
+        return dict(counts)
+    return dict((pool, counts.get(pool, 0)) for pool in pools)
+
+
+# where get_osd_index() keeps the last index, shared by the tools a user runs on a host;
+# not in a world writable directory, and only trusted when owned by that user
+OSD_INDEX_CACHE = '/var/lib/ceph/tmp/cephinfo-osd-index.json'
+
+osd_index = None
+
+
+def osd_devices(metadata):
+    """ the short names of the devices under an OSD, e.g. ['sda', 'nvme0n1'] """
+    if metadata.get('devices'):
+        return metadata['devices'].split(',')
+    devices = []
+    for key in ('bluestore_bdev_dev_node', 'backend_filestore_dev_node', 'bluefs_db_dev_node',
+                'bluefs_wal_dev_node', 'journal_dev_node'):
+        node = metadata.get(key)
+        if node and node.startswith('/dev/') and os.path.basename(node) not in devices:
+            devices.append(os.path.basename(node))
+    return devices
+
+
+def osd_rotational(metadata):
+    rotational = metadata.get('rotational', metadata.get('bluestore_bdev_rotational'))
+    if rotational is None:
+        return None
+    return str(rotational) == '1'
+
+
+class OsdIndex(object):
+    """ Every OSD's metadata and CRUSH location, indexed for set lookups.
+
+        select(host='x', objectstore='filestore', rotational=True, rack='r1', ...) intersects
+        the indexes instead of asking the mons once per OSD. Any CRUSH bucket type (host,
+        rack, room, ...) and the device class, objectstore, rotational and device
+        ('host:sda') can be selected on.
+    """
+
+    def __init__(self, epoch, metadata, tree_nodes):
+        self.epoch = epoch
+        self.metadata = dict((osd['id'], osd) for osd in metadata)
+        self.indexes = {}
+        by_id = dict((node['id'], node) for node in tree_nodes)
+        parents = {}
+        for node in tree_nodes:
+            for child in node.get('children', []):
+                parents[child] = node['id']
+        for node in tree_nodes:
+            if node['type'] != 'osd':
+                continue
+            osd = node['id']
+            self.add('device_class', node.get('device_class'), osd)
+            parent = parents.get(osd)
+            while parent is not None:
+                self.add(by_id[parent]['type'], by_id[parent]['name'], osd)
+                parent = parents.get(parent)
+        for osd, metadata in self.metadata.iteritems():
+            self.add('hostname', metadata.get('hostname'), osd)
+            self.add('objectstore', metadata.get('osd_objectstore'), osd)
+            self.add('rotational', osd_rotational(metadata), osd)
+            for device in osd_devices(metadata):
+                self.add('device', '%s:%s' % (metadata.get('hostname'), device), osd)
+
+    def add(self, key, value, osd):
+        if value is not None:
+            self.indexes.setdefault(key, {}).setdefault(value, set()).add(osd)
+
+    def get(self, key, value):
+        return self.indexes.get(key, {}).get(value, set())
+
+    def values(self, key):
+        return sorted(self.indexes.get(key, {}))
+
+    def select(self, **criteria):
+        """ The ids of the OSDs matching every criterion; no criteria selects all """
+        osds = set(self.metadata)
+        for key, value in criteria.iteritems():
+            osds &= self.get(key, value)
+        return osds
+
+    def hosts(self):
+        """ {osd id: CRUSH host} """
+        return dict((osd, host) for host, osds in self.indexes.get('host', {}).iteritems() for osd in osds)
+
+
+def get_osd_hosts():
+    """ {osd id: CRUSH host} of every OSD in the CRUSH tree """
+    return get_osd_index().hosts()
+
+
+def get_osd_epoch():
+    return json.loads(commands.getoutput('ceph osd stat --format=json 2>/dev/null'))['epoch']
+
+
+def get_fsid():
+    return json.loads(commands.getoutput('ceph fsid --format=json 2>/dev/null'))['fsid']
+
+
+def read_own_json(path):
+    """ The JSON in path, or None unless the file is ours and only writable by us """
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    with os.fdopen(fd) as f:
+        st = os.fstat(f.fileno())
+        if st.st_uid != os.getuid() or st.st_mode & 022:
+            logger.warning("Ignoring %s, it is not owned and only writable by uid %d", path, os.getuid())
+            return None
         try:
-            sum_iops += stat_data['pgmap']['op_per_sec']
-        except KeyError:
-            try:
-                sum_iops += stat_data['pgmap']['read_op_per_sec'] + stat_data['pgmap']['write_op_per_sec']
-            except KeyError:
-                pass
+            return json.load(f)
+        except ValueError:
+            return None
+
+
+def write_json(path, data):
+    """ Atomically replace path with data, through a private temporary file next to it """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def get_osd_index(cache=OSD_INDEX_CACHE):
+    """ The OsdIndex, rebuilt only when the osdmap epoch changed (OSDs boot with new metadata
+        in a new epoch). The last index is kept in cache so that short lived tools share it;
+        tools acting on the index (destroying OSDs) should pass cache=None.
+    """
+    global osd_index
+    epoch = get_osd_epoch()
+    if osd_index is not None and osd_index.epoch == epoch:
+        return osd_index
+    fsid = get_fsid() if cache else None
+    if cache:
+        data = read_own_json(cache)
         try:
-            sum_read += stat_data['pgmap']['read_bytes_sec'] / 1024 / 1024
-            sum_write += stat_data['pgmap']['write_bytes_sec'] / 1024 / 1024
-            count += 1
-        except KeyError:
+            if data and data['fsid'] == fsid and data['epoch'] == epoch:
+                osd_index = OsdIndex(epoch, data['metadata'], data['tree'])
+                return osd_index
+        except (KeyError, TypeError):
             pass
-        time.sleep(1)
-        init_stat()
+    metadata = json.loads(commands.getoutput('ceph osd metadata --format=json 2>/dev/null'))
+    tree = json.loads(commands.getoutput('ceph osd tree --format=json 2>/dev/null'))['nodes']
+    osd_index = OsdIndex(epoch, metadata, tree)
+    if cache:
+        try:
+            write_json(cache, {'fsid': fsid, 'epoch': epoch, 'metadata': metadata, 'tree': tree})
+        except EnvironmentError as e:
+            logger.debug("Could not write the osd index cache %s: %s", cache, e)
+    return osd_index
+
+
+def get_n_openstack_volumes():
+    return get_n_rbd_images('volumes')
+
+
+def get_n_openstack_images():
+    return get_n_rbd_images('images')
+
+
+def get_pgmap_rates(pgmap):
+    """ [iops, read MB/s, write MB/s] from a status pgmap; ceph omits the rates while they are zero """
     try:
-        return [int(sum_iops / count), int(sum_read / count), int(sum_write / count)]
-    except ZeroDivisionError:
-        return [0, 0, 0]
+        iops = pgmap['op_per_sec']
+    except KeyError:
+        iops = pgmap.get('read_op_per_sec', 0) + pgmap.get('write_op_per_sec', 0)
+    return [iops,
+            pgmap.get('read_bytes_sec', 0) / 1024.0 / 1024,
+            pgmap.get('write_bytes_sec', 0) / 1024.0 / 1024]
+
+
+class ActivitySampler(object):
+    """ Background sampler keeping a ring buffer of pgmap rates from 'status'.
+
+        Samples are taken every interval seconds over the shared get_cluster() connection
+        (or 'ceph -s' when the rados bindings are missing), so callers can read smoothed
+        rates at any time without waiting.
+    """
+
+    def __init__(self, interval=1, size=600, alpha=0.2, conffile='/etc/ceph/ceph.conf'):
+        self.interval = interval
+        self.alpha = alpha
+        self.conffile = conffile
+        self.samples = deque(maxlen=size)
+        self.ewma_rates = None
+
+    def start(self):
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def get_status(self):
+        if rados is None:
+            return json.loads(commands.getoutput('ceph -s -f json 2>/dev/null'))
+        ret, buf, out = get_cluster(self.conffile).mon_command(json.dumps({'prefix': 'status', 'format': 'json'}), b'', timeout=5)
+        if ret != 0:
+            raise IOError("status failed: %s" % out)
+        return json.loads(buf)
+
+    def run(self):
+        while True:
+            start = time.time()
+            try:
+                self.add(get_pgmap_rates(self.get_status()['pgmap']))
+            except Exception:
+                logger.exception("Failed to sample cluster activity")
+            time.sleep(max(0, self.interval - (time.time() - start)))
+
+    def add(self, rates):
+        self.samples.append(rates)
+        if self.ewma_rates is None:
+            self.ewma_rates = list(rates)
+        else:
+            self.ewma_rates = [e + self.alpha * (r - e) for e, r in zip(self.ewma_rates, rates)]
+
+    def window(self, n=None):
+        samples = list(self.samples)
+        if n:
+            samples = samples[-n:]
+        return samples
+
+    def mean(self, n=None):
+        samples = self.window(n)
+        if not samples:
+            return [0, 0, 0]
+        return [sum(column) / float(len(samples)) for column in zip(*samples)]
+
+    def percentile(self, p, n=None):
+        """ nearest-rank percentile of each rate over the last n samples """
+        samples = self.window(n)
+        if not samples:
+            return [0, 0, 0]
+        rank = max(0, int(math.ceil(p / 100.0 * len(samples))) - 1)
+        return [sorted(column)[rank] for column in zip(*samples)]
+
+    def ewma(self):
+        return self.ewma_rates or [0, 0, 0]
+
+
+activity_sampler = None
+
+
+def start_activity_sampler(interval=1, size=600):
+    global activity_sampler
+    if activity_sampler is None:
+        activity_sampler = ActivitySampler(interval, size).start()
+    return activity_sampler
+
+
+def get_smooth_activity(n):
+    """ Mean [iops, read MB/s, write MB/s] over the last n sampler samples, without blocking.
+
+        Without a running sampler (or before its first sample) the current stat_data snapshot is used.
+    """
+    if activity_sampler is not None and activity_sampler.samples:
+        rates = activity_sampler.mean(n)
+    else:
+        rates = get_pgmap_rates(stat_data['pgmap'])
+    return [int(x) for x in rates]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# prometheus.py
+#
+# Serve pre-rendered Prometheus/OpenMetrics text refreshed in the background
+#
+
+from collections import OrderedDict
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(samples):
+    """ Render (name, labels, value) samples as Prometheus text, grouping samples by name. """
+    by_name = OrderedDict()
+    for name, labels, value in samples:
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, values in by_name.iteritems():
+        lines.append('# TYPE %s gauge' % name)
+        for labels, value in values:
+            if labels:
+                label_text = ','.join('%s="%s"' % (k, escape(v)) for k, v in sorted(labels.items()))
+                lines.append('%s{%s} %s' % (name, label_text, value))
+            else:
+                lines.append('%s %s' % (name, value))
+    lines.append('')
+    return '\n'.join(lines)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer(object):
+    """ Serve the last rendered snapshot on /metrics while a thread refreshes it.
+
+        refresh() must return the rendered text. Scrapes never wait for a refresh,
+        they get the last complete snapshot, so many scrapers share one set of mon queries.
+    """
+
+    def __init__(self, refresh, interval=60, port=9283, address=''):
+        self.refresh = refresh
+        self.interval = interval
+        self.address = address
+        self.port = port
+        self.text = None
+
+    def refresh_loop(self):
+        while True:
+            start = time.time()
+            try:
+                text = self.refresh()
+                duration = time.time() - start
+                self.text = text + render([
+                    ('exporter_refresh_duration_seconds', {}, '%.3f' % duration),
+                    ('exporter_refresh_timestamp_seconds', {}, int(start)),
+                ])
+                logger.info("Refreshed metrics in %.1fs", duration)
+            except Exception:
+                logger.exception("Failed to refresh metrics, serving the previous snapshot")
+            time.sleep(max(0, self.interval - (time.time() - start)))
+
+    def serve_forever(self):
+        thread = threading.Thread(target=self.refresh_loop)
+        thread.daemon = True
+        thread.start()
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                text = exporter.text
+                if text is None:
+                    self.send_error(503, 'No snapshot yet')
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(text)))
+                self.end_headers()
+                self.wfile.write(text)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        logger.info("Serving metrics on %s:%s/metrics", self.address, self.port)
+        ThreadingHTTPServer((self.address, self.port), Handler).serve_forever()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# import the package as the tools do: from cephinfo import cephinfo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -0,0 +1,78 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from cephinfo.carbon import CarbonClient
+
+
+class FakeCarbon(object):
+    """ Local plaintext carbon listener """
+
+    def __init__(self, port=0):
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', port))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+        self.lines = []
+        self.connections = 0
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except socket.error:
+                return
+            self.connections += 1
+            data = ''
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            conn.close()
+            self.lines.extend(data.splitlines())
+
+    def wait(self, n, timeout=5):
+        deadline = time.time() + timeout
+        while len(self.lines) < n and time.time() < deadline:
+            time.sleep(0.01)
+        return self.lines
+
+    def close(self):
+        self.listener.close()
+
+
+def test_batches_share_one_connection():
+    fake = FakeCarbon()
+    client = CarbonClient('127.0.0.1', fake.port, batch_size=100)
+    for i in range(1050):
+        client.send('test.osds.%d.kb' % i, i, 1500000000)
+    client.close()
+    lines = fake.wait(1050)
+    fake.close()
+    assert len(lines) == 1050
+    assert lines[7] == 'test.osds.7.kb 7 1500000000'
+    assert fake.connections == 1
+
+
+def test_spool_replayed_after_outage():
+    spool = tempfile.mktemp()
+    client = CarbonClient('127.0.0.1', 1, spool=spool)
+    client.send('test.down', 1, 1500000000)
+    client.flush()
+    assert client.n_spooled == 1 and os.path.exists(spool)
+
+    fake = FakeCarbon()
+    client = CarbonClient('127.0.0.1', fake.port, spool=spool)
+    client.send('test.up', 2, 1500000060)
+    client.close()
+    lines = fake.wait(2)
+    fake.close()
+    assert lines == ['test.down 1 1500000000', 'test.up 2 1500000060']
+    assert not os.path.exists(spool)
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+
+from cephinfo import cephinfo
+
+
+def test_read_own_json():
+    top = tempfile.mkdtemp()
+    try:
+        path = os.path.join(top, 'index.json')
+        cephinfo.write_json(path, {'epoch': 1})
+        assert cephinfo.read_own_json(path) == {'epoch': 1}
+        assert os.stat(path).st_mode & 077 == 0
+        # writable by others, or a symlink: not trusted
+        os.chmod(path, 0666)
+        assert cephinfo.read_own_json(path) is None
+        os.chmod(path, 0600)
+        os.symlink(path, path + '.link')
+        assert cephinfo.read_own_json(path + '.link') is None
+        assert cephinfo.read_own_json(os.path.join(top, 'missing')) is None
+        assert sorted(os.listdir(top)) == ['index.json', 'index.json.link']
+    finally:
+        shutil.rmtree(top)
+
+
+def test_activity_sampler():
+    sampler = cephinfo.ActivitySampler(size=4)
+    for iops in (10, 20, 30, 40, 50):
+        sampler.add(cephinfo.get_pgmap_rates({'read_op_per_sec': iops, 'write_op_per_sec': iops,
+                                     'read_bytes_sec': iops * 1024 * 1024}))
+    assert sampler.mean() == [70.0, 35.0, 0.0]
+    assert sampler.mean(2) == [90.0, 45.0, 0.0]
+    assert sampler.percentile(50) == [60, 30.0, 0.0]
+    assert sampler.percentile(100) == [100, 50.0, 0.0]
+    assert 20 < sampler.ewma()[0] < 100
+
+
+def test_iter_omap_keys():
+    keys = sorted(['id_1', 'id_2', 'name_', 'name_a', 'name_b', 'name_c', 'obj_x'])
+    reads = []
+
+    class FakeRados(object):
+        class ReadOpCtx(object):
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+    class FakeIoctx(object):
+        def get_omap_keys(self, read_op, start_after, batch):
+            reads.append(start_after)
+            return [(key, None) for key in keys if key > start_after][:batch], 0
+
+        def operate_read_op(self, read_op, obj):
+            pass
+
+    saved = cephinfo.rados
+    cephinfo.rados = FakeRados()
+    try:
+        assert list(cephinfo.iter_omap_keys(FakeIoctx(), 'rbd_directory', 'name_', batch=2)) == \
+            ['name_', 'name_a', 'name_b', 'name_c']
+        # the id_ keys before the prefix are never listed
+        assert reads[0] == 'name^' and len(reads) == 3
+        assert len(list(cephinfo.iter_omap_keys(FakeIoctx(), 'rbd_directory', batch=3))) == len(keys)
+    finally:
+        cephinfo.rados = saved
+
+
+def test_osd_index():
+    tree = [
+        {'id': -1, 'name': 'default', 'type': 'root', 'children': [-2, -3]},
+        {'id': -2, 'name': 'r1', 'type': 'rack', 'children': [-4]},
+        {'id': -3, 'name': 'r2', 'type': 'rack', 'children': [-5]},
+        {'id': -4, 'name': 'h1', 'type': 'host', 'children': [0, 1]},
+        {'id': -5, 'name': 'h2', 'type': 'host', 'children': [2]},
+        {'id': 0, 'name': 'osd.0', 'type': 'osd', 'device_class': 'hdd'},
+        {'id': 1, 'name': 'osd.1', 'type': 'osd', 'device_class': 'ssd'},
+        {'id': 2, 'name': 'osd.2', 'type': 'osd', 'device_class': 'hdd'},
+    ]
+    metadata = [
+        {'id': 0, 'hostname': 'h1', 'osd_objectstore': 'filestore', 'rotational': '1',
+         'backend_filestore_dev_node': '/dev/sda', 'journal_dev_node': '/dev/sdc'},
+        {'id': 1, 'hostname': 'h1', 'osd_objectstore': 'bluestore', 'bluestore_bdev_rotational': '0',
+         'devices': 'sdc'},
+        {'id': 2, 'hostname': 'h2', 'osd_objectstore': 'filestore', 'rotational': '1', 'devices': 'sda'},
+    ]
+    index = cephinfo.OsdIndex(1, metadata, tree)
+    assert index.select(objectstore='filestore', rotational=True, rack='r1') == set([0])
+    assert index.select(objectstore='filestore', rotational=True) == set([0, 2])
+    assert index.select(device='h1:sdc') == set([0, 1])
+    assert index.select(host='h1', device_class='ssd') == set([1])
+    assert index.select(rack='nowhere') == set()
+    assert index.select() == set([0, 1, 2])
+    assert index.values('objectstore') == ['bluestore', 'filestore']
+    assert index.hosts() == {0: 'h1', 1: 'h1', 2: 'h2'}
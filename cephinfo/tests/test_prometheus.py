@@ -0,0 +1,20 @@
+from cephinfo.prometheus import render
+
+
+def test_render():
+    text = render([
+        ('ceph_n_pgs', {'state': 'active'}, 10),
+        ('ceph_n_osds', {}, 3),
+        ('ceph_n_pgs', {'state': 'clean'}, 9),
+        ('ceph_info', {'health': 'HEALTH_WARN "x"'}, 1),
+    ])
+    assert text == '\n'.join([
+        '# TYPE ceph_n_pgs gauge',
+        'ceph_n_pgs{state="active"} 10',
+        'ceph_n_pgs{state="clean"} 9',
+        '# TYPE ceph_n_osds gauge',
+        'ceph_n_osds 3',
+        '# TYPE ceph_info gauge',
+        'ceph_info{health="HEALTH_WARN \\"x\\""} 1',
+        '',
+    ])
@@ -0,0 +1 @@
+../cephinfo/carbon.py
\ No newline at end of file
@@ -16,16 +16,38 @@ import logging
 import argparse
 import commands
 import cephinfo
+import carbon
+import prometheus
 import urllib2
 import math
 import sys
 import time
-import socket
+import threading
 from datetime import datetime
 import math
 
 CARBON_SERVER = '10.181.48.46'
 CARBON_PORT = 2003
+CARBON_SPOOL = '/tmp/ceph-sls-carbon.spool'
+
+# seconds the probe phases may take altogether, keep it below the cron interval
+PROBE_BUDGET = 45
+
+# sls values sent to graphite, along with the per state n_pgs_* values
+GRAPHITE_METRICS = [
+    'n_mons', 'n_quorum', 'n_pools', 'n_osds', 'n_osds_up', 'n_osds_in', 'n_pgs',
+    'n_osd_gb_total', 'n_osd_gb_used', 'n_osd_gb_avail', 'n_pg_gbytes',
+    'n_objects', 'n_object_copies', 'n_objects_degraded', 'n_objects_unfound', 'n_objects_misplaced',
+    'n_read_gb', 'n_write_gb',
+    'latency_ms', 'latency_max_ms', 'latency_min_ms',
+    'read_latency_ms', 'read_latency_max_ms', 'read_latency_min_ms',
+    'n_openstack_volumes', 'n_openstack_images',
+    'read_mb_sec', 'write_mb_sec', 'op_per_sec',
+    'phase_bench_seconds', 'phase_health_seconds', 'phase_volumes_seconds', 'phase_images_seconds',
+]
+
+# per osd values from 'osd df' sent to graphite
+GRAPHITE_OSD_METRICS = ['crush_weight', 'reweight', 'kb', 'kb_used', 'kb_avail', 'utilization', 'var']
 
 formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
 logger = logging.getLogger(__file__)
@@ -35,9 +57,11 @@ stream_handler.setFormatter(formatter)
 logger.addHandler(stream_handler)
 
 
-def get_status(pg_stats_sum, latency_ms):
-    health = commands.getoutput('timeout 10 ceph health')
+def get_health():
+    return commands.getoutput('timeout 10 ceph health')
 
+
+def get_status(health, pg_stats_sum, latency_ms):
     if health.startswith('HEALTH_ERR'):
         return 'unavailable', health
 
@@ -53,12 +77,8 @@ def get_status(pg_stats_sum, latency_ms):
     return 'available', health
 
 
-def write_xml(slsid='Ceph'):
-    osd_states = cephinfo.get_osd_states()
-    osd_stats_sum = cephinfo.get_osd_stats_sum()
-    pg_stats_sum = cephinfo.get_pg_stats_sum()['stat_sum']
-    pg_map = cephinfo.stat_data['pgmap']
-    latency = None
+def get_latencies():
+    """ Write then read bench the test pool, returns (write latency, read latency) """
     try:
         latency = cephinfo.get_write_latency()
         logger.info("Write Latency: %s", latency)
@@ -69,16 +89,101 @@ def write_xml(slsid='Ceph'):
         # russ: clean up all benchmark data associated with this node, sometimes rados cleanup fails if specifying
         # specific prefix from above, and then number of objects continues to grow. For my use case, this will never
         # wipe objects I don't want to wipe
-        cleanup_output = cephinfo.rados_cleanup(latency[0].split(".")[0])
-        logger.info("benchmark %s cleaned up: %s", latency[0], cleanup_output)
+        # the cleanup waits a random backoff, so leave it running in the background rather than in the probe
+        cephinfo.rados_cleanup(latency[0].split(".")[0], background=True)
     except IndexError:
         latency = ['', [0, 0, 0]]
         read_latency = [0, 0, 0]
         logger.warning("IndexError when calling write_latency: %s", latency)
+    return latency, read_latency
+
+
+# {name: Phase} last started, which may still run after its timeout
+running_phases = {}
+# {name: (result, duration)} of the last finished run of each phase
+finished_phases = {}
+# when the last bench phase was started
+last_bench = 0
+
+
+class Phase(threading.Thread):
+    """ One probe phase, run concurrently with the others """
+
+    def __init__(self, name, func, timeout, fallback):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.func = func
+        self.timeout = timeout
+        self.result = fallback
+        self.duration = None
+
+    def run(self):
+        start = time.time()
+        try:
+            self.result = self.func()
+        except Exception:
+            logger.exception("Phase %s failed, using the degraded result", self.name)
+        self.duration = time.time() - start
+        finished_phases[self.name] = (self.result, self.duration)
+
+
+def run_phases(phases, budget):
+    """ Run all phases concurrently and wait for each at most its timeout, all within budget seconds.
+
+        Returns {name: (result, duration)}. Phases which didn't finish in time keep their fallback result.
+        A phase still running since an earlier call is not started again, its last result is reused.
+    """
+    start = time.time()
+    deadline = start + budget
+    results = {}
+    for phase in phases:
+        previous = running_phases.get(phase.name)
+        if previous is not None and previous.is_alive():
+            logger.warning("Phase %s is still running since an earlier probe, not starting it again", phase.name)
+            results[phase.name] = finished_phases.get(phase.name, (phase.result, 0.0))
+            continue
+        running_phases[phase.name] = phase
+        phase.start()
+    for phase in phases:
+        if phase.name in results:
+            continue
+        phase.join(max(0, min(start + phase.timeout, deadline) - time.time()))
+        if phase.is_alive():
+            logger.warning("Phase %s did not finish within %.0fs, using the degraded result",
+                           phase.name, time.time() - start)
+            results[phase.name] = (phase.result, time.time() - start)
+        else:
+            logger.info("Phase %s took %.1fs", phase.name, phase.duration)
+            results[phase.name] = (phase.result, phase.duration)
+    return results
+
+
+def get_context(slsid='Ceph', budget=PROBE_BUDGET, bench_interval=0):
+    """ Collect the SLS values from the current cephinfo snapshot, returns (context, pg_states, osd_df)
+
+        The rados bench runs at most every bench_interval seconds, in between its last result is reused.
+    """
+    global last_bench
+    osd_states = cephinfo.get_osd_states()
+    osd_stats_sum = cephinfo.get_osd_stats_sum()
+    pg_stats_sum = cephinfo.get_pg_stats_sum()['stat_sum']
+    bench_fallback = (['', [0, 0, 0]], [0, 0, 0])
+    phases = [
+        Phase('health', get_health, 15, ''),
+        Phase('volumes', cephinfo.get_n_openstack_volumes, budget, 0),
+        Phase('images', cephinfo.get_n_openstack_images, budget, 0),
+    ]
+    if time.time() - last_bench >= bench_interval:
+        last_bench = time.time()
+        phases.insert(0, Phase('bench', get_latencies, 30, bench_fallback))
+    phases = run_phases(phases, budget)
+    if 'bench' not in phases:
+        phases['bench'] = finished_phases.get('bench', (bench_fallback, 0.0))
+    latency, read_latency = phases['bench'][0]
     pg_states = cephinfo.get_pg_states()
     osd_df = cephinfo.osd_df_data['nodes']
     activity = cephinfo.get_smooth_activity(10)
-    status, availabilityinfo = get_status(pg_stats_sum, latency[1][0] * 1000)
+    status, availabilityinfo = get_status(phases['health'][0], pg_stats_sum, latency[1][0] * 1000)
     context = {
         "slsid": slsid,
         "timestamp": datetime.strftime(datetime.now(), '%Y-%m-%dT%H:%M:%S'),
@@ -108,8 +213,8 @@ def write_xml(slsid='Ceph'):
         "read_latency_ms": read_latency[0] * 1000,
         "read_latency_max_ms": read_latency[1] * 1000,
         "read_latency_min_ms": read_latency[2] * 1000,
-        "n_openstack_volumes": cephinfo.get_n_openstack_volumes(),
-        "n_openstack_images": cephinfo.get_n_openstack_images(),
+        "n_openstack_volumes": phases['volumes'][0],
+        "n_openstack_images": phases['images'][0],
         "op_per_sec": activity[0],
         "read_mb_sec": activity[1],
         "write_mb_sec": activity[2],
@@ -121,6 +226,15 @@ def write_xml(slsid='Ceph'):
     for state in pg_states.keys():
         context['n_pgs_%s' % state] = pg_states[state]
 
+    for name, (result, duration) in phases.items():
+        context['phase_%s_seconds' % name] = round(duration, 3)
+
+    return context, pg_states, osd_df
+
+
+def write_xml(carbon_client, slsid='Ceph', budget=PROBE_BUDGET):
+    context, pg_states, osd_df = get_context(slsid, budget)
+
     template = """
 <?xml version="1.0" encoding="utf-8"?>
 
@@ -180,77 +294,73 @@ def write_xml(slsid='Ceph'):
     # print template.format(**context)
 
     # generate Graphite update
-    graphite = """
-{graphite_prefix}.n_mons {n_mons} {graphite_timestamp}
-{graphite_prefix}.n_quorum {n_quorum} {graphite_timestamp}
-{graphite_prefix}.n_pools {n_pools} {graphite_timestamp}
-{graphite_prefix}.n_osds {n_osds} {graphite_timestamp}
-{graphite_prefix}.n_osds_up {n_osds_up} {graphite_timestamp}
-{graphite_prefix}.n_osds_in {n_osds_in} {graphite_timestamp}
-{graphite_prefix}.n_pgs {n_pgs} {graphite_timestamp}
-"""
-
+    prefix = context['graphite_prefix']
+    timestamp = context['graphite_timestamp']
+    for key in GRAPHITE_METRICS:
+        carbon_client.send('%s.%s' % (prefix, key), context[key], timestamp)
     for state in pg_states.keys():
-        graphite = graphite + "{graphite_prefix}.n_pgs_%s {n_pgs_%s} {graphite_timestamp}\n" % (state, state)
-
-    graphite = graphite + """{graphite_prefix}.n_osd_gb_total {n_osd_gb_total} {graphite_timestamp}
-{graphite_prefix}.n_osd_gb_used {n_osd_gb_used} {graphite_timestamp}
-{graphite_prefix}.n_osd_gb_avail {n_osd_gb_avail} {graphite_timestamp}
-{graphite_prefix}.n_pg_gbytes {n_pg_gbytes} {graphite_timestamp}
-{graphite_prefix}.n_objects {n_objects} {graphite_timestamp}
-{graphite_prefix}.n_object_copies {n_object_copies} {graphite_timestamp}
-{graphite_prefix}.n_objects_degraded {n_objects_degraded} {graphite_timestamp}
-{graphite_prefix}.n_objects_unfound {n_objects_unfound} {graphite_timestamp}
-{graphite_prefix}.n_objects_misplaced {n_objects_misplaced} {graphite_timestamp}
-{graphite_prefix}.n_read_gb {n_read_gb} {graphite_timestamp}
-{graphite_prefix}.n_write_gb {n_write_gb} {graphite_timestamp}
-{graphite_prefix}.latency_ms {latency_ms} {graphite_timestamp}
-{graphite_prefix}.latency_max_ms {latency_max_ms} {graphite_timestamp}
-{graphite_prefix}.latency_min_ms {latency_min_ms} {graphite_timestamp}
-{graphite_prefix}.read_latency_ms {read_latency_ms} {graphite_timestamp}
-{graphite_prefix}.read_latency_max_ms {read_latency_max_ms} {graphite_timestamp}
-{graphite_prefix}.read_latency_min_ms {read_latency_min_ms} {graphite_timestamp}
-{graphite_prefix}.n_openstack_volumes {n_openstack_volumes} {graphite_timestamp}
-{graphite_prefix}.n_openstack_images {n_openstack_images} {graphite_timestamp}
-{graphite_prefix}.read_mb_sec {read_mb_sec} {graphite_timestamp}
-{graphite_prefix}.write_mb_sec {write_mb_sec} {graphite_timestamp}
-{graphite_prefix}.op_per_sec {op_per_sec} {graphite_timestamp}
-"""
-    # go ahead and send sls data - I feel like with large carbon output some are getting dropped somewhere
-    update = graphite.format(**context)
-    sock = socket.socket()
-    sock.connect((CARBON_SERVER, CARBON_PORT))
-    sock.sendall(update)
-    sock.close()
+        carbon_client.send('%s.n_pgs_%s' % (prefix, state), context['n_pgs_%s' % state], timestamp)
 
     # now send osd data
-    graphite = ""
+    osd_prefix = context['graphite_osd_prefix']
     for osd in osd_df:
-        graphite = graphite + "{graphite_osd_prefix}.%s.crush_weight %s {graphite_timestamp}\n" % (
-            osd['id'], osd['crush_weight'])
-        graphite = graphite + "{graphite_osd_prefix}.%s.reweight %s {graphite_timestamp}\n" % (
-            osd['id'], osd['reweight'])
-        graphite = graphite + "{graphite_osd_prefix}.%s.kb %s {graphite_timestamp}\n" % (osd['id'], osd['kb'])
-        graphite = graphite + "{graphite_osd_prefix}.%s.kb_used %s {graphite_timestamp}\n" % (osd['id'], osd['kb_used'])
-        graphite = graphite + "{graphite_osd_prefix}.%s.kb_avail %s {graphite_timestamp}\n" % (
-            osd['id'], osd['kb_avail'])
-        graphite = graphite + "{graphite_osd_prefix}.%s.utilization %s {graphite_timestamp}\n" % (
-            osd['id'], osd['utilization'])
-        graphite = graphite + "{graphite_osd_prefix}.%s.var %s {graphite_timestamp}\n" % (osd['id'], osd['var'])
-
-    update = graphite.format(**context)
-    sock = socket.socket()
-    sock.connect((CARBON_SERVER, CARBON_PORT))
-    sock.sendall(update)
-    sock.close()
-
-
-# main
-
-parser = argparse.ArgumentParser(description="CERN Ceph SLS Probe")
-parser.add_argument('-i', '--id', help='SLS ID, e.g. Ceph, Ceph_Preprod, Ceph_Wigner')
-
-parsed_args, rest = parser.parse_known_args()
-
-cephinfo.get_json()
-write_xml(parsed_args.id)
+        for key in GRAPHITE_OSD_METRICS:
+            carbon_client.send('%s.%s.%s' % (osd_prefix, osd['id'], key), osd[key], timestamp)
+    carbon_client.flush()
+
+
+def render_prometheus(context, pg_states, osd_df):
+    """ Render the SLS values, per state PG counts and per OSD 'osd df' series as Prometheus text """
+    labels = {'slsid': context['slsid']}
+    samples = [('ceph_sls_status', dict(labels, status=context['status']), 1)]
+    for key in GRAPHITE_METRICS:
+        samples.append(('ceph_sls_' + key, labels, context[key]))
+    for state in sorted(pg_states.keys()):
+        samples.append(('ceph_sls_n_pgs_by_state', dict(labels, state=state), pg_states[state]))
+    for key in GRAPHITE_OSD_METRICS:
+        for osd in osd_df:
+            samples.append(('ceph_sls_osd_' + key, dict(labels, osd=osd['id']), osd[key]))
+    return prometheus.render(samples)
+
+
+def refresh_prometheus(slsid, budget, bench_interval):
+    cephinfo.get_json()
+    return render_prometheus(*get_context(slsid, budget, bench_interval))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CERN Ceph SLS Probe")
+    parser.add_argument('-i', '--id', help='SLS ID, e.g. Ceph, Ceph_Preprod, Ceph_Wigner')
+    parser.add_argument('--carbon-server', default=CARBON_SERVER, help='Carbon server (default: %(default)s)')
+    parser.add_argument('--carbon-port', type=int, default=CARBON_PORT, help='Carbon port (default: %(default)s)')
+    parser.add_argument('--carbon-protocol', default=carbon.PLAINTEXT, choices=carbon.PROTOCOLS,
+                        help='Carbon protocol, use port 2004 for pickle (default: %(default)s)')
+    parser.add_argument('--carbon-spool', default=CARBON_SPOOL,
+                        help='Spool metrics here while carbon is unreachable (default: %(default)s)')
+    parser.add_argument('--budget', type=float, default=PROBE_BUDGET,
+                        help='Seconds the probe phases may take, slower phases report degraded results (default: %(default)s)')
+    parser.add_argument('--exporter-port', type=int, default=0,
+                        help='Run as a long-lived Prometheus exporter on this port instead of a one-shot probe')
+    parser.add_argument('--exporter-interval', type=int, default=60,
+                        help='Seconds between exporter snapshot refreshes (default: %(default)s)')
+    parser.add_argument('--exporter-bench-interval', type=int, default=900,
+                        help='Seconds between the exporter rados benches, the last result is reused in between '
+                             '(default: %(default)s)')
+
+    parsed_args, rest = parser.parse_known_args()
+
+    # sample activity in the background while the benchmarks run, get_smooth_activity() won't block
+    cephinfo.start_activity_sampler()
+
+    if parsed_args.exporter_port:
+        server = prometheus.MetricsServer(lambda: refresh_prometheus(parsed_args.id, parsed_args.budget,
+                                                                     parsed_args.exporter_bench_interval),
+                                          parsed_args.exporter_interval, parsed_args.exporter_port)
+        server.serve_forever()
+        sys.exit()
+
+    carbon_client = carbon.CarbonClient(parsed_args.carbon_server, parsed_args.carbon_port,
+                                        protocol=parsed_args.carbon_protocol, spool=parsed_args.carbon_spool)
+    cephinfo.get_json()
+    write_xml(carbon_client, parsed_args.id, parsed_args.budget)
+    carbon_client.close()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+#
+# ceph_chown.py
+#
+# chown all Ceph OSD files to ceph:ceph, which is a needed step for a hammer to jewel
+# upgrade, with as short an OSD downtime as possible.
+#
+# Every OSD directory is walked by its own pool of threads, all OSDs at once: a first pass
+# while the ceph-osd is running fixes nearly everything, then the OSD is stopped for a
+# second pass, and started again. The first pass records the inode and mtime of every
+# directory it has read, so the second pass only re-reads the directories whose entries
+# were created, removed or renamed since; the files of the other directories cannot have
+# changed owner. Changed directories are read in full, as a file deleted and recreated
+# with the same name may reuse the inode of the old one.
+#
+# Usage:
+#
+#   ceph_chown.py [--workers N] [--osd DIR ...]
+#
+# Example usage:
+#
+#   ./ceph_chown.py
+#   ./ceph_chown.py --osd /var/lib/ceph/osd/ceph-12 --workers 32
+#
+
+from optparse import OptionParser
+import Queue
+import commands
+import errno
+import grp
+import logging
+import os
+import pwd
+import stat
+import sys
+import threading
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+logger = logging.getLogger(__name__)
+
+
+def list_dir(path):
+    """ [(name, is a directory)] without following symlinks """
+    if scandir is not None:
+        return [(entry.name, entry.is_dir(follow_symlinks=False)) for entry in scandir(path)]
+    return [(name, stat.S_ISDIR(os.lstat(os.path.join(path, name)).st_mode)) for name in os.listdir(path)]
+
+
+class ChownWalker(object):
+    """ Walk a tree with a pool of threads and chown whatever is not owned by uid:gid.
+
+        walk() can be called again on the same tree: it then skips the directories whose
+        inode and mtime are the same as when they were last read.
+    """
+
+    def __init__(self, uid, gid, workers=8, chown=os.lchown):
+        self.uid = uid
+        self.gid = gid
+        self.n_workers = workers
+        self.chown = chown
+        self.lock = threading.Lock()
+        self.dirs = {}
+        self.reset()
+
+    def reset(self):
+        self.n_entries = 0
+        self.n_dirs_read = 0
+        self.n_chowned = 0
+        self.n_errors = 0
+        self.start = time.time()
+
+    def fix(self, path, st):
+        if st.st_uid == self.uid and st.st_gid == self.gid:
+            return 0
+        try:
+            self.chown(path, self.uid, self.gid)
+            return 1
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return 0
+
+    def visit(self, path):
+        """ chown the directory and its entries, and return its subdirectories """
+        try:
+            st = os.lstat(path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return []
+            raise
+        n_chowned = self.fix(path, st)
+        key = (st.st_ino, st.st_mtime)
+        known = self.dirs.get(path)
+        if known and known[0] == key:
+            with self.lock:
+                self.n_chowned += n_chowned
+                self.n_entries += 1
+            return known[1]
+        subdirs = []
+        n_entries = 1
+        for name, is_dir in list_dir(path):
+            child = os.path.join(path, name)
+            if is_dir:
+                subdirs.append(child)
+                continue
+            try:
+                n_chowned += self.fix(child, os.lstat(child))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            n_entries += 1
+        self.dirs[path] = (key, subdirs)
+        with self.lock:
+            self.n_chowned += n_chowned
+            self.n_entries += n_entries
+            self.n_dirs_read += 1
+        return subdirs
+
+    def work(self, queue):
+        while True:
+            path = queue.get()
+            if path is None:
+                return
+            try:
+                for subdir in self.visit(path):
+                    queue.put(subdir)
+            except Exception:
+                logger.exception("Failed to chown %s", path)
+                with self.lock:
+                    self.n_errors += 1
+            finally:
+                queue.task_done()
+
+    def walk(self, root):
+        self.reset()
+        queue = Queue.Queue()
+        queue.put(root)
+        workers = [threading.Thread(target=self.work, args=(queue,)) for _ in range(self.n_workers)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        queue.join()
+        for _ in workers:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+        return time.time() - self.start
+
+    def progress(self):
+        elapsed = max(time.time() - self.start, 1e-6)
+        return "%d entries (%.0f/s), %d directories read, %d chowned, %d errors in %.0fs" % (
+            self.n_entries, self.n_entries / elapsed, self.n_dirs_read, self.n_chowned, self.n_errors, elapsed)
+
+
+def chown_osd(path, uid, gid, workers, interval):
+    """ Both passes on one OSD directory, with the OSD stopped for the second one """
+    try:
+        with open(os.path.join(path, 'whoami')) as f:
+            osd = f.read().strip()
+    except IOError:
+        logger.error("%s is not mounted", path)
+        return False
+    walker = ChownWalker(uid, gid, workers)
+    done = threading.Event()
+
+    def report():
+        while not done.wait(interval):
+            logger.info("osd.%s: %s", osd, walker.progress())
+    reporter = threading.Thread(target=report)
+    reporter.daemon = True
+    reporter.start()
+    try:
+        logger.info("osd.%s: starting the 1st pass (while ceph-osd is running)", osd)
+        walker.walk(path)
+        logger.info("osd.%s: 1st pass done: %s", osd, walker.progress())
+        commands.getoutput('systemctl stop ceph-osd@%s.service' % osd)
+        stopped = time.time()
+        logger.info("osd.%s: starting the 2nd pass (while ceph-osd is stopped)", osd)
+        walker.walk(path)
+        logger.info("osd.%s: 2nd pass done: %s", osd, walker.progress())
+        # so ceph can open its log, and in case udev doesn't create the journal correctly
+        for name in ('/var/log/ceph/ceph-osd.%s.log' % osd, os.path.join(path, 'journal')):
+            if os.path.exists(name):
+                os.chown(name, uid, gid)
+        commands.getoutput('systemctl start ceph-osd@%s.service' % osd)
+        logger.info("osd.%s: started again, it was down for %.0fs", osd, time.time() - stopped)
+    finally:
+        done.set()
+    return walker.n_errors == 0
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("--osd", dest="osds", action="append", default=[], metavar="DIR",
+                      help="Only chown this OSD directory, may be repeated "
+                           "(default: every OSD directory owned by root)")
+    parser.add_option("-w", "--workers", dest="workers", type="int", default=8,
+                      help="Threads walking each OSD directory (default: %default)")
+    parser.add_option("-u", "--user", dest="user", default="ceph", help="Owner (default: %default)")
+    parser.add_option("-g", "--group", dest="group", default="ceph", help="Group (default: %default)")
+    parser.add_option("-i", "--interval", dest="interval", type="float", default=30,
+                      help="Seconds between progress reports (default: %default)")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    os.environ['PATH'] = '/opt/puppetlabs/bin:' + os.environ['PATH']
+    uid = pwd.getpwnam(options.user).pw_uid
+    gid = grp.getgrnam(options.group).gr_gid
+
+    osds = options.osds or [os.path.join('/var/lib/ceph/osd', name) for name in sorted(os.listdir('/var/lib/ceph/osd'))
+                            if os.stat(os.path.join('/var/lib/ceph/osd', name)).st_uid == 0]
+    if not osds:
+        print "No OSD directories to chown"
+        sys.exit(0)
+
+    commands.getoutput("puppet agent --disable 'chown intervention'")
+    # set noout, because osds can go down for awhile
+    commands.getoutput('ceph osd set noout')
+    commands.getoutput('chown %s:%s /var/log/ceph /var/lib/ceph /var/lib/ceph/* /var/lib/ceph/tmp/* '
+                       '/var/lib/ceph/boot*/* /var/run/ceph' % (options.user, options.group))
+
+    results = {}
+    threads = [threading.Thread(target=lambda path: results.__setitem__(
+        path, chown_osd(path, uid, gid, options.workers, options.interval)), args=(path,)) for path in osds]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # partprobe to recreate journal devs owned by ceph
+    commands.getoutput('partprobe')
+    failed = [path for path in osds if not results.get(path)]
+    if failed:
+        print "Failed to chown %s, check the log before unsetting noout" % ', '.join(failed)
+        sys.exit(1)
+    print "all done. Unset noout, and set puppet ceph user/group to ceph:ceph before re-enabling puppet."
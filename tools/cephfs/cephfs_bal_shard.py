@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#
+# cephfs_bal_shard.py
+#
+# Balance the subdirectories of some CephFS directories over the active MDS ranks with
+# export pins (ceph.dir.pin).
+#
+# All the roots are planned in one process: the subdirectories of every root of a cluster
+# are weighed by their recursive entries (ceph.dir.rentries, the metadata the MDS serves)
+# or bytes (ceph.dir.rbytes), and spread over max_mds ranks either by bin packing, which
+# keeps the current pin of a subdirectory when its rank is not overloaded, or by
+# rendezvous hashing of the name, which ignores the weights but only moves 1/n of the
+# subdirectories when max_mds changes to n. A subdirectory which is itself one of the
+# roots is left to its own subdirectories. Only the pins which differ from the current
+# ones are written. The xattrs are read and written by a pool of threads.
+#
+# Usage:
+#
+#   cephfs_bal_shard.py [--method pack|hash] [--weight entries|bytes] [--really] CLUSTER:DIR ...
+#
+# Example usage:
+#
+#   ./cephfs_bal_shard.py dwight:/cephfs-dwight dwight:/cephfs-dwight/volumes/_nogroup
+#   ./cephfs_bal_shard.py --really dwight:/cephfs-dwight dwight:/cephfs-dwight/volumes/_nogroup
+#
+
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+import commands
+import errno
+import hashlib
+import json
+import os
+import sys
+
+try:
+    import xattr
+except ImportError:
+    xattr = None
+
+PIN = 'ceph.dir.pin'
+WEIGHTS = {'entries': 'ceph.dir.rentries', 'bytes': 'ceph.dir.rbytes'}
+
+
+class Xattrs(object):
+    """ The xattrs of the mounted filesystem, with the xattr module or getfattr/setfattr """
+
+    def get(self, path, name):
+        if xattr is not None:
+            try:
+                return xattr.getxattr(path, name)
+            except EnvironmentError as e:
+                if e.errno in (errno.ENODATA, errno.ENOENT):
+                    return None
+                raise
+        status, output = commands.getstatusoutput('getfattr --only-values -n %s%s 2>/dev/null' %
+                                                  (name, commands.mkarg(path)))
+        return output if status == 0 else None
+
+    def set(self, path, name, value):
+        if xattr is not None:
+            xattr.setxattr(path, name, value)
+            return
+        status, output = commands.getstatusoutput('setfattr -n %s -v %s%s' % (name, value, commands.mkarg(path)))
+        if status != 0:
+            raise IOError(output)
+
+
+def subdirs(root, roots):
+    """ The subdirectories of root which are not roots themselves """
+    return [path for path in (os.path.join(root, name) for name in sorted(os.listdir(root)))
+            if os.path.isdir(path) and not os.path.islink(path) and os.path.normpath(path) not in roots]
+
+
+def read_dir(xattrs, path, weight):
+    """ (path, weight, current pin or -1) """
+    value = xattrs.get(path, WEIGHTS[weight])
+    pin = xattrs.get(path, PIN)
+    return path, int(value or 0), int(pin) if pin not in (None, '') else -1
+
+
+def pack(dirs, n_ranks, tolerance=0.1):
+    """ {path: rank}: greedy bin packing of the heaviest first onto the lightest rank
+
+        A directory keeps its current rank as long as that stays within tolerance of the
+        mean load, so that rerunning the plan migrates as few subtrees as possible.
+    """
+    total = sum(weight for path, weight, pin in dirs)
+    limit = (1 + tolerance) * total / n_ranks
+    loads = [0] * n_ranks
+    plan = {}
+    moved = []
+    for path, weight, pin in sorted(dirs, key=lambda d: (-d[1], d[0])):
+        if 0 <= pin < n_ranks and loads[pin] + weight <= limit:
+            plan[path] = pin
+            loads[pin] += weight
+        else:
+            moved.append((path, weight))
+    for path, weight in moved:
+        rank = min(range(n_ranks), key=lambda r: (loads[r], r))
+        plan[path] = rank
+        loads[rank] += weight
+    return plan
+
+
+def rendezvous(dirs, n_ranks):
+    """ {path: rank} with the highest hash of the name and the rank """
+    return dict((path, max(range(n_ranks), key=lambda r: hashlib.md5('%s/%d' % (os.path.basename(path), r)).digest()))
+                for path, weight, pin in dirs)
+
+
+def rank_loads(dirs, pins, n_ranks):
+    """ The total weight per rank, and of the unpinned directories """
+    loads = defaultdict(int)
+    for path, weight, pin in dirs:
+        rank = pins.get(path, pin)
+        loads[rank if 0 <= rank < n_ranks else -1] += weight
+    return loads
+
+
+def max_mds(cluster):
+    return json.loads(commands.getoutput('ceph mds dump --format json --cluster %s 2>/dev/null' % cluster))['max_mds']
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %prog [options] CLUSTER:DIR ...")
+    parser.add_option("-m", "--method", dest="method", default="pack", choices=['pack', 'hash'],
+                      help="pack: balance the weights, keeping the current pins where possible; "
+                           "hash: rendezvous hash of the names (default: %default)")
+    parser.add_option("-w", "--weight", dest="weight", default="entries", choices=sorted(WEIGHTS),
+                      help="Weigh directories by their recursive entries or bytes (default: %default)")
+    parser.add_option("-t", "--tolerance", dest="tolerance", type="float", default=0.1,
+                      help="Keep a current pin while its rank is at most this much above the mean (default: %default)")
+    parser.add_option("--max-mds", dest="max_mds", type="int",
+                      help="Ranks to pin to (default: max_mds of each cluster)")
+    parser.add_option("-p", "--parallel", dest="parallel", type="int", default=16,
+                      help="Concurrent xattr reads and writes (default: %default)")
+    parser.add_option("-v", "--verbose", dest="verbose", default=False, action="store_true",
+                      help="List every directory, not only those whose pin changes")
+    parser.add_option("-r", "--really", dest="really", default=False, action="store_true",
+                      help="Really write the pins; without it only the plan is shown")
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("no CLUSTER:DIR to balance")
+
+    roots = defaultdict(set)
+    for arg in args:
+        cluster, _, root = arg.partition(':')
+        if not root:
+            parser.error("%s is not CLUSTER:DIR" % arg)
+        roots[cluster].add(os.path.normpath(root))
+
+    xattrs = Xattrs()
+    workers = ThreadPool(options.parallel)
+    changes = []
+    for cluster in sorted(roots):
+        n_ranks = options.max_mds or max_mds(cluster)
+        paths = [path for top in sorted(roots[cluster]) for path in subdirs(top, roots[cluster])]
+        dirs = workers.map(lambda path: read_dir(xattrs, path, options.weight), paths)
+        if options.method == 'pack':
+            plan = pack(dirs, n_ranks, options.tolerance)
+        else:
+            plan = rendezvous(dirs, n_ranks)
+
+        before, after = rank_loads(dirs, {}, n_ranks), rank_loads(dirs, plan, n_ranks)
+        print "%s: %d directories under %d roots on %d ranks" % (cluster, len(dirs), len(roots[cluster]), n_ranks)
+        print "%-8s %16s %16s" % ('RANK', 'BEFORE', 'AFTER')
+        for rank in sorted(set(before) | set(after)):
+            print "%-8s %16d %16d" % (rank if rank >= 0 else 'unpinned', before.get(rank, 0), after.get(rank, 0))
+        print
+        for path, weight, pin in dirs:
+            if plan[path] != pin:
+                changes.append((path, plan[path]))
+            if plan[path] != pin or options.verbose:
+                print "%-64s %14d %4d -> %d" % (path, weight, pin, plan[path])
+        print
+
+    print "%d pins to change" % len(changes)
+    if not options.really:
+        print "Not writing any pin without --really"
+        sys.exit(0)
+    try:
+        workers.map(lambda (path, rank): xattrs.set(path, PIN, str(rank)), changes)
+    finally:
+        workers.close()
+    print "Pinned %d directories" % len(changes)
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+
+from cephfs_bal_shard import PIN, WEIGHTS, Xattrs, pack, rank_loads, read_dir, rendezvous, subdirs
+
+
+class FakeXattrs(Xattrs):
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, path, name):
+        return self.values.get((os.path.normpath(path), name))
+
+    def set(self, path, name, value):
+        self.values[(os.path.normpath(path), name)] = str(value)
+
+
+def test_plan():
+    dirs = [('a', 100, -1), ('b', 60, -1), ('c', 50, -1), ('d', 40, -1), ('e', 10, 1)]
+    plan = pack(dirs, 2)
+    loads = rank_loads(dirs, plan, 2)
+    assert loads[0] + loads[1] == 260 and abs(loads[0] - loads[1]) <= 20, loads
+    # a balanced plan is stable
+    assert pack([(path, weight, plan[path]) for path, weight, pin in dirs], 2) == plan
+    # an overloaded rank loses its lightest directories first
+    plan = pack([('a', 100, 0), ('b', 60, 0), ('c', 50, 0), ('d', 40, 0), ('e', 10, 0)], 2)
+    assert plan['a'] == 0 and plan['b'] == 1
+
+    dirs = [('/r/%d' % i, 1, -1) for i in range(1000)]
+    three, four = rendezvous(dirs, 3), rendezvous(dirs, 4)
+    moved = sum(1 for path in three if three[path] != four[path])
+    assert all(four[path] == 3 for path in three if three[path] != four[path])
+    assert 150 < moved < 350, moved
+
+
+def test_scan():
+    top = tempfile.mkdtemp()
+    try:
+        for d in ('x', 'y', 'z', 'volumes/v1', 'volumes/v2'):
+            os.makedirs(os.path.join(top, d))
+        os.symlink(os.path.join(top, 'x'), os.path.join(top, 'link'))
+        values = {}
+        for d, entries in (('x', 500), ('y', 300), ('z', 200), ('volumes/v1', 400), ('volumes/v2', 400)):
+            values[(os.path.join(top, d), WEIGHTS['entries'])] = str(entries)
+        values[(os.path.join(top, 'x'), PIN)] = '0'
+        xattrs = FakeXattrs(values)
+        roots = set([top, os.path.join(top, 'volumes')])
+        dirs = [read_dir(xattrs, path, 'entries') for root in sorted(roots) for path in subdirs(root, roots)]
+        assert [os.path.relpath(path, top) for path, weight, pin in dirs] == \
+            ['x', 'y', 'z', 'volumes/v1', 'volumes/v2']
+        assert dirs[0][1:] == (500, 0) and dirs[1][1:] == (300, -1)
+        plan = pack(dirs, 3)
+        assert plan[os.path.join(top, 'x')] == 0
+        assert sorted(rank_loads(dirs, plan, 3).values()) == [500, 600, 700]
+    finally:
+        shutil.rmtree(top)
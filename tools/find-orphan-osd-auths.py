@@ -8,15 +8,15 @@ cephinfo.init_osd()
 
 yesno = 'n'
 
+osd_states = dict(("osd.%d" % osd['osd'], osd['state']) for osd in cephinfo.osd_data['osds'])
+
 for entry in cephinfo.auth_data['auth_dump']:
   entity = entry['entity']
   if not entity.startswith('osd'):
     continue
 
-  for osd in cephinfo.osd_data['osds']:
-    if "osd.%d" % osd['osd'] == entity:
-      print "auth'd osd %s is in state %s" % (entity, osd['state'])
-      break
+  if entity in osd_states:
+    print "auth'd osd %s is in state %s" % (entity, osd_states[entity])
   else:
     print "auth'd osd %s doesn't exist" % entity
     if yesno == 'all':
@@ -22,40 +22,72 @@ This is a loose port to python of the Perl version at
 http://www.pandamatak.com/people/anand/xfer/histo
 
 https://github.com/bitly/data_hacks
+
+Input is parsed in chunks of floats. Buckets are found by binary search,
+with their edges computed in Decimal so that values on an edge land in the
+same bucket as when every value was a Decimal,
+mean and variance are merged per chunk, and quantiles are either exact or
+estimated with a t-digest in bounded memory (--sketch). numpy is used for
+the per chunk work when it is installed.
 """
 
 import sys
-from decimal import Decimal
+import bisect
+import itertools
 import logging
 import math
+from array import array
 from optparse import OptionParser
 from collections import namedtuple
+from decimal import Decimal
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# lines parsed per chunk
+CHUNK_SIZE = 65536
+
+# t-digest compression: more centroids, more precise quantiles
+SKETCH_COMPRESSION = 200
 
 
 class MVSD(object):
     "A class that calculates a running Mean / Variance / Standard Deviation"
     def __init__(self):
         self.is_started = False
-        self.ss = Decimal(0)  # (running) sum of square deviations from mean
-        self.m = Decimal(0)  # (running) mean
-        self.total_w = Decimal(0)  # weight of items seen
+        self.ss = 0.0  # (running) sum of square deviations from mean
+        self.m = 0.0  # (running) mean
+        self.total_w = 0  # weight of items seen
 
     def add(self, x, w=1):
         "add another datapoint to the Mean / Variance / Standard Deviation"
-        if not isinstance(x, Decimal):
-            x = Decimal(x)
+        self.add_moments(w, float(x), 0.0)
+
+    def add_moments(self, w, m, ss):
+        "merge the weight, mean and sum of square deviations of another sample"
+        if not w:
+            return
         if not self.is_started:
-            self.m = x
-            self.ss = Decimal(0)
+            self.m = m
+            self.ss = ss
             self.total_w = w
             self.is_started = True
         else:
             temp_w = self.total_w + w
-            self.ss += (self.total_w * w * (x - self.m) *
-                        (x - self.m)) / temp_w
-            self.m += (x - self.m) / temp_w
+            delta = m - self.m
+            self.ss += ss + delta * delta * self.total_w * w / float(temp_w)
+            self.m += delta * w / float(temp_w)
             self.total_w = temp_w
 
+    def add_chunk(self, values, counts=None):
+        "add a chunk of values, each seen once or counts times"
+        self.add_moments(*chunk_moments(values, counts))
+
+    def merge(self, other):
+        self.add_moments(other.total_w, other.m, other.ss)
+
     def var(self):
         return self.ss / self.total_w
 
@@ -68,6 +100,35 @@ class MVSD(object):
 DataPoint = namedtuple('DataPoint', ['value', 'count'])
 
 
+def chunk_moments(values, counts=None):
+    "(weight, mean, sum of square deviations) of a chunk, computed in two passes"
+    if numpy is not None:
+        values = numpy.asarray(values, dtype=float)
+        if counts is None:
+            w = len(values)
+            if not w:
+                return 0, 0.0, 0.0
+            m = values.mean()
+            return w, float(m), float(((values - m) ** 2).sum())
+        counts = numpy.asarray(counts)
+        w = int(counts.sum())
+        if not w:
+            return 0, 0.0, 0.0
+        m = (values * counts).sum() / w
+        return w, float(m), float((counts * (values - m) ** 2).sum())
+    if counts is None:
+        w = len(values)
+        if not w:
+            return 0, 0.0, 0.0
+        m = math.fsum(values) / w
+        return w, m, math.fsum((v - m) * (v - m) for v in values)
+    w = sum(counts)
+    if not w:
+        return 0, 0.0, 0.0
+    m = math.fsum(v * c for v, c in itertools.izip(values, counts)) / w
+    return w, m, math.fsum(c * (v - m) * (v - m) for v, c in itertools.izip(values, counts))
+
+
 def test_mvsd():
     mvsd = MVSD()
     for x in range(10):
@@ -77,27 +138,94 @@ def test_mvsd():
     assert '%.2f' % mvsd.var() == "8.25"
     assert '%.14f' % mvsd.sd() == "2.87228132326901"
 
+    # the same, merged from chunks
+    merged = MVSD()
+    merged.add_chunk([0, 1, 2, 3])
+    other = MVSD()
+    other.add_chunk([4, 5, 9], [1, 1, 1])
+    other.add_chunk([6, 7, 8])
+    merged.merge(other)
+    assert '%.2f' % merged.mean() == "4.50"
+    assert '%.2f' % merged.var() == "8.25"
+    weighted = MVSD()
+    weighted.add(1, 3)
+    weighted.add(5, 1)
+    assert '%.2f' % weighted.mean() == "2.00"
+
+
+def parse_line(line, agg_value_key, agg_key_value):
+    "(value, count) of one input line, None for blank lines; raises ValueError"
+    clean_line = line.strip()
+    if not clean_line:
+        # skip empty lines (ie: newlines)
+        return None
+    if clean_line[0] in ['"', "'"]:
+        clean_line = clean_line.strip("\"'")
+    if agg_key_value:
+        key, value = clean_line.rstrip().rsplit(None, 1)
+        return float(key), int(value)
+    elif agg_value_key:
+        value, key = clean_line.lstrip().split(None, 1)
+        return float(key), int(value)
+    else:
+        return float(clean_line), 1
+
 
-def load_stream(input_stream, agg_value_key, agg_key_value):
-    for line in input_stream:
-        clean_line = line.strip()
-        if not clean_line:
-            # skip empty lines (ie: newlines)
-            continue
-        if clean_line[0] in ['"', "'"]:
-            clean_line = clean_line.strip("\"'")
+def parse_lines(lines, agg_value_key, agg_key_value):
+    values = []
+    counts = []
+    for line in lines:
         try:
-            if agg_key_value:
-                key, value = clean_line.rstrip().rsplit(None, 1)
-                yield DataPoint(Decimal(key), int(value))
-            elif agg_value_key:
-                value, key = clean_line.lstrip().split(None, 1)
-                yield DataPoint(Decimal(key), int(value))
-            else:
-                yield DataPoint(Decimal(clean_line), 1)
-        except:
+            parsed = parse_line(line, agg_value_key, agg_key_value)
+        except ValueError:
             logging.exception('failed %r', line)
             print >>sys.stderr, "invalid line %r" % line
+            continue
+        if parsed is not None:
+            values.append(parsed[0])
+            counts.append(parsed[1])
+    return values, counts
+
+
+def load_stream(input_stream, agg_value_key, agg_key_value):
+    for values, counts in load_chunks(input_stream, agg_value_key, agg_key_value):
+        if counts is None:
+            for value in values:
+                yield DataPoint(value, 1)
+        else:
+            for value, count in itertools.izip(values, counts):
+                yield DataPoint(value, count)
+
+
+def load_chunks(input_stream, agg_value_key, agg_key_value, chunk_size=CHUNK_SIZE):
+    """
+    Yields (values, counts) for each chunk_size lines of input; counts is None
+    when every value was seen once.
+    """
+    while True:
+        lines = list(itertools.islice(input_stream, chunk_size))
+        if not lines:
+            return
+        if not agg_value_key and not agg_key_value:
+            try:
+                # fast path: a clean column of numbers
+                yield map(float, lines), None
+                continue
+            except ValueError:
+                values, counts = parse_lines(lines, False, False)
+                yield values, None
+                continue
+        yield parse_lines(lines, agg_value_key, agg_key_value)
+
+
+def point_chunks(points, chunk_size=CHUNK_SIZE):
+    "Regroup an iterable of DataPoint into (values, counts) chunks"
+    points = iter(points)
+    while True:
+        chunk = list(itertools.islice(points, chunk_size))
+        if not chunk:
+            return
+        yield [float(p.value) for p in chunk], [p.count for p in chunk]
 
 
 def median(values, key=None):
@@ -121,38 +249,162 @@ def test_median():
     assert "4.50" == "%.2f" % median([4.0, 5, 2, 1, 9, 10])
 
 
-def histogram(stream, options):
+class ExactQuantiles(object):
+    "Keeps every value, sorting once when a quantile is asked for"
+    def __init__(self):
+        self.chunks = []
+        self.weighted = False
+        self.sorted = None
+
+    def add_chunk(self, values, counts=None):
+        if counts is not None:
+            self.weighted = True
+        self.chunks.append((values, counts))
+        self.sorted = None
+
+    def prepare(self):
+        if not self.weighted:
+            if numpy is not None:
+                values = numpy.sort(numpy.concatenate([numpy.asarray(v, dtype=float) for v, _ in self.chunks]))
+            else:
+                values = sorted(itertools.chain.from_iterable(v for v, _ in self.chunks))
+            self.sorted = (values, None)
+            return
+        pairs = []
+        for values, counts in self.chunks:
+            if counts is None:
+                counts = itertools.repeat(1)
+            pairs.extend(itertools.izip(values, counts))
+        pairs.sort()
+        self.sorted = ([v for v, _ in pairs], cumsum(c for _, c in pairs))
+
+    def value_at(self, rank):
+        values, cumulative = self.sorted
+        if cumulative is None:
+            return float(values[rank])
+        return float(values[bisect.bisect_right(cumulative, rank)])
+
+    def total(self):
+        values, cumulative = self.sorted
+        return len(values) if cumulative is None else cumulative[-1]
+
+    def quantile(self, q):
+        "Linear interpolation between the closest ranks, so that the median of an even count is the mean of the middle two"
+        if self.sorted is None:
+            self.prepare()
+        total = self.total()
+        if not total:
+            raise ValueError('no values')
+        position = q * (total - 1)
+        lo = int(math.floor(position))
+        hi = int(math.ceil(position))
+        v_lo = self.value_at(lo)
+        return v_lo + (self.value_at(hi) - v_lo) * (position - lo)
+
+
+def cumsum(counts):
+    total = 0
+    cumulative = []
+    for c in counts:
+        total += c
+        cumulative.append(total)
+    return cumulative
+
+
+class TDigest(object):
     """
-    Loop over the stream and add each entry to the dataset, printing out at the
-    end.
-
-    stream yields Decimal()
+    Merging t-digest (Dunning): a sorted list of (mean, weight) centroids,
+    small near the tails and large around the median, so that quantiles are
+    estimated within a fraction of a percent in O(compression) memory.
     """
-    if not options.min or not options.max:
-        # glob the iterator here so we can do min/max on it
-        data = list(stream)
-    else:
-        data = stream
-    bucket_scale = 1
-
-    if options.min:
-        min_v = Decimal(options.min)
-    else:
-        min_v = min(data, key=lambda x: x.value)
-        min_v = min_v.value
-    if options.max:
-        max_v = Decimal(options.max)
-    else:
-        max_v = max(data, key=lambda x: x.value)
-        max_v = max_v.value
+    def __init__(self, compression=SKETCH_COMPRESSION):
+        self.compression = compression
+        self.centroids = []
+        self.buffer = []
+        self.total = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add_chunk(self, values, counts=None):
+        if hasattr(values, 'tolist'):
+            values = values.tolist()
+        if not values:
+            return
+        self.min = min(self.min, min(values))
+        self.max = max(self.max, max(values))
+        if counts is None:
+            self.buffer.extend((v, 1) for v in values)
+        else:
+            if hasattr(counts, 'tolist'):
+                counts = counts.tolist()
+            self.buffer.extend(itertools.izip(values, counts))
+        if len(self.buffer) > 20 * self.compression:
+            self.compress()
+
+    def compress(self):
+        if not self.buffer:
+            return
+        points = self.centroids + self.buffer
+        points.sort()
+        self.buffer = []
+        total = float(sum(w for _, w in points))
+        merged = []
+        cumulative = 0.0
+        mean, weight = points[0]
+        for m, w in itertools.islice(points, 1, None):
+            q = (cumulative + (weight + w) / 2.0) / total
+            if weight + w <= 4 * total * q * (1 - q) / self.compression:
+                weight += w
+                mean += (m - mean) * w / float(weight)
+            else:
+                merged.append((mean, weight))
+                cumulative += weight
+                mean, weight = m, w
+        merged.append((mean, weight))
+        self.centroids = merged
+        self.total = total
+
+    def merge(self, other):
+        other.compress()
+        self.buffer.extend(other.centroids)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+
+    def quantile(self, q):
+        "Interpolates between centroid centres, and between the extreme centroids and min / max"
+        self.compress()
+        if not self.centroids:
+            raise ValueError('no values')
+        rank = q * self.total
+        previous_mean, previous_rank = self.min, 0.0
+        cumulative = 0.0
+        for mean, weight in self.centroids:
+            centre = cumulative + weight / 2.0
+            if rank <= centre:
+                if centre == previous_rank:
+                    return mean
+                return previous_mean + (mean - previous_mean) * (rank - previous_rank) / (centre - previous_rank)
+            previous_mean, previous_rank = mean, centre
+            cumulative += weight
+        if self.total == previous_rank:
+            return self.max
+        return previous_mean + (self.max - previous_mean) * (rank - previous_rank) / (self.total - previous_rank)
+
+
+def bucket_boundaries(options, min_v, max_v):
+    """
+    The upper edge of each bucket, the lower edge of the first being min_v.
 
-    if not max_v > min_v:
-        raise ValueError('max must be > min. max:%s min:%s' % (max_v, min_v))
+    The edges are computed in Decimal, from the shortest repr of min_v and
+    max_v, and only then rounded to floats: float steps can fall just below
+    a decimal edge (0.7 / 7 * 4 < 0.4), and an input value of 0.4 would land
+    in the next bucket.
+    """
+    min_v = Decimal(repr(float(min_v)))
+    max_v = Decimal(repr(float(max_v)))
     diff = max_v - min_v
-
     boundaries = []
-    bucket_counts = []
-    buckets = 0
 
     if options.custbuckets:
         bound = options.custbuckets.split(',')
@@ -172,8 +424,6 @@ def histogram(stream, options):
 
         # beware: the min_v is not included in the boundaries,
         # so no need to do a -1!
-        bucket_counts = [0 for x in range(len(boundaries))]
-        buckets = len(boundaries)
     elif options.logscale:
         buckets = options.buckets and int(options.buckets) or 10
         if buckets <= 0:
@@ -198,7 +448,6 @@ def histogram(stream, options):
             for i in range(k):
                 sum += 2**i * x
                 yield sum
-        bucket_counts = [0 for x in range(buckets)]
         for step in log_steps(buckets, diff):
             boundaries.append(min_v + step)
     else:
@@ -206,56 +455,163 @@ def histogram(stream, options):
         if buckets <= 0:
             raise ValueError('# of buckets must be > 0')
         step = diff / buckets
-        bucket_counts = [0 for x in range(buckets)]
         for x in range(buckets):
             boundaries.append(min_v + (step * (x + 1)))
+    return [float(boundary) for boundary in boundaries]
+
+
+def bin_chunk(bucket_counts, boundaries, min_v, max_v, values, counts=None):
+    """
+    Add a chunk to bucket_counts: a value goes in the first bucket whose upper
+    boundary is >= value. Returns the weight of the values outside min/max.
+    """
+    if numpy is not None:
+        values = numpy.asarray(values, dtype=float)
+        weights = numpy.ones(len(values), dtype=numpy.int64) if counts is None else numpy.asarray(counts)
+        inside = (values >= min_v) & (values <= max_v)
+        index = numpy.searchsorted(boundaries, values[inside], side='left')
+        binned = numpy.bincount(index, weights=weights[inside], minlength=len(boundaries) + 1)
+        for i in range(len(bucket_counts)):
+            bucket_counts[i] += int(binned[i])
+        return int(weights[~inside].sum())
 
     skipped = 0
-    samples = 0
-    mvsd = MVSD()
-    accepted_data = []
-    for record in data:
-        samples += record.count
-        if options.mvsd:
-            mvsd.add(record.value, record.count)
-            accepted_data.append(record)
-        # find the bucket this goes in
-        if record.value < min_v or record.value > max_v:
-            skipped += record.count
+    n_buckets = len(boundaries)
+    find = bisect.bisect_left
+    if counts is None:
+        counts = itertools.repeat(1)
+    for value, count in itertools.izip(values, counts):
+        if value < min_v or value > max_v:
+            skipped += count
             continue
-        for bucket_postion, boundary in enumerate(boundaries):
-            if record.value <= boundary:
-                bucket_counts[bucket_postion] += record.count
-                break
+        i = find(boundaries, value)
+        if i < n_buckets:
+            bucket_counts[i] += count
+    return skipped
+
+
+class Summary(object):
+    "Everything histogram() prints, computed in one pass over the chunks"
+    def __init__(self, options):
+        self.options = options
+        self.mvsd = MVSD()
+        self.quantiles = TDigest() if getattr(options, 'sketch', False) else ExactQuantiles()
+        self.want_quantiles = options.mvsd or bool(getattr(options, 'quantiles', None))
+        self.samples = 0
+        self.skipped = 0
+        self.min_v = float(options.min) if options.min else None
+        self.max_v = float(options.max) if options.max else None
+        # with both limits known the buckets are filled as we go, otherwise the chunks are kept
+        self.streaming = self.min_v is not None and self.max_v is not None
+        self.kept = []
+        self.boundaries = None
+        self.bucket_counts = None
+        if self.streaming:
+            self.make_buckets()
+
+    def make_buckets(self):
+        if not self.max_v > self.min_v:
+            raise ValueError('max must be > min. max:%s min:%s' % (self.max_v, self.min_v))
+        self.boundaries = bucket_boundaries(self.options, self.min_v, self.max_v)
+        self.bucket_counts = [0 for x in range(len(self.boundaries))]
+
+    def add_chunk(self, values, counts=None):
+        if not len(values):
+            return
+        if numpy is not None:
+            values = numpy.asarray(values, dtype=float)
+            if counts is not None:
+                counts = numpy.asarray(counts, dtype=numpy.int64)
+        self.samples += len(values) if counts is None else int(sum(counts))
+        if self.options.mvsd:
+            self.mvsd.add_chunk(values, counts)
+        if self.want_quantiles:
+            self.quantiles.add_chunk(values, counts)
+        if self.streaming:
+            self.skipped += bin_chunk(self.bucket_counts, self.boundaries, self.min_v, self.max_v, values, counts)
+            return
+        if numpy is None:
+            values = array('d', values)
+            if counts is not None:
+                counts = array('l', counts)
+        self.kept.append((values, counts))
+        if numpy is not None:
+            chunk_min, chunk_max = float(values.min()), float(values.max())
+        else:
+            chunk_min, chunk_max = min(values), max(values)
+        if not self.options.min:
+            self.min_v = chunk_min if self.min_v is None else min(self.min_v, chunk_min)
+        if not self.options.max:
+            self.max_v = chunk_max if self.max_v is None else max(self.max_v, chunk_max)
+
+    def finish(self):
+        if not self.samples:
+            raise ValueError('no input values')
+        if not self.streaming:
+            self.make_buckets()
+            for values, counts in self.kept:
+                self.skipped += bin_chunk(self.bucket_counts, self.boundaries, self.min_v, self.max_v,
+                                          values, counts)
+            self.kept = []
+
+
+def histogram(stream, options):
+    """
+    Loop over the stream and add each entry to the dataset, printing out at the
+    end.
+
+    stream yields DataPoint()
+    """
+    histogram_chunks(point_chunks(stream), options)
+
+
+def histogram_chunks(chunks, options):
+    """
+    Same as histogram(), for (values, counts) chunks as yielded by load_chunks()
+    """
+    summary = Summary(options)
+    for values, counts in chunks:
+        summary.add_chunk(values, counts)
+    summary.finish()
+    print_histogram(summary, options)
+    return summary
+
+
+def print_histogram(summary, options):
+    bucket_scale = 1
+    bucket_counts = summary.bucket_counts
+    samples = summary.samples
 
     # auto-pick the hash scale
     if max(bucket_counts) > 75:
         bucket_scale = int(max(bucket_counts) / 75)
 
     print("# NumSamples = %d; Min = %0.2f; Max = %0.2f" %
-          (samples, min_v, max_v))
-    if skipped:
+          (samples, summary.min_v, summary.max_v))
+    if summary.skipped:
         print("# %d value%s outside of min/max" %
-              (skipped, skipped > 1 and 's' or ''))
+              (summary.skipped, summary.skipped > 1 and 's' or ''))
     if options.mvsd:
         print("# Mean = %f; Variance = %f; SD = %f; Median %f" %
-              (mvsd.mean(), mvsd.var(), mvsd.sd(),
-               median(accepted_data, key=lambda x: x.value)))
+              (summary.mvsd.mean(), summary.mvsd.var(), summary.mvsd.sd(),
+               summary.quantiles.quantile(0.5)))
+    if getattr(options, 'quantiles', None):
+        print("# " + "; ".join("p%s = %f" % (q, summary.quantiles.quantile(float(q) / 100))
+                               for q in options.quantiles.split(',')))
     print "# each " + options.dot + " represents a count of %d" % bucket_scale
-    bucket_min = min_v
-    bucket_max = min_v
+    bucket_min = summary.min_v
+    bucket_max = summary.min_v
     percentage = ""
     format_string = options.format + ' - ' + options.format + ' [%6d]: %s%s'
-    for bucket in range(buckets):
+    for bucket in range(len(bucket_counts)):
         bucket_min = bucket_max
-        bucket_max = boundaries[bucket]
+        bucket_max = summary.boundaries[bucket]
         bucket_count = bucket_counts[bucket]
         star_count = 0
         if bucket_count:
             star_count = bucket_count / bucket_scale
         if options.percentage:
-            percentage = " (%0.2f%%)" % (100 * Decimal(bucket_count) /
-                                         Decimal(samples))
+            percentage = " (%0.2f%%)" % (100.0 * bucket_count / samples)
         print format_string % (bucket_min, bucket_max, bucket_count, options.dot *
                                star_count, percentage)
 
@@ -284,6 +640,12 @@ if __name__ == "__main__":
     parser.add_option("--no-mvsd", dest="mvsd", action="store_false",
                       default=True, help="Disable the calculation of Mean, " +
                       "Variance and SD (improves performance)")
+    parser.add_option("-q", "--quantiles", dest="quantiles",
+                      help="Comma seperated list of percentiles to print, e.g. 50,90,99")
+    parser.add_option("--sketch", dest="sketch", default=False, action="store_true",
+                      help="Estimate the median and quantiles with a t-digest " +
+                      "instead of keeping every value; with --min and --max " +
+                      "the memory used no longer grows with the input")
     parser.add_option("-f", "--bucket-format", dest="format", default="%10.4f",
                       help="format for bucket numbers")
     parser.add_option("-p", "--percentage", dest="percentage", default=False,
@@ -296,5 +658,5 @@ if __name__ == "__main__":
         parser.print_usage()
         print "for more help use --help"
         sys.exit(1)
-    histogram(load_stream(sys.stdin, options.agg_value_key,
-                          options.agg_key_value), options)
+    histogram_chunks(load_chunks(sys.stdin, options.agg_value_key,
+                                 options.agg_key_value), options)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+#
+# hot_pgs.py
+#
+# Find the hot PGs, pools, OSDs and hosts from the read/write counters in the pg dump.
+#
+# Each snapshot keeps only the pgids, acting sets and the num_read, num_read_kb,
+# num_write and num_write_kb counters of every PG. The per PG rates are the differences
+# between the newest and the oldest kept snapshot, divided by the time between them.
+# Reads are attributed to the acting primary, writes to every OSD of the acting set;
+# OSDs are grouped into hosts with the CRUSH tree.
+#
+# Unlike top/rbdtop.sh, this needs no debug logging on the OSDs: the counters are always
+# there. They are only as fresh as the last stats report of each OSD, so intervals
+# below 30s are noisy.
+#
+# Usage:
+#
+#   hot_pgs.py [-i SECONDS] [-c COUNT] [-n TOP] [--state FILE]
+#
+# Example usage:
+#
+#   ./hot_pgs.py -i 60                  # two snapshots, 60s apart
+#   ./hot_pgs.py -i 30 -c 0 -k 4        # refresh every 30s, rates over the last 2 minutes
+#   ./hot_pgs.py --state /var/tmp/hot_pgs.json --json   # from cron: rates since the previous run
+#
+
+from collections import defaultdict, deque
+from itertools import izip
+from optparse import OptionParser
+from array import array
+import commands
+import json
+import os
+import sys
+import time
+
+from cephinfo import cephinfo
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COUNTERS = ('num_read', 'num_read_kb', 'num_write', 'num_write_kb')
+R_OPS, R_KB, W_OPS, W_KB = range(len(COUNTERS))
+SORT_KEYS = ('ops', 'bytes', 'read_ops', 'write_ops', 'read_bytes', 'write_bytes')
+
+
+class Snapshot(object):
+    """ pgids, acting sets and a flat array of the 4 counters per PG, at one time """
+
+    def __init__(self, t, pgids, acting, counters):
+        self.time = t
+        self.pgids = pgids
+        self.acting = acting
+        self.counters = counters
+
+    @classmethod
+    def from_pg_stats(cls, t, pg_stats):
+        pgids = []
+        acting = []
+        counters = array('d')
+        for pg in pg_stats:
+            stat_sum = pg['stat_sum']
+            pgids.append(pg['pgid'])
+            acting.append(pg['acting'])
+            counters.extend(stat_sum.get(counter, 0) for counter in COUNTERS)
+        return cls(t, pgids, acting, counters)
+
+    def to_json(self):
+        return {'time': self.time, 'pgids': self.pgids, 'acting': self.acting, 'counters': list(self.counters)}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['time'], data['pgids'], data['acting'], array('d', data['counters']))
+
+
+def get_snapshot():
+    out = json.loads(commands.getoutput('ceph pg dump pgs --format=json 2>/dev/null'))
+    # nautilus wraps the list
+    if isinstance(out, dict):
+        out = out['pg_stats']
+    return Snapshot.from_pg_stats(time.time(), out)
+
+
+def pg_rates(old, new):
+    """ [(pgid, acting, [read ops/s, read kB/s, write ops/s, write kB/s])] from old to new
+
+        PGs missing from the old snapshot (created, split) are skipped, and counters
+        that went backwards are taken as zero.
+    """
+    dt = float(new.time - old.time)
+    if dt <= 0:
+        raise ValueError('snapshots are not in time order')
+    n = len(COUNTERS)
+    if old.pgids == new.pgids:
+        before = old.counters
+        pgids = new.pgids
+        acting = new.acting
+        after = new.counters
+    else:
+        index = dict((pgid, i) for i, pgid in enumerate(old.pgids))
+        keep = [i for i, pgid in enumerate(new.pgids) if pgid in index]
+        before = array('d')
+        after = array('d')
+        for i in keep:
+            j = index[new.pgids[i]]
+            before.extend(old.counters[j * n:(j + 1) * n])
+            after.extend(new.counters[i * n:(i + 1) * n])
+        pgids = [new.pgids[i] for i in keep]
+        acting = [new.acting[i] for i in keep]
+
+    if numpy is not None:
+        deltas = numpy.frombuffer(after, dtype=float) - numpy.frombuffer(before, dtype=float)
+        rates = (numpy.maximum(deltas, 0) / dt).reshape(-1, n).tolist()
+    else:
+        flat = [max(a - b, 0) / dt for a, b in izip(after, before)]
+        rates = [flat[i:i + n] for i in xrange(0, len(flat), n)]
+    return zip(pgids, acting, rates)
+
+
+def aggregate(rates, hosts):
+    """ Sum the PG rates by pool, OSD and host """
+    pools = defaultdict(lambda: [0.0] * len(COUNTERS))
+    osds = defaultdict(lambda: [0.0] * len(COUNTERS))
+    for pgid, acting, rate in rates:
+        pool = pools[pgid.split('.')[0]]
+        for i, value in enumerate(rate):
+            pool[i] += value
+        if not acting:
+            continue
+        primary = osds[acting[0]]
+        primary[R_OPS] += rate[R_OPS]
+        primary[R_KB] += rate[R_KB]
+        for osd in acting:
+            osds[osd][W_OPS] += rate[W_OPS]
+            osds[osd][W_KB] += rate[W_KB]
+    by_host = defaultdict(lambda: [0.0] * len(COUNTERS))
+    for osd, rate in osds.iteritems():
+        host = by_host[hosts.get(osd, 'unknown')]
+        for i, value in enumerate(rate):
+            host[i] += value
+    return pools, osds, by_host
+
+
+def sort_value(rate, sort):
+    return {
+        'ops': rate[R_OPS] + rate[W_OPS],
+        'bytes': rate[R_KB] + rate[W_KB],
+        'read_ops': rate[R_OPS],
+        'write_ops': rate[W_OPS],
+        'read_bytes': rate[R_KB],
+        'write_bytes': rate[W_KB],
+    }[sort]
+
+
+def top(items, n, sort):
+    return sorted(items, key=lambda item: -sort_value(item[1], sort))[:n]
+
+
+def get_pool_names():
+    try:
+        pools = json.loads(commands.getoutput('ceph osd lspools --format=json 2>/dev/null'))
+    except ValueError:
+        return {}
+    return dict((str(pool['poolnum']), pool['poolname']) for pool in pools)
+
+
+def print_table(title, rows):
+    print "%-32s %10s %10s %10s %10s" % (title, 'R_IOPS', 'W_IOPS', 'R_MiB/s', 'W_MiB/s')
+    for name, rate in rows:
+        print "%-32s %10.1f %10.1f %10.2f %10.2f" % (
+            name, rate[R_OPS], rate[W_OPS], rate[R_KB] / 1024, rate[W_KB] / 1024)
+    print
+
+
+def report(old, new, hosts, pool_names, n, sort, as_json):
+    rates = pg_rates(old, new)
+    pools, osds, by_host = aggregate(rates, hosts)
+    tables = [
+        ('PG', [('%s %s' % (pgid, acting), rate) for (pgid, acting), rate in
+                top([((pgid, acting), rate) for pgid, acting, rate in rates], n, sort)]),
+        ('POOL', [('%s (%s)' % (pool, pool_names[pool]) if pool in pool_names else pool, rate)
+                  for pool, rate in top(pools.items(), n, sort)]),
+        ('OSD', [('osd.%d (%s)' % (osd, hosts.get(osd, 'unknown')), rate)
+                 for osd, rate in top(osds.items(), n, sort)]),
+        ('HOST', top(by_host.items(), n, sort)),
+    ]
+    if as_json:
+        print json.dumps({
+            'time': new.time,
+            'interval': new.time - old.time,
+            'counters': ['read_ops', 'read_kb', 'write_ops', 'write_kb'],
+            'top': dict((title.lower(), [[name, rate] for name, rate in rows]) for title, rows in tables),
+        }, indent=2)
+        return
+    print "Rates over %.0fs at %s" % (new.time - old.time, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(new.time)))
+    print
+    for title, rows in tables:
+        print_table(title, rows)
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-i", "--interval", dest="interval", type="float", default=60,
+                      help="Seconds between snapshots (default: %default)")
+    parser.add_option("-c", "--count", dest="count", type="int", default=1,
+                      help="Reports to print, 0 to run forever (default: %default)")
+    parser.add_option("-k", "--keep", dest="keep", type="int", default=2,
+                      help="Snapshots to keep; the rates are over the oldest to the newest (default: %default)")
+    parser.add_option("-n", "--top", dest="top", type="int", default=10,
+                      help="Rows per table (default: %default)")
+    parser.add_option("-s", "--sort", dest="sort", default="ops", choices=SORT_KEYS,
+                      help="%s (default: %%default)" % ', '.join(SORT_KEYS))
+    parser.add_option("--state", dest="state", metavar="FILE",
+                      help="Compare with the snapshot saved in FILE by the previous run, then save the new one")
+    parser.add_option("--json", dest="json", default=False, action="store_true",
+                      help="Print the tables as JSON")
+    (options, args) = parser.parse_args()
+
+    hosts = cephinfo.get_osd_hosts()
+    pool_names = get_pool_names()
+
+    if options.state:
+        new = get_snapshot()
+        old = None
+        if os.path.exists(options.state):
+            with open(options.state) as f:
+                old = Snapshot.from_json(json.load(f))
+        with open(options.state + '.tmp', 'w') as f:
+            json.dump(new.to_json(), f)
+        os.rename(options.state + '.tmp', options.state)
+        if old is None:
+            print >> sys.stderr, "Saved the first snapshot to %s, rates from the next run on" % options.state
+            sys.exit(0)
+        report(old, new, hosts, pool_names, options.top, options.sort, options.json)
+        sys.exit(0)
+
+    snapshots = deque([get_snapshot()], maxlen=max(2, options.keep))
+    n = 0
+    while not options.count or n < options.count:
+        time.sleep(max(0, options.interval - (time.time() - snapshots[-1].time)))
+        snapshots.append(get_snapshot())
+        report(snapshots[0], snapshots[-1], hosts, pool_names, options.top, options.sort, options.json)
+        n += 1
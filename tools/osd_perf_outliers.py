@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+#
+# osd_perf_outliers.py
+#
+# Find the OSDs (and hosts) whose commit/apply latency stands out from their peers.
+#
+# Every interval 'ceph osd perf' and 'ceph osd df' are sampled into a ring buffer per
+# OSD, and the latencies are smoothed with an EWMA. Each OSD is compared to the other
+# OSDs of its device class, and to the OSDs of its host, with a robust z-score
+# ((x - median) / (1.4826 * MAD)); each host's median is compared to the other hosts of
+# the class the same way. An OSD or host is an outlier once it was flagged in most of
+# the recent samples, so a single hiccup does not count.
+#
+# The flags are logged, and can be served as Prometheus metrics. With --reweight, the
+# override reweight of outlier OSDs is lowered a step every --reweight-interval to shed
+# load, while few PGs are backfilling (like ceph-gentle-reweight); reweights are never
+# raised again, that is left to whoever replaces the disk.
+#
+# Usage:
+#
+#   osd_perf_outliers.py [--interval SECONDS] [--metrics-port PORT] [--reweight [--really]]
+#
+# Example usage:
+#
+#   ./osd_perf_outliers.py --count 30 --interval 10      # watch for five minutes
+#   ./osd_perf_outliers.py --metrics-port 9284
+#   ./osd_perf_outliers.py --reweight --min-reweight 0.8 --really
+#
+
+from collections import defaultdict, deque
+from optparse import OptionParser
+import commands
+import logging
+import time
+
+from cephinfo import cephinfo
+from cephinfo.prometheus import MetricsServer, render
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+# the MAD of normally distributed values is 1/1.4826 of their standard deviation
+MAD_SCALE = 1.4826
+
+COMMIT, APPLY, UTIL = range(3)
+
+
+def median(values):
+    if numpy is not None:
+        return float(numpy.median(values))
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return float(values[mid])
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def robust_z(values, min_spread):
+    """ (x - median) / (1.4826 * MAD) of every value; the spread is at least min_spread
+
+        min_spread keeps a group of identical latencies from turning every small
+        difference into an outlier.
+    """
+    if numpy is not None:
+        values = numpy.asarray(values, dtype=float)
+        center = numpy.median(values)
+        spread = max(MAD_SCALE * numpy.median(numpy.abs(values - center)), min_spread)
+        return list((values - center) / spread)
+    center = median(values)
+    spread = max(MAD_SCALE * median([abs(v - center) for v in values]), min_spread)
+    return [(v - center) / spread for v in values]
+
+
+class OsdSeries(object):
+    """ Ring buffer of (time, commit ms, apply ms, utilization %) samples of one OSD, with EWMAs """
+
+    def __init__(self, size, alpha, window):
+        self.samples = deque(maxlen=size)
+        self.alpha = alpha
+        self.ewma = None
+        self.flags = deque(maxlen=window)
+
+    def add(self, t, commit, apply, util):
+        self.samples.append((t, commit, apply, util))
+        if self.ewma is None:
+            self.ewma = [commit, apply, util]
+        else:
+            self.ewma = [e + self.alpha * (v - e) for e, v in zip(self.ewma, (commit, apply, util))]
+
+
+class OutlierDetector(object):
+
+    def __init__(self, size=360, alpha=0.3, threshold=3.5, min_latency=5.0, min_spread=1.0,
+                 window=12, min_flagged=8):
+        self.size = size
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_latency = min_latency
+        self.min_spread = min_spread
+        self.window = window
+        self.min_flagged = min_flagged
+        self.series = {}
+        self.host_flags = defaultdict(lambda: deque(maxlen=window))
+        self.device_classes = {}
+        self.hosts = {}
+        self.z = {}
+        self.host_z = {}
+
+    def add_sample(self, t, perf, df, hosts):
+        """ perf: {osd: (commit, apply)}, df: {osd: osd df node}, hosts: {osd: host} """
+        self.hosts = hosts
+        for osd, (commit, apply) in perf.iteritems():
+            node = df.get(osd, {})
+            self.device_classes[osd] = node.get('device_class', 'unknown')
+            series = self.series.get(osd)
+            if series is None:
+                series = self.series[osd] = OsdSeries(self.size, self.alpha, self.window)
+            series.add(t, commit, apply, node.get('utilization', 0.0))
+        # OSDs gone from osd perf (down, removed) stop being tracked
+        for osd in [osd for osd in self.series if osd not in perf]:
+            del self.series[osd]
+        self.detect()
+
+    def latency(self, osd):
+        ewma = self.series[osd].ewma
+        return max(ewma[COMMIT], ewma[APPLY])
+
+    def detect(self):
+        by_class = defaultdict(list)
+        by_host = defaultdict(list)
+        for osd in self.series:
+            by_class[self.device_classes[osd]].append(osd)
+            by_host[(self.device_classes[osd], self.hosts.get(osd, 'unknown'))].append(osd)
+
+        self.z = {}
+        for device_class, osds in by_class.iteritems():
+            for osd, z in zip(osds, robust_z([self.latency(osd) for osd in osds], self.min_spread)):
+                self.z[osd] = {'class': z}
+        for (device_class, host), osds in by_host.iteritems():
+            if len(osds) < 3:
+                continue
+            for osd, z in zip(osds, robust_z([self.latency(osd) for osd in osds], self.min_spread)):
+                self.z[osd]['host'] = z
+
+        self.host_z = {}
+        for device_class, osds in by_class.iteritems():
+            hosts = sorted(set(host for c, host in by_host if c == device_class))
+            if len(hosts) < 3:
+                continue
+            medians = [median([self.latency(osd) for osd in by_host[(device_class, host)]]) for host in hosts]
+            for host, m, z in zip(hosts, medians, robust_z(medians, self.min_spread)):
+                flagged = z > self.threshold and m > self.min_latency
+                self.host_flags[(device_class, host)].append(flagged)
+                self.host_z[(device_class, host)] = z
+
+        for osd, series in self.series.iteritems():
+            z = self.z[osd]
+            flagged = max(z.values()) > self.threshold and self.latency(osd) > self.min_latency
+            series.flags.append(flagged)
+
+    def osd_outliers(self):
+        return sorted(osd for osd, series in self.series.iteritems() if sum(series.flags) >= self.min_flagged)
+
+    def host_outliers(self):
+        return sorted(key for key, flags in self.host_flags.iteritems()
+                      if key in self.host_z and sum(flags) >= self.min_flagged)
+
+    def metrics(self):
+        samples = []
+        outliers = set(self.osd_outliers())
+        for osd in sorted(self.series):
+            series = self.series[osd]
+            labels = {'ceph_daemon': 'osd.%d' % osd, 'host': self.hosts.get(osd, 'unknown'),
+                      'device_class': self.device_classes[osd]}
+            samples.append(('ceph_osd_perf_commit_latency_ewma_ms', labels, '%.2f' % series.ewma[COMMIT]))
+            samples.append(('ceph_osd_perf_apply_latency_ewma_ms', labels, '%.2f' % series.ewma[APPLY]))
+            samples.append(('ceph_osd_perf_utilization_ewma', labels, '%.2f' % series.ewma[UTIL]))
+            for group, z in sorted(self.z[osd].iteritems()):
+                samples.append(('ceph_osd_perf_robust_z', dict(labels, group=group), '%.2f' % z))
+            samples.append(('ceph_osd_perf_outlier', labels, int(osd in outliers)))
+        host_outliers = set(self.host_outliers())
+        for key in sorted(self.host_z):
+            labels = {'device_class': key[0], 'host': key[1]}
+            samples.append(('ceph_host_perf_robust_z', labels, '%.2f' % self.host_z[key]))
+            samples.append(('ceph_host_perf_outlier', labels, int(key in host_outliers)))
+        return samples
+
+
+def get_num_backfilling():
+    out = commands.getoutput("ceph pg stat | tr ',:' '\n' | awk '/backfilling/ { total += $1}; END { print total}'")
+    return int(out) if out.strip() else 0
+
+
+def reweight_outliers(osds, df, step, min_reweight, max_backfilling, really):
+    """ Lower the override reweight of each outlier by step, down to min_reweight """
+    if not osds:
+        return
+    backfilling = get_num_backfilling()
+    if backfilling > max_backfilling:
+        logger.info("%d PGs backfilling, not reweighting %s", backfilling, osds)
+        return
+    for osd in osds:
+        reweight = float(df.get(osd, {}).get('reweight', 1.0))
+        new_reweight = max(min_reweight, round(reweight - step, 4))
+        if new_reweight >= reweight:
+            continue
+        cmd = "ceph osd reweight osd.%d %.4f" % (osd, new_reweight)
+        if really:
+            logger.warning("Calling %s: %s", cmd, commands.getoutput(cmd))
+        else:
+            logger.warning("Would call %s (not --really)", cmd)
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-i", "--interval", dest="interval", type="float", default=10,
+                      help="Seconds between samples (default: %default)")
+    parser.add_option("-c", "--count", dest="count", type="int", default=0,
+                      help="Stop after this many samples, 0 to run forever (default: %default)")
+    parser.add_option("--history", dest="history", type="int", default=360,
+                      help="Samples kept per OSD (default: %default)")
+    parser.add_option("--alpha", dest="alpha", type="float", default=0.3,
+                      help="EWMA smoothing factor of the latencies (default: %default)")
+    parser.add_option("-t", "--threshold", dest="threshold", type="float", default=3.5,
+                      help="Robust z-score above which an OSD or host is flagged (default: %default)")
+    parser.add_option("--min-latency", dest="min_latency", type="float", default=5.0,
+                      help="Never flag below this latency in ms (default: %default)")
+    parser.add_option("--min-spread", dest="min_spread", type="float", default=1.0,
+                      help="Minimum spread in ms of the z-scores (default: %default)")
+    parser.add_option("--window", dest="window", type="int", default=12,
+                      help="Recent samples considered for the outlier decision (default: %default)")
+    parser.add_option("--min-flagged", dest="min_flagged", type="int", default=8,
+                      help="Flagged samples in the window to be an outlier (default: %default)")
+    parser.add_option("--tree-interval", dest="tree_interval", type="float", default=600,
+                      help="Seconds between reloads of the CRUSH tree (default: %default)")
+    parser.add_option("-p", "--metrics-port", dest="metrics_port", type="int",
+                      help="Serve Prometheus metrics on this port instead of logging the outliers")
+    parser.add_option("--reweight", dest="reweight", default=False, action="store_true",
+                      help="Lower the reweight of outlier OSDs")
+    parser.add_option("--reweight-step", dest="reweight_step", type="float", default=0.05,
+                      help="(default: %default)")
+    parser.add_option("--reweight-interval", dest="reweight_interval", type="float", default=600,
+                      help="Seconds between reweight steps (default: %default)")
+    parser.add_option("--min-reweight", dest="min_reweight", type="float", default=0.8,
+                      help="(default: %default)")
+    parser.add_option("-b", "--max-backfilling", dest="max_backfilling", type="int", default=50,
+                      help="Do not reweight while more PGs are backfilling (default: %default)")
+    parser.add_option("-r", "--really", dest="really", default=False, action="store_true",
+                      help="Really change the reweights")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    detector = OutlierDetector(options.history, options.alpha, options.threshold, options.min_latency,
+                               options.min_spread, options.window, options.min_flagged)
+    state = {'hosts': {}, 'tree_time': 0, 'reweight_time': 0, 'outliers': []}
+
+    def sample():
+        now = time.time()
+        if now - state['tree_time'] > options.tree_interval:
+            state['hosts'] = cephinfo.get_osd_hosts()
+            state['tree_time'] = now
+        df = cephinfo.get_osd_df()
+        detector.add_sample(now, cephinfo.get_osd_perf(), df, state['hosts'])
+        outliers = detector.osd_outliers()
+        if outliers != state['outliers']:
+            logger.warning("Outlier OSDs: %s; outlier hosts: %s",
+                           ', '.join('osd.%d (%s, %.1f ms, %.0f%% full)' % (
+                               osd, detector.hosts.get(osd, 'unknown'), detector.latency(osd),
+                               detector.series[osd].ewma[UTIL]) for osd in outliers) or 'none',
+                           ', '.join('%s (%s)' % (host, device_class)
+                                     for device_class, host in detector.host_outliers()) or 'none')
+            state['outliers'] = outliers
+        if options.reweight and now - state['reweight_time'] > options.reweight_interval and \
+                detector.series and len(detector.series.values()[0].samples) >= options.window:
+            state['reweight_time'] = now
+            reweight_outliers(outliers, df, options.reweight_step, options.min_reweight,
+                              options.max_backfilling, options.really)
+        return render(detector.metrics())
+
+    if options.metrics_port:
+        MetricsServer(sample, options.interval, options.metrics_port).serve_forever()
+
+    n = 0
+    while not options.count or n < options.count:
+        start = time.time()
+        try:
+            sample()
+        except Exception:
+            logger.exception("Failed to sample osd perf")
+        n += 1
+        time.sleep(max(0, options.interval - (time.time() - start)))
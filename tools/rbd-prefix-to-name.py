@@ -4,6 +4,7 @@ from optparse import OptionParser
 import sys
 import re
 import commands
+from rbd_prefix_index import RbdPrefixIndex, MAX_AGE
 
 def rbd_prefix_to_name(options):
   prefix = options.prefix.replace('rbd_data.','id_')
@@ -23,14 +24,41 @@ def rbd_prefix_to_name(options):
 #0010 : 34 33 36 2d 35 33 32 32 2d 34 61 32 36 2d 61 38 : 436-5322-4a26-a8
 #0020 : 61 31 2d 30 33 64 61 30 64 65 61 65 36 63 33    : a1-03da0deae6c3
 
+def resolve_stream(options, stream):
+  # resolve prefixes in batches against the local index of the pool's rbd_directory
+  index = RbdPrefixIndex(options.pool, options.index, options.max_age)
+  if options.refresh:
+    index.refresh()
+  batch = []
+  for line in stream:
+    if line.strip():
+      batch.append(line.strip())
+    if len(batch) >= 10000:
+      print_resolved(index.resolve(batch))
+      batch = []
+  print_resolved(index.resolve(batch))
+
+def print_resolved(resolved):
+  for prefix, name in resolved:
+    print prefix, name or '-'
+
 if __name__ == "__main__":
   parser = OptionParser()
+  parser.usage = "%prog -P <prefix> | cat prefixes | %prog [options]"
   parser.add_option("-P", "--prefix", dest="prefix", type="string",
                   help="RBD object prefix to lookup")
   parser.add_option("-p", "--pool", dest="pool", type="string", default="volumes",
                   help="Ceph pool (default: volumes)")
+  parser.add_option("-i", "--index", dest="index", type="string", default=None,
+                  help="Index file (default: ~/.cache/rbd-prefix-index.<pool>.sqlite)")
+  parser.add_option("--max-age", dest="max_age", type="int", default=MAX_AGE,
+                  help="Rebuild the index when older than this many seconds (default: %d)" % MAX_AGE)
+  parser.add_option("--refresh", dest="refresh", action="store_true", default=False,
+                  help="Rebuild the index now")
   (options, args) = parser.parse_args()
-  if not options.prefix:
+  if options.prefix:
+    print rbd_prefix_to_name(options)
+  elif not sys.stdin.isatty():
+    resolve_stream(options, sys.stdin)
+  else:
     parser.error('PREFIX not given')
-
-  print rbd_prefix_to_name(options)
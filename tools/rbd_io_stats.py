@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+#
+# rbd_io_stats.py
+#
+# Gather IO statistics about RBD volumes from (optionally gzipped) OSD logs in one pass.
+#
+# Two log formats are understood:
+#
+#  - filestore messages at debug_filestore 10:
+#      ceph tell osd.* injectargs '--debug_filestore 10'
+#  - client ops at debug_ms 1 (as enabled by top/rbdtop.sh):
+#      ceph tell osd.0 injectargs '--debug_ms 1'
+#
+# Usage:
+#
+#   rbd_io_stats.py logfile.gz [logfile2.gz ...]
+#
+# Example usage:
+#
+#   ./rbd_io_stats.py /var/log/ceph/ceph-osd.*.log-20140416.gz
+#   ./rbd_io_stats.py --start '2019-05-21 10:00:00' --end '2019-05-21 10:05:00' /var/log/ceph/ceph-osd.0.log
+#
+# Each log is parsed by its own worker process; per OSD, pool, PG, RBD image, object and
+# IO size are kept as bounded-memory heavy hitter counters, so the numbers for the rarest
+# keys are approximate (see TopK).
+#
+
+from collections import defaultdict
+from multiprocessing import Pool
+from operator import itemgetter
+from optparse import OptionParser
+import gzip
+import heapq
+import re
+import sys
+
+FILESTORE_WRITE_RE = re.compile(r'10 filestore\(/var/lib/ceph/osd/ceph-(\d+)\) write (\S+) (\d+)~(\d+) = (\d+)')
+FILESTORE_READ_RE = re.compile(r'10 filestore\(/var/lib/ceph/osd/ceph-(\d+)\) FileStore::read (\S+) (\d+)~(\d+)/(\d+)')
+OSD_OP_RE = re.compile(r'osd_op\((\S+) (.*?)\[([^\]]*)\]')
+PGID_RE = re.compile(r'\b(\d+)\.([0-9a-f]+)(?:s\d+)?\b')
+OBJECT_RE = re.compile(r'(rbd_data\.[0-9a-f]+)\.[0-9a-f]+|(rbd_header\.[0-9a-f]+)')
+EXTENT_RE = re.compile(r'(\d+)~(\d+)')
+LOG_OSD_RE = re.compile(r'ceph-osd\.(\d+)\.log')
+
+WRITE_OPS = ('write', 'writefull', 'writesame', 'zero', 'truncate')
+READ_OPS = ('read', 'sparse-read')
+
+DIMENSIONS = (
+    ('osd', 'OSD'),
+    ('pool', 'pool'),
+    ('pg', 'PG'),
+    ('rbd', 'RBD'),
+    ('object', 'object'),
+    ('length', 'length'),
+)
+
+
+class TopK(object):
+    """ Heavy hitter counters in bounded memory (Space-Saving).
+
+        At most k keys are counted. A new key takes over the counter of the key with the
+        smallest count and inherits its count, which is kept as the error of the new key:
+        a count is never too low and at most errors[key] too high, and any key seen more
+        often than the smallest count is still counted.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.counts = {}
+        self.errors = {}
+        # (count, key), possibly stale: the smallest current one is the minimum counter
+        self.heap = []
+
+    def add(self, key, n=1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += n
+        elif len(counts) < self.k:
+            counts[key] = n
+            self.errors[key] = 0
+        else:
+            low, victim = self.pop_min()
+            del counts[victim]
+            del self.errors[victim]
+            counts[key] = low + n
+            self.errors[key] = low
+        heapq.heappush(self.heap, (counts[key], key))
+        if len(self.heap) > 4 * self.k:
+            self.rebuild()
+
+    def pop_min(self):
+        while True:
+            count, key = heapq.heappop(self.heap)
+            if self.counts.get(key) == count:
+                return count, key
+
+    def rebuild(self):
+        self.heap = [(count, key) for key, count in self.counts.iteritems()]
+        heapq.heapify(self.heap)
+
+    def low(self):
+        """ The most a key which is not counted can have been seen """
+        return min(self.counts.itervalues()) if len(self.counts) >= self.k else 0
+
+    def merge(self, other):
+        """ A key missing from one summary may have been seen as often as its smallest count """
+        low, other_low = self.low(), other.low()
+        merged = [(self.counts.get(key, low) + other.counts.get(key, other_low),
+                   self.errors.get(key, low) + other.errors.get(key, other_low), key)
+                  for key in set(self.counts) | set(other.counts)]
+        merged = heapq.nlargest(self.k, merged)
+        self.counts = dict((key, count) for count, error, key in merged)
+        self.errors = dict((key, error) for count, error, key in merged)
+        self.rebuild()
+
+    def top(self, n):
+        return heapq.nlargest(n, self.counts.iteritems(), key=itemgetter(1))
+
+
+class IOStats(object):
+    """ Read and write counts per dimension, plus bytes per RBD image and counts per op name """
+
+    def __init__(self, k=1000):
+        self.counts = {}
+        for kind in ('write', 'read'):
+            for dim, _ in DIMENSIONS:
+                self.counts[(kind, dim)] = TopK(k)
+            self.counts[(kind, 'rbd_bytes')] = TopK(k)
+        self.ops = defaultdict(int)
+        self.lines = 0
+
+    def add(self, kind, osd, pg, obj, length):
+        counts = self.counts
+        pool = pg.split('.')[0]
+        m = OBJECT_RE.search(obj)
+        rbd = m and (m.group(1) or m.group(2))
+        counts[(kind, 'osd')].add(osd)
+        counts[(kind, 'pool')].add(pool)
+        counts[(kind, 'pg')].add(pg)
+        counts[(kind, 'object')].add(obj)
+        counts[(kind, 'length')].add(length)
+        if rbd:
+            counts[(kind, 'rbd')].add(rbd)
+            counts[(kind, 'rbd_bytes')].add(rbd, length)
+
+    def merge(self, other):
+        for key, topk in other.counts.iteritems():
+            self.counts[key].merge(topk)
+        for op, n in other.ops.iteritems():
+            self.ops[op] += n
+        self.lines += other.lines
+
+
+def parse_osd_op(description):
+    """ Split a debug_ms / dump_ops_in_flight osd_op description.
+
+        osd_op(client.4567.0:123 4.3f 4:fc4a5b8e:::rbd_data.1234abcd.0000000000000012:head [write 0~4096] ...)
+        returns (pgid, object, [(op name, length)]) or None.
+    """
+    m = OSD_OP_RE.search(description)
+    if not m:
+        return None
+    middle = m.group(2)
+    obj = OBJECT_RE.search(middle)
+    obj = obj.group(0) if obj else (middle.split() or ['?'])[-1]
+    pg = PGID_RE.search(middle.replace(obj, ''))
+    if not pg:
+        # hammer style: the pg comes after the ops
+        pg = PGID_RE.search(description[m.end():])
+    pgid = '%s.%s' % pg.groups() if pg else '?'
+    ops = []
+    for op in m.group(3).split(','):
+        op = op.strip()
+        if not op:
+            continue
+        extent = EXTENT_RE.search(op)
+        ops.append((op.split()[0], int(extent.group(2)) if extent else 0))
+    return pgid, obj, ops
+
+
+def timestamp(line):
+    """ 'YYYY-MM-DD HH:MM:SS' of a log line, for both the old and the ISO 'T' formats """
+    return line[:10] + ' ' + line[11:19]
+
+
+def analyze(stream, osd='?', start=None, end=None, image=None, k=1000):
+    stats = IOStats(k)
+    for line in stream:
+        if image and image not in line:
+            continue
+        if 'filestore(' in line:
+            m = FILESTORE_WRITE_RE.search(line)
+            kind = 'write'
+            if not m:
+                m = FILESTORE_READ_RE.search(line)
+                kind = 'read'
+            if not m:
+                continue
+            if (start and timestamp(line) < start) or (end and timestamp(line) > end):
+                continue
+            obj = m.group(2)
+            stats.ops[kind] += 1
+            stats.add(kind, m.group(1), obj.split('_')[0], obj, int(m.group(5)))
+        elif 'osd_op(' in line and '<==' in line:
+            parsed = parse_osd_op(line)
+            if not parsed:
+                continue
+            if (start and timestamp(line) < start) or (end and timestamp(line) > end):
+                continue
+            pgid, obj, ops = parsed
+            for name, length in ops:
+                stats.ops[name] += 1
+                if name in WRITE_OPS:
+                    stats.add('write', osd, pgid, obj, length)
+                elif name in READ_OPS:
+                    stats.add('read', osd, pgid, obj, length)
+        else:
+            continue
+        stats.lines += 1
+    return stats
+
+
+def open_log(path):
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path)
+    return open(path)
+
+
+def analyze_file(args):
+    path, start, end, image, k = args
+    m = LOG_OSD_RE.search(path)
+    with open_log(path) as stream:
+        return analyze(stream, m and m.group(1) or '?', start, end, image, k)
+
+
+def analyze_files(paths, start=None, end=None, image=None, k=1000, processes=None):
+    stats = IOStats(k)
+    jobs = [(path, start, end, image, k) for path in paths]
+    if len(jobs) == 1 or '-' in paths:
+        results = map(analyze_file, jobs)
+    else:
+        workers = Pool(processes)
+        results = workers.imap_unordered(analyze_file, jobs)
+    for result in results:
+        stats.merge(result)
+    return stats
+
+
+def pprint(message, topk, n, names=None):
+    print message
+    top = topk.top(n)
+    for key, count in top:
+        if names and names.get(key):
+            print "%s (%s): %s" % (key, names[key], count)
+        else:
+            print "%s: %s" % (key, count)
+    error = max([topk.errors[key] for key, count in top] or [0])
+    if error:
+        print "(counts may be high by up to %d)" % error
+    print
+
+
+def report(stats, n=12, names=None):
+    print "Operations:"
+    for op, count in sorted(stats.ops.items(), key=itemgetter(1), reverse=True):
+        print "%s: %s" % (op, count)
+    print
+    for kind, title in (('write', 'Writes'), ('read', 'Reads')):
+        for dim, label in DIMENSIONS:
+            pprint("%s per %s:" % (title, label), stats.counts[(kind, dim)], n, names)
+        pprint("%s bytes per RBD:" % title, stats.counts[(kind, 'rbd_bytes')], n, names)
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.usage = "%prog [options] logfile[.gz] [logfile2[.gz] ...]"
+    parser.add_option("-n", "--top", dest="top", type="int", default=12,
+                      help="Number of entries per report (default: %default)")
+    parser.add_option("-k", "--capacity", dest="k", type="int", default=1000,
+                      help="Heavy hitters tracked per report, bounds the memory (default: %default)")
+    parser.add_option("-j", "--processes", dest="processes", type="int", default=None,
+                      help="Parallel log parsers (default: one per cpu)")
+    parser.add_option("--start", dest="start", help="Skip lines before 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_option("--end", dest="end", help="Skip lines after 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_option("--image", dest="image", help="Only count ops on this rbd_data.<id> prefix")
+    parser.add_option("--resolve", dest="resolve", metavar="POOL",
+                      help="Show image names, resolving RBD prefixes in this pool")
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("no log files given")
+
+    stats = analyze_files(args, options.start, options.end, options.image, options.k, options.processes)
+    names = None
+    if options.resolve:
+        from rbd_prefix_index import RbdPrefixIndex
+        prefixes = set()
+        for kind in ('write', 'read'):
+            for key in ('rbd', 'rbd_bytes'):
+                prefixes.update(key for key, _ in stats.counts[(kind, key)].top(options.top))
+        names = dict(RbdPrefixIndex(options.resolve).resolve(sorted(prefixes)))
+    report(stats, options.top, names)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# rbd_prefix_index.py
+#
+# Map rbd_data.<id> object prefixes to image names, from a pool's rbd_directory
+# cached in a local SQLite index.
+#
+
+import os
+import re
+import sqlite3
+import stat
+import struct
+import time
+from cephinfo import cephinfo
+
+# rebuild the index from rbd_directory when it is older than this many seconds
+MAX_AGE = 3600
+
+# per user, so that nobody else can feed image names to the tools resolving with it
+INDEX_PATH = '~/.cache/rbd-prefix-index.%s.sqlite'
+
+PREFIX_RE = re.compile(r'rbd_data\.([0-9a-f]+)')
+
+
+def image_id(prefix):
+    """ rbd_data.<id>[.<object number>] or <id> -> <id> """
+    m = PREFIX_RE.search(prefix)
+    if m:
+        return m.group(1)
+    return prefix.strip()
+
+
+def check_owner(path):
+    """ Refuse an existing index which another user could have written """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return
+    if not stat.S_ISREG(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 022:
+        raise IOError("%s is not a regular file owned and only writable by uid %d, not using it" %
+                      (path, os.getuid()))
+
+
+def decode_name(value):
+    """ rbd_directory values are an encoded string: le32 length + bytes """
+    length, = struct.unpack('<I', value[:4])
+    return value[4:4 + length]
+
+
+class RbdPrefixIndex(object):
+    """ id -> name map of one pool's RBD images, persisted in SQLite.
+
+        The whole map is read from rbd_directory in paged omap reads when the index is
+        missing or older than max_age; ids missing from a fresh index are looked up one
+        by one and added, so new images are found without a full rebuild.
+    """
+
+    def __init__(self, pool, path=None, max_age=MAX_AGE):
+        self.pool = pool
+        self.path = path or os.path.expanduser(INDEX_PATH % pool)
+        self.max_age = max_age
+        if not path and not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path), 0700)
+        check_owner(self.path)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS images (id TEXT PRIMARY KEY, name TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.names = dict(self.db.execute('SELECT id, name FROM images'))
+
+    def refreshed(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'refreshed'").fetchone()
+        return float(row[0]) if row else 0
+
+    def stale(self):
+        return time.time() - self.refreshed() > self.max_age
+
+    def refresh(self):
+        """ Reload the whole id -> name map from rbd_directory """
+        ioctx = cephinfo.get_cluster().open_ioctx(self.pool)
+        try:
+            names = dict((key[len('id_'):], decode_name(value))
+                         for key, value in cephinfo.iter_omap_vals(ioctx, 'rbd_directory', 'id_'))
+        finally:
+            ioctx.close()
+        with self.db:
+            self.db.execute('DELETE FROM images')
+            self.db.executemany('INSERT INTO images VALUES (?, ?)', names.iteritems())
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('refreshed', ?)", (str(time.time()),))
+        self.names = names
+
+    def lookup_missing(self, ids):
+        """ Fetch ids which aren't in the index straight from rbd_directory """
+        ioctx = cephinfo.get_cluster().open_ioctx(self.pool)
+        try:
+            with cephinfo.rados.ReadOpCtx() as read_op:
+                it, ret = ioctx.get_omap_vals_by_keys(read_op, tuple('id_' + i for i in ids))
+                ioctx.operate_read_op(read_op, 'rbd_directory')
+                found = dict((key[len('id_'):], decode_name(value)) for key, value in it)
+        finally:
+            ioctx.close()
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO images VALUES (?, ?)', found.iteritems())
+        self.names.update(found)
+        return found
+
+    def resolve(self, prefixes):
+        """ Returns [(prefix, name or None)] for a batch of prefixes """
+        if self.stale():
+            self.refresh()
+        ids = [image_id(p) for p in prefixes]
+        missing = set(i for i in ids if i not in self.names)
+        if missing:
+            self.lookup_missing(missing)
+        return [(p, self.names.get(i)) for p, i in zip(prefixes, ids)]
+
+    def name(self, prefix):
+        return self.resolve([prefix])[0][1]
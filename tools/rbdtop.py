@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+#
+# rbdtop.py
+#
+# Live per-image RBD IO ranking, sampled from the OSDs' op trackers
+#
+# Instead of turning on debug_ms and grepping the OSD log (top/rbdtop.sh), poll
+# dump_ops_in_flight and dump_historic_ops on many OSDs in parallel, attribute
+# the ops to RBD images and rank the images over a sliding window.
+#
+# Usage:
+#
+#   rbdtop.py                           # all OSDs with an admin socket on this host
+#   rbdtop.py -o 12 -o 13 -o 14         # these OSDs, through 'ceph tell'
+#   rbdtop.py -o all --resolve volumes  # every up OSD, showing volume names
+#   rbdtop.py --record ops.json         # also save the raw dumps
+#   rbdtop.py --replay ops.json         # rank recorded dumps and exit
+#
+# The op trackers only hold a sample of the ops (in flight at the time of the poll,
+# or the slowest recent ones), so the rates are a ranking aid, not exact IOPS.
+#
+
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+import commands
+import glob
+import heapq
+import json
+import os
+import sys
+import time
+
+from rbd_io_stats import OSD_OP_RE, OBJECT_RE, WRITE_OPS, READ_OPS, parse_osd_op
+
+ASOK_GLOB = '/var/run/ceph/ceph-osd.*.asok'
+
+COMMANDS = ('dump_ops_in_flight', 'dump_historic_ops')
+
+# seconds before a 'ceph tell' or admin socket call is abandoned
+TIMEOUT = 10
+
+# columns of the per image totals
+R_OPS, W_OPS, R_BYTES, W_BYTES = range(4)
+
+
+def local_osds():
+    """ ids of the OSDs with an admin socket on this host """
+    return sorted(os.path.basename(path)[len('ceph-osd.'):-len('.asok')] for path in glob.glob(ASOK_GLOB))
+
+
+def up_osds():
+    osd_dump = json.loads(commands.getoutput('ceph osd dump --format=json 2>/dev/null'))
+    return [str(osd['osd']) for osd in osd_dump['osds'] if osd['up']]
+
+
+def fetch(osd, command, tell=False):
+    """ Returns the parsed op dump of one OSD, or None if it didn't answer """
+    if tell:
+        cmd = 'timeout %d ceph tell osd.%s %s --format=json 2>/dev/null' % (TIMEOUT, osd, command)
+    else:
+        cmd = 'timeout %d ceph --admin-daemon /var/run/ceph/ceph-osd.%s.asok %s 2>/dev/null' % (TIMEOUT, osd, command)
+    status, output = commands.getstatusoutput(cmd)
+    if status != 0:
+        return None
+    try:
+        return json.loads(output)
+    except ValueError:
+        return None
+
+
+def dump_ops(dump):
+    """ The op list of a dump_ops_in_flight or dump_historic_ops reply, whatever the release """
+    if not dump:
+        return []
+    ops = dump.get('ops', dump.get('Ops'))
+    if ops is None:
+        # mimic and later may nest the historic ops per op type
+        ops = []
+        for value in dump.values():
+            if isinstance(value, dict):
+                ops.extend(dump_ops(value))
+    return ops
+
+
+def op_time(op, now):
+    """ When the op was initiated, as a timestamp, or now if that is unknown """
+    initiated = op.get('initiated_at') or ''
+    try:
+        stamp = time.mktime(time.strptime(initiated[:19], '%Y-%m-%d %H:%M:%S'))
+    except ValueError:
+        return now
+    if len(initiated) > 20 and initiated[19] == '.':
+        stamp += float('0' + initiated[19:])
+    return stamp
+
+
+class OpsWindow(object):
+    """ Per image read/write ops and bytes initiated over the last `window` seconds.
+
+        Ops are identified by (osd, reqid, initiated_at), so an op reported by several
+        polls, or by both the in flight and the historic dump, is only counted once.
+        dump_historic_ops keeps ops for osd_op_history_duration, longer than the window:
+        the ops initiated before the window are ignored, so forgetting an op once it left
+        the window cannot count it again.
+    """
+
+    def __init__(self, window=60):
+        self.window = window
+        # heap of (op time, sequence, image, counts): the ops do not arrive in time order
+        self.events = []
+        self.sequence = 0
+        self.totals = {}
+        self.pools = {}
+        self.seen = {}
+
+    def add(self, now, osd, dump):
+        """ Add the ops of one dump taken at time now, returns how many were new """
+        added = 0
+        cutoff = now - self.window
+        for op in dump_ops(dump):
+            description = op.get('description', '')
+            m = OSD_OP_RE.search(description)
+            if not m:
+                continue
+            key = (osd, m.group(1), op.get('initiated_at'))
+            if key in self.seen:
+                continue
+            stamp = min(op_time(op, now), now)
+            if stamp < cutoff:
+                continue
+            self.seen[key] = stamp
+            pgid, obj, ops = parse_osd_op(description)
+            image = OBJECT_RE.search(obj)
+            if not image:
+                continue
+            image = image.group(1) or image.group(2)
+            counts = [0, 0, 0, 0]
+            for name, length in ops:
+                if name in WRITE_OPS:
+                    counts[W_OPS] += 1
+                    counts[W_BYTES] += length
+                elif name in READ_OPS:
+                    counts[R_OPS] += 1
+                    counts[R_BYTES] += length
+            if not counts[R_OPS] and not counts[W_OPS]:
+                continue
+            self.pools[image] = pgid.split('.')[0]
+            self.sequence += 1
+            heapq.heappush(self.events, (stamp, self.sequence, image, counts))
+            totals = self.totals.setdefault(image, [0, 0, 0, 0])
+            for i in range(4):
+                totals[i] += counts[i]
+            added += 1
+        return added
+
+    def expire(self, now):
+        cutoff = now - self.window
+        events = self.events
+        while events and events[0][0] < cutoff:
+            _, _, image, counts = heapq.heappop(events)
+            totals = self.totals[image]
+            for i in range(4):
+                totals[i] -= counts[i]
+            if not any(totals):
+                del self.totals[image]
+                del self.pools[image]
+        for key, stamp in self.seen.items():
+            if stamp < cutoff:
+                del self.seen[key]
+
+    def top(self, n, sort='ops'):
+        """ [(image, [r ops, w ops, r bytes, w bytes])] of the n busiest images """
+        if sort == 'bytes':
+            key = lambda item: item[1][R_BYTES] + item[1][W_BYTES]
+        else:
+            key = lambda item: item[1][R_OPS] + item[1][W_OPS]
+        return sorted(self.totals.items(), key=key, reverse=True)[:n]
+
+
+def sample(workers, osds, tell, commands_):
+    """ Poll every (osd, command) in parallel, returns [(osd, command, dump or None)] """
+    jobs = [(osd, command) for osd in osds for command in commands_]
+    dumps = workers.map(lambda job: fetch(job[0], job[1], tell), jobs)
+    return [(osd, command, dump) for (osd, command), dump in zip(jobs, dumps)]
+
+
+def human(n):
+    for unit in ('', 'k', 'M', 'G'):
+        if abs(n) < 1024:
+            return '%.0f%s' % (n, unit)
+        n /= 1024.0
+    return '%.0fT' % n
+
+
+def render(window, n, sort, span, names=None, header=''):
+    """ top-like table of the n busiest images, rates are per second over span """
+    span = float(max(1, span))
+    lines = [header, '',
+             '%-28s %-5s %-40s %8s %8s %8s %8s' % ('IMAGE', 'POOL', 'NAME', 'R/s', 'W/s', 'RB/s', 'WB/s')]
+    for image, totals in window.top(n, sort):
+        name = (names or {}).get(image) or '-'
+        lines.append('%-28s %-5s %-40s %8.1f %8.1f %8s %8s' % (
+            image, window.pools.get(image, '?'), name,
+            totals[R_OPS] / span, totals[W_OPS] / span,
+            human(totals[R_BYTES] / span), human(totals[W_BYTES] / span)))
+    return '\n'.join(lines)
+
+
+def resolve_names(index, window, n, sort, names):
+    """ Add names for the displayed images which aren't known yet """
+    missing = [image for image, _ in window.top(n, sort) if image not in names]
+    if missing:
+        names.update(index.resolve(missing))
+
+
+def replay(path, window):
+    """ Feed recorded dumps (one JSON object per line, as written by --record) into window """
+    first = last = None
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if first is None:
+                first = record['time']
+            last = record['time']
+            window.add(record['time'], record['osd'], record['dump'])
+            window.expire(record['time'])
+    return first, last
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.usage = "%prog [options]"
+    parser.add_option("-o", "--osd", dest="osds", action="append", default=[],
+                      help="Poll this OSD through 'ceph tell', may be repeated; 'all' polls every up OSD "
+                           "(default: the OSDs with an admin socket on this host)")
+    parser.add_option("-n", "--top", dest="top", type="int", default=20,
+                      help="Number of images shown (default: %default)")
+    parser.add_option("-s", "--sort", dest="sort", choices=('ops', 'bytes'), default='ops',
+                      help="Rank by ops or bytes (default: %default)")
+    parser.add_option("-w", "--window", dest="window", type="int", default=60,
+                      help="Sliding window in seconds (default: %default)")
+    parser.add_option("-d", "--delay", dest="delay", type="float", default=2,
+                      help="Seconds between polls (default: %default)")
+    parser.add_option("-j", "--parallel", dest="parallel", type="int", default=32,
+                      help="Concurrent OSD queries (default: %default)")
+    parser.add_option("-i", "--iterations", dest="iterations", type="int", default=0,
+                      help="Exit after this many polls (default: run until interrupted)")
+    parser.add_option("--in-flight-only", dest="historic", action="store_false", default=True,
+                      help="Don't poll dump_historic_ops")
+    parser.add_option("--resolve", dest="resolve", metavar="POOL",
+                      help="Show image names, resolving RBD prefixes in this pool")
+    parser.add_option("--record", dest="record", metavar="FILE",
+                      help="Append the raw dumps to FILE, for --replay")
+    parser.add_option("--replay", dest="replay", metavar="FILE",
+                      help="Rank the dumps recorded in FILE instead of polling")
+    (options, args) = parser.parse_args()
+
+    window = OpsWindow(options.window)
+    names = {}
+    index = None
+    if options.resolve:
+        from rbd_prefix_index import RbdPrefixIndex
+        index = RbdPrefixIndex(options.resolve)
+
+    if options.replay:
+        first, last = replay(options.replay, window)
+        if first is None:
+            parser.error("no dumps in %s" % options.replay)
+        if index:
+            resolve_names(index, window, options.top, options.sort, names)
+        print render(window, options.top, options.sort, min(options.window, last - first) or options.delay,
+                     names, 'rbdtop replay of %s' % options.replay)
+        sys.exit(0)
+
+    tell = bool(options.osds)
+    if 'all' in options.osds:
+        osds = up_osds()
+    elif options.osds:
+        osds = options.osds
+    else:
+        osds = local_osds()
+    if not osds:
+        parser.error("no OSDs to poll, use -o")
+    polled = COMMANDS if options.historic else COMMANDS[:1]
+    workers = ThreadPool(min(options.parallel, len(osds) * len(polled)))
+    record = open(options.record, 'a') if options.record else None
+
+    start = time.time()
+    iteration = 0
+    try:
+        while True:
+            now = time.time()
+            failed = set()
+            for osd, command, dump in sample(workers, osds, tell, polled):
+                if dump is None:
+                    failed.add(osd)
+                    continue
+                window.add(now, osd, dump)
+                if record:
+                    record.write(json.dumps({'time': now, 'osd': osd, 'command': command, 'dump': dump}) + '\n')
+            window.expire(now)
+            if record:
+                record.flush()
+            if index:
+                resolve_names(index, window, options.top, options.sort, names)
+            header = 'rbdtop - %s - %d OSDs polled in %.1fs, %d not answering - %d ops in the last %ds' % (
+                time.strftime('%F %T'), len(osds), time.time() - now, len(failed),
+                len(window.events), options.window)
+            sys.stdout.write('\033[H\033[2J')
+            print render(window, options.top, options.sort, min(options.window, now - start) or options.delay,
+                         names, header)
+            sys.stdout.flush()
+            iteration += 1
+            if options.iterations and iteration >= options.iterations:
+                break
+            time.sleep(max(0, options.delay - (time.time() - now)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if record:
+            record.close()
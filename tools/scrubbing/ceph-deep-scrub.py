@@ -16,7 +16,10 @@ import rados
 import logging
 import logging.handlers
 import sys
-import socket
+import atexit
+import scrub_forecast
+import omap_scan
+from cephinfo import carbon
 
 logger = logging.getLogger(__name__)
 stream_handler = logging.StreamHandler()
@@ -56,23 +59,34 @@ parser.add_argument('--conf', dest='CONF', type=str, default="/etc/ceph/ceph.con
                     help='Ceph config file. (default: %(default)s)')
 parser.add_argument("--graphite-prefix", dest="GRAPHITE_PREFIX", default="",
                     help="Graphite prefix to use when inserting metrics (default: %(default)s)")
+parser.add_argument("--carbon-server", dest="CARBON_SERVER", default=CARBON_SERVER,
+                    help="Carbon server to send metrics to (default: %(default)s)")
+parser.add_argument("--carbon-port", dest="CARBON_PORT", type=int, default=CARBON_PORT,
+                    help="Carbon port (default: %(default)s)")
+parser.add_argument("--carbon-spool", dest="CARBON_SPOOL", default="ceph_deep_scrub_carbon.spool",
+                    help="Spool metrics here while carbon is unreachable (default: %(default)s)")
+parser.add_argument("--model-file", dest="MODEL_FILE", default="ceph_deep_scrub_model.json",
+                    help="File to keep the deep scrub duration model in (default: %(default)s)")
+parser.add_argument("--auto-max-scrubs", dest="AUTO_MAX_SCRUBS", type=int, default=0,
+                    help="Raise the max scrubs up to this many when the forecast says the backlog "
+                         "can't be cleared within --age. 0 disables. (default: %(default)s)")
+parser.add_argument("--skip-file", dest="SKIP_FILE", default=None,
+                    help="Skip/throttle list written by omap_scan.py --output, reloaded every round: "
+                         "skipped PGs are never deep scrubbed, throttled PGs only alone")
+
+
+carbon_client = None
 
 
 def send_metric(key, value):
-    """ sends metric to carbon server """
-    context = {
-        "graphite_timestamp": int(time.time()),
-        "key": key,
-        "value": value
-    }
-    graphite = """
-{key} {value} {graphite_timestamp}\n"""
-
-    graphite = graphite.format(**context)
-    sock = socket.socket()
-    sock.connect((CARBON_SERVER, CARBON_PORT))
-    sock.sendall(graphite)
-    sock.close()
+    """ queues metric for the carbon server, sent on the next flush """
+    carbon_client.send(key, value)
+
+
+def pause(seconds):
+    """ sends the metrics queued this round, then sleeps until the next one """
+    carbon_client.flush()
+    time.sleep(seconds)
 
 
 def in_scrubbing_window(min_hour, max_hour):
@@ -107,6 +121,13 @@ def main():
     MIN_HOUR = args.START_HOUR
     MAX_HOUR = args.END_HOUR
     GRAPHITE_PREFIX = args.GRAPHITE_PREFIX
+    AUTO_MAX_SCRUBS = args.AUTO_MAX_SCRUBS
+    model = scrub_forecast.ScrubModel(args.MODEL_FILE)
+
+    # one carbon connection for the lifetime of the scheduler
+    global carbon_client
+    carbon_client = carbon.CarbonClient(args.CARBON_SERVER, args.CARBON_PORT, spool=args.CARBON_SPOOL)
+    atexit.register(carbon_client.close)
 
     # connect to cluster
     try:
@@ -127,7 +148,7 @@ def main():
         if not in_scrubbing_window(MIN_HOUR, MAX_HOUR):
             logger.warning("Outside of deep scrubbing hours, will not start")
             if SLEEP:
-                time.sleep(120)
+                pause(120)
                 continue
             else:
                 sys.exit(0)
@@ -145,6 +166,10 @@ def main():
         pg_dump = json.loads(buf)
         pg_stats = pg_dump['pg_stats']
 
+        cmd = {'prefix': 'osd tree', 'format': 'json'}
+        ret, buf, out = cluster.mon_command(json.dumps(cmd), b'', timeout=5)
+        osd_classes = scrub_forecast.get_osd_classes(json.loads(buf))
+
         # check if any previous jobs have finished
         existing_scrubbing = [pg for pg in pg_stats if pg['pgid'] in deep_scrubbing]
         logger.info("Checking %s PGs if they have finished scrubbing", len(existing_scrubbing))
@@ -156,6 +181,9 @@ def main():
                     duration = (scrub_completed - deep_scrubbing[pg['pgid']]).total_seconds()
                     logger.info("pg %s appears to have finished a deep scrub, took %s seconds", pg['pgid'], duration)
                     del deep_scrubbing[pg['pgid']]
+                    model.add(scrub_forecast.pg_pool(pg), scrub_forecast.pg_device_class(pg, osd_classes),
+                              pg['stat_sum']['num_bytes'], duration)
+                    model.save()
                     if GRAPHITE_PREFIX:
                         logger.info("trying to send metric to graphite")
                         send_metric("{}.deep_scrub.duration".format(GRAPHITE_PREFIX), duration)
@@ -165,6 +193,40 @@ def main():
             else:
                 logger.info("pg %s is still deep scrubbing", pg['pgid'])
 
+        # can the configured limits and window clear the backlog within AGE days?
+        forecast = scrub_forecast.forecast(model, pg_stats, osd_classes, now, AGE, MIN_HOUR, MAX_HOUR,
+                                           MAX_SCRUBS_WEEK, MAX_SCRUBS_WEEKEND)
+        if forecast is None:
+            logger.info("Not enough deep scrubs measured yet to forecast the backlog")
+        else:
+            logger.info("Forecast: %s stale PGs, %.0f scrub-hours of backlog, need %.2f concurrent scrubs to keep up, "
+                        "have %.2f, backlog clears in %.1f days, recommend max scrubs %s (weekend %s)",
+                        forecast['n_stale'], forecast['stale_work'] / 3600, forecast['needed_rate'],
+                        forecast['available_rate'], forecast['clear_seconds'] / 86400,
+                        forecast['recommended_scrubs'], forecast['recommended_scrubs_weekend'])
+            if not forecast['can_clear']:
+                logger.warning("Deep scrub backlog will not be cleared within %s days with the current limits", AGE)
+            if GRAPHITE_PREFIX:
+                for key in ('stale_work', 'needed_rate', 'available_rate', 'recommended_scrubs'):
+                    send_metric("{}.deep_scrub.forecast.{}".format(GRAPHITE_PREFIX, key), forecast[key])
+            if AUTO_MAX_SCRUBS:
+                week, weekend = scrub_forecast.auto_limits(forecast, MAX_SCRUBS_WEEK, MAX_SCRUBS_WEEKEND,
+                                                           AUTO_MAX_SCRUBS)
+                if now.isoweekday() >= 6:
+                    MAX_SCRUBS = weekend
+                else:
+                    MAX_SCRUBS = week
+                logger.info("Auto max scrubs: using %s", MAX_SCRUBS)
+
+        skip = set(skip_pgs)
+        throttle = set()
+        if args.SKIP_FILE:
+            try:
+                file_skip, throttle = omap_scan.load_skip_file(args.SKIP_FILE)
+                skip |= file_skip
+            except (IOError, ValueError):
+                logger.exception("Failed to load %s, using the built in skip list only", args.SKIP_FILE)
+
         # find out which OSDs are currently scrubbing
         pgs_scrubbing = [pg for pg in pg_stats if 'scrubbing' in pg['state']]
         pgs_scrubbing.sort(key=lambda k: k['pgid'])
@@ -185,7 +247,19 @@ def main():
         if len(pgs_scrubbing) >= MAX_SCRUBS:
             logger.info("Currently limited to %s active deep scrubs - pending another deep scrub task to finish", MAX_SCRUBS)
             if SLEEP:
-                time.sleep(30)
+                pause(30)
+                continue
+            else:
+                sys.exit()
+
+        # heavy omap PGs deep scrub alone: start nothing while one is queued or scrubbing
+        deep_scrubbing_now = set(pg['pgid'] for pg in pgs_scrubbing)
+        throttled_busy = sorted(pgid for pgid in throttle if pgid in deep_scrubbing or pgid in deep_scrubbing_now)
+        if throttled_busy:
+            logger.info("Heavy omap pg %s is deep scrubbing alone - not starting other deep scrubs",
+                        ', '.join(throttled_busy))
+            if SLEEP:
+                pause(30)
                 continue
             else:
                 sys.exit()
@@ -208,7 +282,7 @@ def main():
         if len(deep_scrubbing) >= MAX_SCRUBS:
             logger.warning("Already tracking %s queued deep scrubs, not queuing more: %s", len(deep_scrubbing), deep_scrubbing)
             if SLEEP:
-                time.sleep(30)
+                pause(30)
                 continue
             else:
                 sys.exit()
@@ -218,16 +292,22 @@ def main():
             i += 1
             logger.info("PG %s last deep scrubbed %s", pg['pgid'], pg['last_deep_scrub_stamp'])
 
-            if pg['pgid'] in skip_pgs:
+            if pg['pgid'] in skip:
                 logger.warning("Skipping PG %s due to configuration", pg['pgid'])
                 continue
 
+            # the oldest due PG is a heavy omap one: start nothing else until it can run alone
+            if pg['pgid'] in throttle and (pgs_scrubbing or deep_scrubbing or n_triggered):
+                logger.warning("Waiting for the other deep scrubs to finish to deep scrub heavy omap pg %s alone",
+                               pg['pgid'])
+                break
+
             deep_scrub_stamp = datetime.datetime.strptime(pg['last_deep_scrub_stamp'][:-7], "%Y-%m-%d %H:%M:%S")
 
             if deep_scrub_stamp > now - datetime.timedelta(days=AGE):
                 logger.warning("No need to deep scrub, oldest PG was deep scrubbed less than %s days ago on %s", AGE, deep_scrub_stamp)
                 if SLEEP:
-                    time.sleep(300)
+                    pause(300)
                     continue
                 else:
                     sys.exit()
@@ -242,6 +322,10 @@ def main():
                 logger.warning("pg %s already queued or started for deep scrub", pg['pgid'])
                 blocked = True
 
+            if pg['pgid'] in throttle and blocked:
+                logger.warning("Heavy omap pg %s is blocked, not starting other deep scrubs before it", pg['pgid'])
+                break
+
             if not blocked and n_to_trigger > 0:
                 # queue deep scrub
                 output = commands.getoutput("ceph pg deep-scrub %s" % pg['pgid'])
@@ -256,7 +340,7 @@ def main():
 
                 n_triggered += 1
 
-                if n_triggered == n_to_trigger:
+                if n_triggered == n_to_trigger or pg['pgid'] in throttle:
                     break
 
             # if we weren't triggering any, this lets loop above print what needs to be scrubbed without scheduling
@@ -266,7 +350,7 @@ def main():
 
         if SLEEP:
             logger.info("Forcing sleep of %s seconds...", SLEEP)
-            time.sleep(SLEEP)
+            pause(SLEEP)
         else:
             break
 
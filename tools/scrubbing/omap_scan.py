@@ -0,0 +1,230 @@
+#!/usr/bin/python
+# Find the PGs and objects with the heaviest omaps, e.g. unsharded RGW bucket indexes, and
+# write the skip/throttle list that ceph-deep-scrub.py --skip-file loads.
+#
+# The PGs are ranked by num_omap_keys/num_omap_bytes from one pg dump (these are only
+# accurate since the PG's last deep scrub). With --pool, every object of that pool is
+# listed once and the omap keys of each are counted in paged reads by a bounded pool of
+# workers, each with its own ioctx; only the heaviest objects are kept, so memory does
+# not grow with the pool. The PGs holding the heaviest objects are looked up with
+# 'ceph osd map'.
+#
+# PGs at or above the --skip thresholds are never deep scrubbed by ceph-deep-scrub.py,
+# PGs at or above the --throttle thresholds are only deep scrubbed alone.
+#
+# Example usage:
+#
+#   ./omap_scan.py                                           # rank PGs from the pg dump
+#   ./omap_scan.py --pool default.rgw.buckets.index --prefix .dir. --workers 16
+#   ./omap_scan.py --pool default.rgw.buckets.index --output /etc/ceph/deep-scrub-skip.json
+
+try:
+  import simplejson as json
+except ImportError:
+  import json
+
+import argparse
+import commands
+import heapq
+import logging
+import os
+import threading
+import time
+import Queue
+
+from cephinfo import cephinfo
+
+logger = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser(description='Rank the heaviest omap PGs and objects.')
+parser.add_argument('--conf', dest='CONF', default='/etc/ceph/ceph.conf',
+                    help='Ceph config file. (default: %(default)s)')
+parser.add_argument('--pool', dest='POOL',
+                    help='Also count the omap keys of every object of this pool')
+parser.add_argument('--prefix', dest='PREFIX', default='',
+                    help='Only count objects whose name starts with this, e.g. .dir. for bucket indexes')
+parser.add_argument('--workers', dest='WORKERS', type=int, default=8,
+                    help='Objects counted concurrently (default: %(default)s)')
+parser.add_argument('--batch', dest='BATCH', type=int, default=cephinfo.OMAP_BATCH,
+                    help='Omap keys per read (default: %(default)s)')
+parser.add_argument('--top', dest='TOP', type=int, default=20,
+                    help='PGs and objects to show (default: %(default)s)')
+parser.add_argument('--skip-keys', dest='SKIP_KEYS', type=int, default=10000000,
+                    help='Skip deep scrubs of PGs with this many omap keys (default: %(default)s)')
+parser.add_argument('--skip-bytes', dest='SKIP_BYTES', type=int, default=4 << 30,
+                    help='Skip deep scrubs of PGs with this many omap bytes (default: %(default)s)')
+parser.add_argument('--throttle-keys', dest='THROTTLE_KEYS', type=int, default=1000000,
+                    help='Deep scrub PGs with this many omap keys alone (default: %(default)s)')
+parser.add_argument('--throttle-bytes', dest='THROTTLE_BYTES', type=int, default=512 << 20,
+                    help='Deep scrub PGs with this many omap bytes alone (default: %(default)s)')
+parser.add_argument('--output', dest='OUTPUT',
+                    help='Write the skip/throttle list for ceph-deep-scrub.py --skip-file here')
+
+
+class OmapScanner(object):
+    """ Count the omap keys of every listed object with a bounded pool of workers.
+
+        One thread lists the pool into a bounded queue, so listing never runs far ahead
+        of counting; only the top objects are kept.
+    """
+
+    def __init__(self, cluster, pool, prefix='', workers=8, batch=cephinfo.OMAP_BATCH, top=20):
+        self.cluster = cluster
+        self.pool = pool
+        self.prefix = prefix
+        self.n_workers = workers
+        self.batch = batch
+        self.top = top
+        self.queue = Queue.Queue(maxsize=workers * 64)
+        self.lock = threading.Lock()
+        self.heap = []
+        self.n_objects = 0
+        self.n_keys = 0
+        self.n_errors = 0
+
+    def add(self, n_keys, nspace, name):
+        with self.lock:
+            self.n_objects += 1
+            self.n_keys += n_keys
+            if len(self.heap) < self.top:
+                heapq.heappush(self.heap, (n_keys, nspace, name))
+            elif n_keys > self.heap[0][0]:
+                heapq.heapreplace(self.heap, (n_keys, nspace, name))
+
+    def work(self):
+        ioctx = self.cluster.open_ioctx(self.pool)
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                nspace, name = item
+                try:
+                    ioctx.set_namespace(nspace)
+                    self.add(cephinfo.count_omap_keys(ioctx, name, self.batch), nspace, name)
+                except cephinfo.rados.ObjectNotFound:
+                    # deleted since it was listed
+                    pass
+                except Exception:
+                    logger.exception("Failed to count the omap keys of %s", name)
+                    with self.lock:
+                        self.n_errors += 1
+        finally:
+            ioctx.close()
+
+    def run(self):
+        workers = [threading.Thread(target=self.work) for _ in range(self.n_workers)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        ioctx = self.cluster.open_ioctx(self.pool)
+        start = time.time()
+        n_listed = 0
+        try:
+            ioctx.set_namespace(cephinfo.rados.LIBRADOS_ALL_NSPACES)
+            for obj in ioctx.list_objects():
+                if not obj.key.startswith(self.prefix):
+                    continue
+                self.queue.put((obj.nspace, obj.key))
+                n_listed += 1
+                if n_listed % 100000 == 0:
+                    logger.info("Listed %d objects in %.0fs, %d counted", n_listed, time.time() - start,
+                                self.n_objects)
+        finally:
+            for _ in workers:
+                self.queue.put(None)
+            for worker in workers:
+                worker.join()
+            ioctx.close()
+        return sorted(self.heap, reverse=True)
+
+
+def pg_omap(pg_stats):
+    """ [(pgid, omap keys, omap bytes)] of the PGs with omap data, heaviest first """
+    pgs = [(pg['pgid'], pg['stat_sum'].get('num_omap_keys', 0), pg['stat_sum'].get('num_omap_bytes', 0))
+           for pg in pg_stats]
+    return sorted([pg for pg in pgs if pg[1] or pg[2]], key=lambda pg: (-pg[1], -pg[2]))
+
+
+def object_pg(pool, nspace, name):
+    cmd = "ceph osd map %s %s %s --format=json 2>/dev/null" % (
+        commands.mkarg(pool), commands.mkarg(name), "--namespace %s" % commands.mkarg(nspace) if nspace else '')
+    try:
+        return json.loads(commands.getoutput(cmd))['pgid']
+    except (ValueError, KeyError):
+        return None
+
+
+def classify(pgs, objects, args):
+    """ The skip and throttle lists, with the reason for every PG """
+    skip = {}
+    throttle = {}
+    for pgid, keys, n_bytes in pgs:
+        reason = '%d omap keys, %d omap bytes in the pg dump' % (keys, n_bytes)
+        if keys >= args.SKIP_KEYS or n_bytes >= args.SKIP_BYTES:
+            skip[pgid] = reason
+        elif keys >= args.THROTTLE_KEYS or n_bytes >= args.THROTTLE_BYTES:
+            throttle[pgid] = reason
+    for pgid, keys, name in objects:
+        if pgid is None or pgid in skip:
+            continue
+        reason = '%s has %d omap keys' % (name, keys)
+        if keys >= args.SKIP_KEYS:
+            skip[pgid] = reason
+            throttle.pop(pgid, None)
+        elif keys >= args.THROTTLE_KEYS and pgid not in throttle:
+            throttle[pgid] = reason
+    return skip, throttle
+
+
+def load_skip_file(path):
+    """ (skip, throttle) pgid sets from an omap_scan.py --output file """
+    with open(path) as f:
+        data = json.load(f)
+    return set(data.get('skip', {})), set(data.get('throttle', {}))
+
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+    cluster = cephinfo.rados.Rados(conffile=args.CONF)
+    cluster.connect()
+    try:
+        ret, buf, out = cluster.mon_command(json.dumps({'prefix': 'pg dump', 'format': 'json'}), b'', timeout=30)
+        pg_dump = json.loads(buf)
+        pgs = pg_omap(pg_dump.get('pg_stats') or pg_dump['pg_map']['pg_stats'])
+
+        print "%-12s %14s %16s" % ('PG', 'OMAP_KEYS', 'OMAP_BYTES')
+        for pgid, keys, n_bytes in pgs[:args.TOP]:
+            print "%-12s %14d %16d" % (pgid, keys, n_bytes)
+        print
+
+        objects = []
+        if args.POOL:
+            start = time.time()
+            scanner = OmapScanner(cluster, args.POOL, args.PREFIX, args.WORKERS, args.BATCH, args.TOP)
+            heaviest = scanner.run()
+            logger.info("Counted the omap keys of %d objects (%d keys, %d errors) in %.0fs",
+                        scanner.n_objects, scanner.n_keys, scanner.n_errors, time.time() - start)
+            print "%-12s %14s  %s" % ('PG', 'OMAP_KEYS', 'OBJECT')
+            for n_keys, nspace, name in heaviest:
+                pgid = object_pg(args.POOL, nspace, name)
+                objects.append((pgid, n_keys, name if not nspace else '%s/%s' % (nspace, name)))
+                print "%-12s %14d  %s" % (pgid, n_keys, objects[-1][2])
+            print
+    finally:
+        cluster.shutdown()
+
+    skip, throttle = classify(pgs, objects, args)
+    print "Skip: %s" % (', '.join(sorted(skip)) or 'none')
+    print "Throttle: %s" % (', '.join(sorted(throttle)) or 'none')
+    if args.OUTPUT:
+        with open(args.OUTPUT + '.tmp', 'w') as f:
+            json.dump({'generated': time.strftime('%Y-%m-%d %H:%M:%S'), 'skip': skip, 'throttle': throttle},
+                      f, indent=2, sort_keys=True)
+        os.rename(args.OUTPUT + '.tmp', args.OUTPUT)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# Deep scrub throughput model and backlog forecast used by ceph-deep-scrub.py
+#
+# Scrub durations measured by the scheduler are fed into a per pool / per OSD device class
+# model of seconds per byte. From that model and the current pg dump we estimate how much
+# deep scrub work is outstanding and whether the configured concurrency and scrub window
+# can clear it within --age days.
+
+try:
+  import simplejson as json
+except ImportError:
+  import json
+
+import datetime
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+# exponential decay applied to the model on each new sample, so it follows the cluster
+DECAY = 0.98
+
+# don't trust a model key before it has seen this many (decayed) samples
+MIN_SAMPLES = 3
+
+WEEKDAYS = 5
+WEEKEND_DAYS = 2
+
+
+def parse_stamp(stamp):
+    """ Parse a pg dump scrub stamp, e.g. '2019-05-21 10:51:02.123456' """
+    return datetime.datetime.strptime(stamp[:-7], "%Y-%m-%d %H:%M:%S")
+
+
+def window_hours(min_hour, max_hour):
+    """ Returns the number of hours per day in_scrubbing_window() allows scrubbing.
+
+        Args:
+            min_hour: earliest time we can scrub
+            max_hour: max time we can scrub
+    """
+    if max_hour > min_hour:
+        hours = max_hour - min_hour + 1
+    elif max_hour < min_hour:
+        hours = (24 - min_hour) + max_hour + 1
+    else:
+        hours = 1
+    return min(24, hours)
+
+
+class ScrubModel(object):
+    """ Decayed linear fit of deep scrub duration against PG bytes.
+
+        duration = overhead + bytes * seconds_per_byte, kept for each (pool, device class)
+        key plus the '*' wildcards so that keys without enough samples fall back to the pool,
+        then the device class, then the whole cluster.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.sums = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.sums = json.load(f)
+            except (IOError, ValueError):
+                logger.exception("Could not load scrub model from %s, starting empty", path)
+
+    @staticmethod
+    def key(pool, device_class):
+        return "%s/%s" % (pool, device_class)
+
+    def add(self, pool, device_class, num_bytes, duration):
+        """ Add one measured deep scrub to the model. """
+        if duration <= 0:
+            return
+        x = float(num_bytes)
+        y = float(duration)
+        for k in set([self.key(pool, device_class), self.key(pool, '*'),
+                      self.key('*', device_class), self.key('*', '*')]):
+            n, sx, sy, sxx, sxy = self.sums.get(k, [0.0, 0.0, 0.0, 0.0, 0.0])
+            self.sums[k] = [n * DECAY + 1, sx * DECAY + x, sy * DECAY + y,
+                            sxx * DECAY + x * x, sxy * DECAY + x * y]
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.sums, f)
+        os.rename(tmp, self.path)
+
+    def coefficients(self, pool, device_class):
+        """ Returns (overhead, seconds_per_byte) for the most specific trusted key, or None. """
+        for k in (self.key(pool, device_class), self.key(pool, '*'),
+                  self.key('*', device_class), self.key('*', '*')):
+            if k not in self.sums:
+                continue
+            n, sx, sy, sxx, sxy = self.sums[k]
+            if n < MIN_SAMPLES:
+                continue
+            denominator = n * sxx - sx * sx
+            if denominator > 0:
+                slope = (n * sxy - sx * sy) / denominator
+                intercept = (sy - slope * sx) / n
+                if slope > 0 and intercept >= 0:
+                    return intercept, slope
+            # degenerate fit (all PGs the same size or negative overhead): use the plain ratio
+            if sx > 0:
+                return 0.0, sy / sx
+            return sy / n, 0.0
+        return None
+
+    def predict(self, pool, device_class, num_bytes):
+        """ Returns the predicted deep scrub duration in seconds, or None if unknown. """
+        coefficients = self.coefficients(pool, device_class)
+        if coefficients is None:
+            return None
+        overhead, seconds_per_byte = coefficients
+        return overhead + num_bytes * seconds_per_byte
+
+
+def pg_pool(pg):
+    return pg['pgid'].split('.')[0]
+
+
+def pg_device_class(pg, osd_classes):
+    """ Device class of the acting primary, which does the bulk of the deep scrub reads. """
+    try:
+        primary = pg.get('acting_primary', pg['acting'][0])
+    except IndexError:
+        return 'unknown'
+    return osd_classes.get(primary, 'unknown')
+
+
+def get_osd_classes(osd_tree):
+    """ Map osd id -> device class from 'osd tree' json """
+    classes = {}
+    for node in osd_tree['nodes']:
+        if node['type'] == 'osd':
+            classes[node['id']] = node.get('device_class', 'unknown')
+    return classes
+
+
+def forecast(model, pg_stats, osd_classes, now, age, min_hour, max_hour, max_scrubs, max_scrubs_weekend):
+    """ Estimate the deep scrub backlog and the concurrency needed to clear it.
+
+        Args:
+            model: ScrubModel
+            pg_stats: 'pg_stats' from pg dump
+            osd_classes: osd id -> device class
+            now: current utc datetime
+            age: --age, days between deep scrubs of each PG
+            min_hour, max_hour: scrubbing window
+            max_scrubs, max_scrubs_weekend: configured concurrency
+
+        Returns a dict, or None while the model has no usable samples.
+    """
+    cutoff = now - datetime.timedelta(days=age)
+    total_work = 0.0
+    stale_work = 0.0
+    n_stale = 0
+    for pg in pg_stats:
+        duration = model.predict(pg_pool(pg), pg_device_class(pg, osd_classes),
+                                 pg['stat_sum']['num_bytes'])
+        if duration is None:
+            return None
+        total_work += duration
+        if parse_stamp(pg['last_deep_scrub_stamp']) <= cutoff:
+            stale_work += duration
+            n_stale += 1
+
+    period = age * 86400.0
+    # fraction of wall clock time inside the scrub window, weighted by each day's concurrency
+    window_fraction = window_hours(min_hour, max_hour) / 24.0
+    slots = window_fraction * (WEEKDAYS * max_scrubs + WEEKEND_DAYS * max_scrubs_weekend) / 7.0
+
+    # scrub-seconds needed per wall clock second to scrub every PG once per period
+    needed_rate = total_work / period
+    spare_rate = slots - needed_rate
+    if spare_rate > 0:
+        clear_seconds = stale_work / spare_rate
+    else:
+        clear_seconds = float('inf')
+
+    # concurrency which keeps up and clears today's backlog within one period
+    weekend_ratio = float(max_scrubs_weekend) / max_scrubs if max_scrubs else 1.0
+    mean_day_weight = (WEEKDAYS + WEEKEND_DAYS * weekend_ratio) / 7.0
+    recommended = int(math.ceil((total_work + stale_work) / (period * window_fraction * mean_day_weight)))
+
+    return {
+        'n_stale': n_stale,
+        'total_work': total_work,
+        'stale_work': stale_work,
+        'needed_rate': needed_rate,
+        'available_rate': slots,
+        'clear_seconds': clear_seconds,
+        'can_clear': clear_seconds <= period,
+        'recommended_scrubs': max(1, recommended),
+        'recommended_scrubs_weekend': max(1, int(math.ceil(recommended * weekend_ratio))),
+    }
+
+
+def auto_limits(result, max_scrubs, max_scrubs_weekend, ceiling):
+    """ Returns (max_scrubs, max_scrubs_weekend) raised towards the recommendation, capped at ceiling.
+
+        The configured values stay the floor, so auto mode never scrubs less than asked for.
+    """
+    if result is None:
+        return max_scrubs, max_scrubs_weekend
+    return (max(max_scrubs, min(ceiling, result['recommended_scrubs'])),
+            max(max_scrubs_weekend, min(ceiling, result['recommended_scrubs_weekend'])))
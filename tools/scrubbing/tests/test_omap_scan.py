@@ -0,0 +1,27 @@
+from omap_scan import OmapScanner, classify, pg_omap
+
+
+def test_classify():
+    class Args(object):
+        SKIP_KEYS = 100
+        SKIP_BYTES = 1000
+        THROTTLE_KEYS = 10
+        THROTTLE_BYTES = 100
+    pgs = pg_omap([
+        {'pgid': '1.0', 'stat_sum': {'num_omap_keys': 200, 'num_omap_bytes': 10}},
+        {'pgid': '1.1', 'stat_sum': {'num_omap_keys': 20, 'num_omap_bytes': 10}},
+        {'pgid': '1.2', 'stat_sum': {'num_omap_keys': 0, 'num_omap_bytes': 0}},
+        {'pgid': '1.3', 'stat_sum': {'num_omap_keys': 1, 'num_omap_bytes': 5000}},
+        {'pgid': '1.4', 'stat_sum': {}},
+    ])
+    assert [pg[0] for pg in pgs] == ['1.0', '1.1', '1.3']
+    skip, throttle = classify(pgs, [('1.1', 150, '.dir.x'), ('1.5', 50, '.dir.y')], Args())
+    assert sorted(skip) == ['1.0', '1.1', '1.3'] and sorted(throttle) == ['1.5']
+
+
+def test_scanner_top():
+    scanner = OmapScanner(None, 'pool', top=2)
+    for n_keys, name in ((5, 'a'), (1, 'b'), (7, 'c'), (3, 'd')):
+        scanner.add(n_keys, '', name)
+    assert sorted(scanner.heap, reverse=True) == [(7, '', 'c'), (5, '', 'a')]
+    assert scanner.n_objects == 4 and scanner.n_keys == 16
@@ -0,0 +1,36 @@
+import datetime
+
+from scrub_forecast import ScrubModel, auto_limits, forecast, window_hours
+
+
+def test_window_hours():
+    assert window_hours(0, 24) == 24
+    assert window_hours(8, 17) == 10
+    assert window_hours(22, 5) == 8
+    assert window_hours(3, 3) == 1
+
+
+def test_forecast():
+    model = ScrubModel()
+    for num_bytes in (10, 20, 30, 40):
+        model.add('1', 'hdd', num_bytes * 2 ** 30, 60 + num_bytes * 10)
+    overhead, seconds_per_byte = model.coefficients('1', 'hdd')
+    assert '%.1f' % overhead == '60.0'
+    assert '%.1f' % (seconds_per_byte * 2 ** 30) == '10.0'
+    # unknown pools fall back to the class, then the cluster
+    assert model.predict('2', 'ssd', 0) is not None
+
+    now = datetime.datetime(2019, 6, 5, 12, 0, 0)
+    old = '2019-05-01 00:00:00.000000'
+    new = '2019-06-04 00:00:00.000000'
+    pgs = [{'pgid': '1.%x' % i, 'acting': [i], 'stat_sum': {'num_bytes': 10 * 2 ** 30},
+            'last_deep_scrub_stamp': old if i < 1000 else new} for i in range(20000)]
+    # 20000 PGs * 160s over 14 days needs ~2.6 concurrent scrubs, plus the backlog
+    result = forecast(model, pgs, {}, now, 14, 0, 24, 2, 2)
+    assert result['n_stale'] == 1000
+    assert not result['can_clear']
+    assert result['recommended_scrubs'] == 3
+    assert auto_limits(result, 2, 1, 10) == (3, 3)
+    assert auto_limits(result, 2, 1, 2) == (2, 2)
+    result = forecast(model, pgs, {}, now, 14, 0, 24, 4, 4)
+    assert result['can_clear']
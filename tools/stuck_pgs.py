@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#
+# stuck_pgs.py
+#
+# Diagnose stuck or inactive PGs: which OSDs are they waiting for, and why.
+#
+# The problem PGs (peering, incomplete, down, activating, ... by default) are selected
+# from one pg dump, then 'pg query' is run for all of them concurrently, at most
+# --parallel at a time, over one persistent librados connection (or 'ceph pg query'
+# subprocesses without the rados bindings). The recovery_state of every answer is
+# reduced to the OSDs blocking the PG and a reason, and the OSDs are ranked by the
+# number of PGs they block. Stale PGs are not queried: their primary is not reporting,
+# so they are attributed to it directly. PGs without an acting set (typically unknown
+# ones) are not queried either, and are listed as such rather than blamed on an OSD.
+#
+# Usage:
+#
+#   stuck_pgs.py [--states peering,incomplete,...] [--parallel N] [--timeout SECONDS]
+#
+# Example usage:
+#
+#   ./stuck_pgs.py
+#   ./stuck_pgs.py --states incomplete --verbose
+#   ./stuck_pgs.py --json > stuck.json
+#
+
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+import commands
+import json
+import sys
+import time
+
+from cephinfo import cephinfo
+
+STATES = ('peering', 'incomplete', 'down', 'activating', 'unknown', 'stale')
+
+# what to try first, by the state of the blocking OSD
+ADVICE = {
+    'down': 'start it; if it is gone for good, mark it lost',
+    'up': 'it is up: check its log, restart it',
+    'missing': 'it no longer exists: mark it lost or recreate it',
+}
+
+
+def select_pgs(pg_stats, states):
+    """ The PGs in any of the states, e.g. 'peering' matches 'remapped+peering' """
+    return [pg for pg in pg_stats if any(state in pg['state'].split('+') for state in states)]
+
+
+def primary(pg):
+    """ The acting primary, or -1 if the PG has no acting set (e.g. unknown PGs) """
+    if pg.get('acting_primary', -1) >= 0:
+        return pg['acting_primary']
+    return pg['acting'][0] if pg.get('acting') else -1
+
+
+def query_pg(pgid, timeout):
+    """ (pgid, query result or None, error or None) """
+    try:
+        if cephinfo.rados is None:
+            out = commands.getoutput('timeout %d ceph pg %s query --format=json 2>&1' % (timeout, pgid))
+            try:
+                return pgid, json.loads(out), None
+            except ValueError:
+                return pgid, None, out.strip().splitlines()[-1] if out.strip() else 'timed out'
+        cmd = json.dumps({'prefix': 'query', 'pgid': pgid, 'format': 'json'})
+        ret, buf, out = cephinfo.get_cluster().pg_command(pgid, cmd, b'', timeout=timeout)
+        if ret != 0:
+            return pgid, None, out or 'error %d' % ret
+        return pgid, json.loads(buf), None
+    except Exception as e:
+        return pgid, None, str(e) or e.__class__.__name__
+
+
+def blockers(query):
+    """ (blocking OSD ids, reason) from a pg query recovery_state
+
+        The first recovery_state entry is the innermost state; the blocking OSDs
+        are those peering is blocked by, the down OSDs it would probe, and the OSDs
+        it is still waiting to hear from.
+    """
+    osds = set()
+    reasons = []
+    states = query.get('recovery_state', [])
+    for state in states:
+        for blocker in state.get('peering_blocked_by', []):
+            osds.add(int(blocker['osd']))
+        for osd in state.get('down_osds_we_would_probe', []):
+            osds.add(int(osd))
+        if state.get('name', '').endswith('/GetInfo'):
+            for peer in state.get('requested_info_from', []):
+                osds.add(int(str(peer.get('osd', peer)).split('(')[0]))
+        for detail in state.get('peering_blocked_by_detail', []):
+            reasons.append(detail.get('detail', str(detail)))
+        for key in ('blocked', 'comment'):
+            if state.get(key):
+                reasons.append(state[key])
+    name = states[0]['name'] if states else query.get('state', 'unknown')
+    reason = '%s: %s' % (name, '; '.join(reasons)) if reasons else name
+    return sorted(osds), reason
+
+
+def diagnose(pgs, results):
+    """ {osd: [pgids]} of the blocking OSDs, {reason: [pgids]}, {pgid: (osds, reason)}
+
+        PGs without an acting set are not blamed on any OSD.
+    """
+    by_osd = defaultdict(list)
+    by_reason = defaultdict(list)
+    details = {}
+    primaries = dict((pg['pgid'], primary(pg)) for pg in pgs)
+    for pgid, query, error in results:
+        if primaries[pgid] < 0:
+            osds, reason = [], 'no acting set'
+        elif query is None:
+            # the primary did not answer: it is the first suspect
+            osds, reason = [primaries[pgid]], 'query failed: %s' % error
+        else:
+            osds, reason = blockers(query)
+        details[pgid] = (osds, reason)
+        by_reason[reason].append(pgid)
+        for osd in osds:
+            by_osd[osd].append(pgid)
+    return by_osd, by_reason, details
+
+
+def osd_states(osd_dump):
+    return dict((osd['osd'], 'up' if osd['up'] else 'down') for osd in osd_dump['osds'])
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-s", "--states", dest="states", default=','.join(STATES),
+                      help="Comma separated PG states to diagnose (default: %default)")
+    parser.add_option("-p", "--parallel", dest="parallel", type="int", default=32,
+                      help="Concurrent pg queries (default: %default)")
+    parser.add_option("-t", "--timeout", dest="timeout", type="int", default=10,
+                      help="Seconds to wait for each pg query (default: %default)")
+    parser.add_option("-n", "--top", dest="top", type="int", default=20,
+                      help="OSDs and reasons to list (default: %default)")
+    parser.add_option("-v", "--verbose", dest="verbose", default=False, action="store_true",
+                      help="Also list every PG with its blockers and reason")
+    parser.add_option("--json", dest="json", default=False, action="store_true",
+                      help="Print the diagnosis as JSON")
+    (options, args) = parser.parse_args()
+
+    start = time.time()
+    cephinfo.init_pg()
+    states = options.states.split(',')
+    pgs = select_pgs(cephinfo.get_pg_stats(), states)
+    up = osd_states(json.loads(commands.getoutput('ceph osd dump --format=json 2>/dev/null')))
+    if not pgs:
+        print "No PGs are %s" % ' or '.join(states)
+        sys.exit(0)
+
+    # stale PGs have no primary to answer a query, and unknown ones often no acting set at all
+    stale = [pg for pg in pgs if 'stale' in pg['state'].split('+') or primary(pg) < 0]
+    queried = [pg for pg in pgs if 'stale' not in pg['state'].split('+') and primary(pg) >= 0]
+    workers = ThreadPool(max(1, min(options.parallel, len(queried))))
+    try:
+        results = workers.map(lambda pg: query_pg(pg['pgid'], options.timeout), queried)
+    finally:
+        workers.close()
+    results += [(pg['pgid'], None, 'stale, the primary is not reporting') for pg in stale]
+    by_osd, by_reason, details = diagnose(pgs, results)
+    elapsed = time.time() - start
+
+    ranked = sorted([item for item in by_osd.iteritems() if item[0] >= 0], key=lambda item: (-len(item[1]), item[0]))
+    if options.json:
+        print json.dumps({
+            'n_pgs': len(pgs),
+            'n_queried': len(queried),
+            'elapsed': elapsed,
+            'osds': [{'osd': osd, 'state': up.get(osd, 'missing'), 'n_pgs': len(pgids), 'pgs': sorted(pgids)}
+                     for osd, pgids in ranked],
+            'reasons': dict((reason, sorted(pgids)) for reason, pgids in by_reason.iteritems()),
+            'pgs': dict((pgid, {'osds': osds, 'reason': reason}) for pgid, (osds, reason) in details.iteritems()),
+        }, indent=2)
+        sys.exit(0)
+
+    print "%d PGs %s, %d queried in %.1fs" % (len(pgs), '/'.join(states), len(queried), elapsed)
+    print
+    print "Unblock these OSDs first:"
+    print "%-10s %-8s %8s  %s" % ('OSD', 'STATE', 'PGS', 'ADVICE')
+    for osd, pgids in ranked[:options.top]:
+        state = up.get(osd, 'missing')
+        print "%-10s %-8s %8d  %s" % ('osd.%d' % osd, state, len(pgids), ADVICE[state])
+    unblocked = [pgid for pgid, (osds, _) in details.iteritems() if not osds]
+    if unblocked:
+        print "%-10s %-8s %8d  %s" % ('none', '', len(unblocked), 'not waiting for any OSD, see the reasons')
+    print
+    print "%6s  %s" % ('PGS', 'REASON')
+    for reason, pgids in sorted(by_reason.iteritems(), key=lambda item: -len(item[1]))[:options.top]:
+        print "%6d  %s" % (len(pgids), reason)
+    if options.verbose:
+        print
+        for pgid in sorted(details):
+            osds, reason = details[pgid]
+            print "%-10s %-24s %s" % (pgid, ','.join('osd.%d' % osd for osd in osds) or '-', reason)
@@ -0,0 +1,11 @@
+def each_numpy_mode(module):
+    """ Iterate once without and, if it is installed, once with the numpy of module """
+    saved = module.numpy
+    try:
+        for use_numpy in (False, True):
+            if use_numpy and saved is None:
+                continue
+            module.numpy = saved if use_numpy else None
+            yield use_numpy
+    finally:
+        module.numpy = saved
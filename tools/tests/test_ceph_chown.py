@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+
+import ceph_chown
+from ceph_chown import ChownWalker
+
+
+@pytest.mark.parametrize('use_scandir', [False, True])
+def test_walker(monkeypatch, use_scandir):
+    if not use_scandir:
+        monkeypatch.setattr(ceph_chown, 'scandir', None)
+    elif ceph_chown.scandir is None:
+        pytest.skip('scandir is not installed')
+    root = tempfile.mkdtemp()
+    try:
+        for d in ('a/b', 'a/c', 'd'):
+            os.makedirs(os.path.join(root, d))
+        for f in ('a/b/1', 'a/b/2', 'a/c/3', 'd/4', '5'):
+            open(os.path.join(root, f), 'w').close()
+        os.symlink('/nonexistent', os.path.join(root, 'link'))
+        chowned = []
+        walker = ChownWalker(-1, -1, workers=3, chown=lambda path, uid, gid: chowned.append(path))
+        walker.walk(root)
+        # 4 directories below root, 5 files and a dangling symlink
+        assert walker.n_dirs_read == 5 and walker.n_entries == 11 and len(chowned) == 11
+        assert walker.n_errors == 0
+        open(os.path.join(root, 'a/c/6'), 'w').close()
+        # in case the mtime granularity hides the change
+        os.utime(os.path.join(root, 'a/c'), (time.time() + 10, time.time() + 10))
+        del chowned[:]
+        walker.walk(root)
+        # only a/c is read again; the other directories are only stat'ed
+        assert walker.n_dirs_read == 1
+        assert sorted(os.path.relpath(path, root) for path in chowned) == \
+            ['.', 'a', 'a/b', 'a/c', 'a/c/3', 'a/c/6', 'd']
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,49 @@
+from collections import namedtuple
+import random
+
+import histogram
+from histogram import SKETCH_COMPRESSION, ExactQuantiles, TDigest, bin_chunk, bucket_boundaries, median
+from numpy_modes import each_numpy_mode
+
+
+def test_quantiles():
+    rng = random.Random(42)
+    values = [rng.expovariate(1.0) for _ in range(100000)]
+    exact = ExactQuantiles()
+    sketch = TDigest()
+    for i in range(0, len(values), 10000):
+        exact.add_chunk(values[i:i + 10000])
+        sketch.add_chunk(values[i:i + 10000])
+    for q in (0.01, 0.5, 0.9, 0.99):
+        assert abs(sketch.quantile(q) - exact.quantile(q)) < 0.01 * max(1, exact.quantile(q))
+    assert len(sketch.centroids) < 10 * SKETCH_COMPRESSION
+
+    exact = ExactQuantiles()
+    exact.add_chunk([4.0, 5, 2], None)
+    exact.add_chunk([1, 9, 10], [1, 1, 1])
+    assert exact.quantile(0.5) == median([4.0, 5, 2, 1, 9, 10])
+    weighted = ExactQuantiles()
+    weighted.add_chunk([1, 2, 3], [1, 10, 1])
+    assert weighted.quantile(0.5) == 2
+
+
+def test_bin_chunk():
+    boundaries = [1.0, 2.0, 3.0]
+    for use_numpy in each_numpy_mode(histogram):
+        bucket_counts = [0, 0, 0]
+        skipped = bin_chunk(bucket_counts, boundaries, 0.0, 3.0, [0.0, 1.0, 1.5, 2.0, 3.0, 3.5])
+        assert bucket_counts == [2, 2, 1] and skipped == 1
+        skipped = bin_chunk(bucket_counts, boundaries, 0.0, 3.0, [2.5, -1], [10, 2])
+        assert bucket_counts == [2, 2, 11] and skipped == 2
+
+
+def test_bucket_boundaries():
+    Options = namedtuple('Options', 'custbuckets logscale buckets')
+    boundaries = bucket_boundaries(Options(None, False, 7), 0.0, 0.7)
+    assert boundaries == [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7]
+    # values on an edge go in the bucket below it, as they did with Decimal
+    bucket_counts = [0] * 7
+    bin_chunk(bucket_counts, boundaries, 0.0, 0.7, [0.1, 0.2, 0.4, 0.5])
+    assert bucket_counts == [1, 1, 0, 1, 1, 0, 0]
+    assert bucket_boundaries(Options('0.3,0.1,2', False, None), 0.0, 0.7) == [0.1, 0.3, 0.7]
+    assert bucket_boundaries(Options(None, True, 3), 0.0, 0.7) == [0.1, 0.3, 0.7]
@@ -0,0 +1,29 @@
+import json
+
+import hot_pgs
+from hot_pgs import Snapshot, aggregate, pg_rates
+from numpy_modes import each_numpy_mode
+
+
+def test_pg_rates():
+    old = Snapshot.from_pg_stats(0, [
+        {'pgid': '1.0', 'acting': [0, 1, 2], 'stat_sum': {'num_read': 10, 'num_read_kb': 40, 'num_write': 0, 'num_write_kb': 0}},
+        {'pgid': '1.1', 'acting': [1, 2, 3], 'stat_sum': {'num_read': 0, 'num_read_kb': 0, 'num_write': 100, 'num_write_kb': 400}},
+    ])
+    new = Snapshot.from_pg_stats(10, [
+        {'pgid': '1.0', 'acting': [0, 1, 2], 'stat_sum': {'num_read': 110, 'num_read_kb': 440, 'num_write': 0, 'num_write_kb': 0}},
+        {'pgid': '1.1', 'acting': [1, 2, 3], 'stat_sum': {'num_read': 0, 'num_read_kb': 0, 'num_write': 50, 'num_write_kb': 400}},
+    ])
+    split = Snapshot.from_pg_stats(10, [
+        {'pgid': '1.2', 'acting': [3, 2, 1], 'stat_sum': {'num_read': 1, 'num_read_kb': 1, 'num_write': 1, 'num_write_kb': 1}},
+        {'pgid': '1.0', 'acting': [0, 1, 2], 'stat_sum': {'num_read': 20, 'num_read_kb': 40, 'num_write': 10, 'num_write_kb': 10}},
+    ])
+    for use_numpy in each_numpy_mode(hot_pgs):
+        rates = pg_rates(old, new)
+        assert rates == [('1.0', [0, 1, 2], [10.0, 40.0, 0.0, 0.0]), ('1.1', [1, 2, 3], [0.0, 0.0, 0.0, 0.0])]
+        assert pg_rates(old, split) == [('1.0', [0, 1, 2], [1.0, 0.0, 1.0, 1.0])]
+    pools, osds, by_host = aggregate(pg_rates(old, split), {0: 'a', 1: 'a', 2: 'b'})
+    assert pools['1'] == [1.0, 0.0, 1.0, 1.0]
+    assert osds[0] == [1.0, 0.0, 1.0, 1.0] and osds[1] == [0.0, 0.0, 1.0, 1.0]
+    assert by_host['a'] == [1.0, 0.0, 2.0, 2.0] and by_host['b'] == [0.0, 0.0, 1.0, 1.0]
+    assert Snapshot.from_json(json.loads(json.dumps(old.to_json()))).counters == old.counters
@@ -0,0 +1,33 @@
+import osd_perf_outliers
+from cephinfo.prometheus import render
+from numpy_modes import each_numpy_mode
+from osd_perf_outliers import OutlierDetector, median, robust_z
+
+
+def test_robust_z():
+    for use_numpy in each_numpy_mode(osd_perf_outliers):
+        assert median([3, 1, 2]) == 2.0 and median([4, 1, 2, 3]) == 2.5
+        z = robust_z([1, 2, 3, 4, 100], 0.1)
+        assert abs(z[2]) < 1e-9 and z[4] > 30
+        assert robust_z([5, 5, 5, 6], 1.0)[3] == 1.0
+
+
+def test_detector():
+    detector = OutlierDetector(alpha=1.0, window=3, min_flagged=2)
+    df = dict((osd, {'device_class': 'hdd', 'utilization': 50.0, 'reweight': 1.0}) for osd in range(12))
+    hosts = dict((osd, 'host%d' % (osd // 3)) for osd in range(12))
+    for t in range(3):
+        perf = dict((osd, (10 + osd % 3, 10)) for osd in range(12))
+        perf[4] = (80, 90)
+        if t == 0:
+            perf[7] = (200, 200)
+        detector.add_sample(t, perf, df, hosts)
+    assert detector.osd_outliers() == [4]
+    assert detector.host_outliers() == []
+    for t in range(3, 6):
+        perf = dict((osd, (80 if hosts[osd] == 'host2' else 10, 10)) for osd in range(12))
+        detector.add_sample(t, perf, df, hosts)
+    assert detector.host_outliers() == [('hdd', 'host2')]
+    assert detector.osd_outliers() == [6, 7, 8]
+    text = render(detector.metrics())
+    assert 'ceph_osd_perf_outlier{ceph_daemon="osd.7",device_class="hdd",host="host2"} 1' in text
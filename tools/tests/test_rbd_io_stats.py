@@ -0,0 +1,50 @@
+from rbd_io_stats import TopK, analyze, parse_osd_op
+
+
+def test_parse_osd_op():
+    luminous = ('2019-05-21 10:51:02.123456 7f00 1 -- 10.0.0.1:6800/1234 <== client.4567 10.0.0.2:0/890 1 ==== '
+                'osd_op(client.4567.0:123 4.3f 4:fc4a5b8e:::rbd_data.1234abcd.0000000000000012:head '
+                '[set-alloc-hint object_size 4194304 write_size 4194304,write 8192~4096] snapc 0=[] '
+                'ondisk+write+known_if_redirected e1234) v8 ==== 234+0+4096 (1 0 0) 0x5 con 0x6')
+    assert parse_osd_op(luminous) == ('4.3f', 'rbd_data.1234abcd.0000000000000012',
+                                      [('set-alloc-hint', 0), ('write', 4096)])
+    stats = analyze([luminous, luminous.replace('<==', '==>')], osd='3')
+    assert stats.ops['write'] == 1
+    assert stats.counts[('write', 'rbd')].top(1) == [('rbd_data.1234abcd', 1)]
+    assert stats.counts[('write', 'rbd_bytes')].top(1) == [('rbd_data.1234abcd', 4096)]
+
+    filestore = ('2014-08-11 12:43:25.477693 7f022d257700 10 filestore(/var/lib/ceph/osd/ceph-0) write '
+                 '3.48_head/14b1ca48/rbd_data.41e16619f5eb6.0000000000001bd1/head//3 3641344~4608 = 4608')
+    stats = analyze([filestore], start='2014-08-11 12:00:00', end='2014-08-11 13:00:00')
+    assert stats.counts[('write', 'pg')].top(1) == [('3.48', 1)]
+    assert stats.counts[('write', 'rbd')].top(1) == [('rbd_data.41e16619f5eb6', 1)]
+    assert analyze([filestore], start='2014-08-11 13:00:00').lines == 0
+
+
+def test_topk():
+    topk = TopK(4)
+    for key in 'aaaaabbbbcccdde':
+        topk.add(key)
+    assert topk.top(2) == [('a', 5), ('b', 4)]
+    assert topk.errors['a'] == topk.errors['b'] == 0 and topk.errors['e'] == 2
+
+    # a key with 1/12 of the adds, interleaved with keys seen only once: 13 counters
+    # guarantee to keep any key seen more than 20000/13 times
+    topk = TopK(13)
+    for i in range(20000):
+        topk.add('heavy' if i % 12 == 0 else i)
+    (key, count), = topk.top(1)
+    assert key == 'heavy' and count - topk.errors[key] <= 1667 <= count
+    # with 5 it may be dropped, but then the smallest count is an upper bound of its count
+    topk = TopK(5)
+    for i in range(20000):
+        topk.add('heavy' if i % 12 == 0 else i)
+    assert 'heavy' in topk.counts or topk.low() >= 1667
+
+    # merged from two halves: still never too low
+    first, second = TopK(13), TopK(13)
+    for i in range(20000):
+        (first if i % 2 else second).add('heavy' if i % 12 == 0 else i)
+    first.merge(second)
+    (key, count), = first.top(1)
+    assert key == 'heavy' and count - first.errors[key] <= 1667 <= count
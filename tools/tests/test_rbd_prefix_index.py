@@ -0,0 +1,37 @@
+import os
+import shutil
+import struct
+import tempfile
+
+from rbd_prefix_index import RbdPrefixIndex, decode_name, image_id
+
+
+def test_decode():
+    value = struct.pack('<I', 11) + 'volume-1234'
+    assert decode_name(value) == 'volume-1234'
+    assert image_id('rbd_data.1a871195a024a98.0000000000003260') == '1a871195a024a98'
+    assert image_id('rbd_data.1a871195a024a98') == '1a871195a024a98'
+    assert image_id('1a871195a024a98\n') == '1a871195a024a98'
+
+
+def test_foreign_index_refused():
+    top = tempfile.mkdtemp()
+    try:
+        path = os.path.join(top, 'index.sqlite')
+        RbdPrefixIndex('rbd', path).db.close()
+        os.chmod(path, 0666)
+        try:
+            RbdPrefixIndex('rbd', path)
+            assert False, 'a world writable index was used'
+        except IOError:
+            pass
+        os.chmod(path, 0600)
+        os.symlink(path, path + '.link')
+        try:
+            RbdPrefixIndex('rbd', path + '.link')
+            assert False, 'a symlinked index was used'
+        except IOError:
+            pass
+        assert RbdPrefixIndex('rbd', path).names == {}
+    finally:
+        shutil.rmtree(top)
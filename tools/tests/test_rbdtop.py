@@ -0,0 +1,32 @@
+import time
+
+from rbdtop import OpsWindow, op_time
+
+
+def test_window():
+    def op(reqid, initiated, ops, obj='rbd_data.1234abcd.0000000000000012'):
+        return {'description': 'osd_op(client.4567.0:%d 4.3f 4:fc4a5b8e:::%s:head [%s] snapc 0=[] ondisk e1)'
+                               % (reqid, obj, ops),
+                'initiated_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(initiated)) + '.250000'}
+    base = time.mktime(time.strptime('2019-05-21 10:00:00', '%Y-%m-%d %H:%M:%S'))
+    assert op_time(op(1, base, 'read 0~1'), 0) == base + 0.25 and op_time({}, 7) == 7
+    window = OpsWindow(window=10)
+    in_flight = {'ops': [op(1, base + 99, 'write 0~4096'), op(2, base + 99, 'read 0~8192'),
+                         op(3, base + 99, 'write 0~4096', 'rbd_data.ffff.0000000000000001')]}
+    assert window.add(base + 100, '0', in_flight) == 3
+    # the same ops again, e.g. from dump_historic_ops, are not counted twice
+    historic = {'size': 20, 'duration': 600, 'Ops': in_flight['ops'] + [op(4, base + 100, 'writefull 0~65536')]}
+    assert window.add(base + 101, '0', historic) == 1
+    assert window.top(1) == [('rbd_data.1234abcd', [1, 2, 8192, 69632])]
+    assert window.top(1, 'bytes')[0][0] == 'rbd_data.1234abcd'
+    assert window.pools['rbd_data.ffff'] == '4'
+    # expired by the time the ops were initiated, not by the time they were polled
+    window.expire(base + 109.5)
+    assert window.top(5) == [('rbd_data.1234abcd', [0, 1, 0, 65536])]
+    window.expire(base + 111)
+    assert window.top(5) == [] and not window.seen
+    # the historic dump still holds the ops for 10 minutes: they are not counted again
+    for t in range(112, 700, 2):
+        assert window.add(base + t, '0', historic) == 0
+        window.expire(base + t)
+    assert window.top(5) == []
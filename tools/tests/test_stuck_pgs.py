@@ -0,0 +1,30 @@
+from stuck_pgs import blockers, diagnose, primary, select_pgs
+
+
+def test_blockers():
+    query = {'state': 'down+peering', 'recovery_state': [
+        {'name': 'Started/Primary/Peering/Down', 'comment': 'not enough up instances of this PG to go active'},
+        {'name': 'Started/Primary/Peering', 'blocked': 'peering is blocked due to down osds',
+         'down_osds_we_would_probe': [12, 13],
+         'peering_blocked_by': [{'osd': 12, 'current_lost_at': 0, 'comment': 'starting or marking this osd lost'}],
+         'peering_blocked_by_detail': [{'detail': 'peering_blocked_by_history_les_bound'}]},
+        {'name': 'Started'},
+    ]}
+    osds, reason = blockers(query)
+    assert osds == [12, 13]
+    assert reason == ('Started/Primary/Peering/Down: not enough up instances of this PG to go active; '
+                      'peering_blocked_by_history_les_bound; peering is blocked due to down osds')
+    osds, reason = blockers({'recovery_state': [
+        {'name': 'Started/Primary/Peering/GetInfo', 'requested_info_from': [{'osd': '7'}, {'osd': '3(1)'}]}]})
+    assert osds == [3, 7] and reason == 'Started/Primary/Peering/GetInfo'
+
+    pgs = [{'pgid': '1.0', 'acting': [1, 2]}, {'pgid': '1.1', 'acting': [3, 4], 'acting_primary': 3},
+           {'pgid': '1.2', 'acting': [], 'acting_primary': -1}]
+    assert [primary(pg) for pg in pgs] == [1, 3, -1]
+    by_osd, by_reason, details = diagnose(pgs, [('1.0', query, None), ('1.1', None, 'timed out'),
+                                                ('1.2', None, 'not queried')])
+    assert by_osd == {12: ['1.0'], 13: ['1.0'], 3: ['1.1']}
+    assert by_reason['query failed: timed out'] == ['1.1']
+    assert by_reason['no acting set'] == ['1.2'] and details['1.2'] == ([], 'no acting set')
+    assert select_pgs([{'state': 'remapped+peering'}, {'state': 'active+clean'}, {'state': 'stale+down'}],
+                      ['peering', 'down']) == [{'state': 'remapped+peering'}, {'state': 'stale+down'}]
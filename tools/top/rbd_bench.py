@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+#
+# rbd_bench.py
+#
+# Run sweeps of 'rbd bench' in parallel across several images and keep the results as JSON
+#
+# Each case of the sweep (io type x io size x threads x pattern) runs one 'rbd bench' per
+# image at the same time and is repeated --repeat times. The per second samples are parsed,
+# so a run records both the aggregate throughput and how steady it was.
+#
+# Usage:
+#
+#   rbd_bench.py [options] pool/image [pool/image ...]
+#
+# Examples:
+#
+#   # what custom_rbd_bench.sh did: 5 reads and writes of 4k on one image
+#   ./rbd_bench.py -r 5 -s 4K -t 16 --total 1G test-pool/test-image-00
+#
+#   # a sweep over 9 images at once, saved for later
+#   ./rbd_bench.py -s 4K,64K,4M -t 1,16 -p rand,seq -o luminous.json test-pool/test-image-{00..22}
+#
+#   # the same sweep after an upgrade, flagging cases more than 10% slower
+#   ./rbd_bench.py -s 4K,64K,4M -t 1,16 -p rand,seq -o nautilus.json --compare luminous.json test-pool/test-image-{00..22}
+#
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+import commands
+import math
+import re
+import socket
+import subprocess
+import sys
+import time
+
+# '  SEC       OPS   OPS/SEC   BYTES/SEC' rows; BYTES/SEC is a float before nautilus, '76 MiB/s' after
+SAMPLE_RE = re.compile(r'^\s*(\d+)\s+(\d+)\s+([\d.]+)\s+([\d.]+)\s*([KMGT]i?B/s)?\s*$')
+SUMMARY_RE = re.compile(r'elapsed:\s*([\d.]+)\s+ops:\s*(\d+)\s+ops/sec:\s*([\d.]+)\s+bytes/sec:\s*([\d.]+)\s*([KMGT]i?B/s)?')
+
+UNITS = {None: 1, 'B/s': 1, 'KiB/s': 1024, 'MiB/s': 1024 ** 2, 'GiB/s': 1024 ** 3, 'TiB/s': 1024 ** 4}
+
+PERCENTILES = (5, 50, 95)
+
+
+def to_bytes(size):
+    """ '4K' / '4M' / '1G' / '4096' -> bytes """
+    size = size.strip().upper().rstrip('B')
+    for i, suffix in enumerate('KMGT'):
+        if size.endswith(suffix):
+            return int(float(size[:-1]) * 1024 ** (i + 1))
+    return int(size)
+
+
+def rate(value, unit):
+    return float(value) * UNITS.get(unit and unit.replace('KB', 'KiB').replace('MB', 'MiB')
+                                    .replace('GB', 'GiB').replace('TB', 'TiB'), 1)
+
+
+def parse_bench(output):
+    """ Parse 'rbd bench' output into a dict with the summary and the per second samples """
+    result = {'samples': []}
+    for line in output.splitlines():
+        m = SAMPLE_RE.match(line)
+        if m:
+            result['samples'].append({
+                'sec': int(m.group(1)),
+                'ops': int(m.group(2)),
+                'ops_per_sec': float(m.group(3)),
+                'bytes_per_sec': rate(m.group(4), m.group(5)),
+            })
+            continue
+        m = SUMMARY_RE.search(line)
+        if m:
+            result['elapsed'] = float(m.group(1))
+            result['ops'] = int(m.group(2))
+            result['ops_per_sec'] = float(m.group(3))
+            result['bytes_per_sec'] = rate(m.group(4), m.group(5))
+    if 'elapsed' not in result:
+        return None
+    return result
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(0, int(math.ceil(p / 100.0 * len(values))) - 1)
+    return values[min(rank, len(values) - 1)]
+
+
+def run_bench(image, io_type, io_size, threads, pattern, total, rw_mix_read=50):
+    """ Run one 'rbd bench' and return its parsed record """
+    cmd = ['rbd', 'bench', '--image', image, '--io-type', io_type, '--io-size', str(io_size),
+           '--io-threads', str(threads), '--io-total', str(total), '--io-pattern', pattern]
+    if io_type == 'readwrite':
+        cmd += ['--rw-mix-read', str(rw_mix_read)]
+    start = time.time()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    record = parse_bench(output) if process.returncode == 0 else None
+    if record is None:
+        return {'image': image, 'error': output.strip().splitlines()[-1:] or ['rbd bench failed']}
+    record['image'] = image
+    record['start'] = start
+    return record
+
+
+def summarize(jobs):
+    """ Aggregate the parallel jobs of one case repetition """
+    ok = [job for job in jobs if 'error' not in job]
+    # per second rate of the whole set of images: sum the jobs' samples by second
+    by_sec = {}
+    for job in ok:
+        for sample in job['samples']:
+            by_sec.setdefault(sample['sec'], []).append(sample['ops_per_sec'])
+    # only the seconds where every job was still running
+    totals = [sum(values) for sec, values in sorted(by_sec.items()) if len(values) == len(ok)]
+    summary = {
+        'jobs': len(jobs),
+        'errors': len(jobs) - len(ok),
+        'ops_per_sec': sum(job['ops_per_sec'] for job in ok),
+        'bytes_per_sec': sum(job['bytes_per_sec'] for job in ok),
+        'elapsed': max([job['elapsed'] for job in ok] or [0]),
+    }
+    for p in PERCENTILES:
+        summary['ops_per_sec_p%d' % p] = percentile(totals, p)
+    return summary
+
+
+def case_key(case):
+    return '%(io_type)s/%(io_size)s/%(threads)s/%(pattern)s' % case
+
+
+def run_case(workers, images, case, total, repeat):
+    runs = []
+    for i in range(repeat):
+        jobs = workers.map(lambda image: run_bench(image, case['io_type'], case['io_size'], case['threads'],
+                                                   case['pattern'], total), images)
+        runs.append({'jobs': jobs, 'summary': summarize(jobs)})
+    result = dict(case)
+    result['runs'] = runs
+    result['ops_per_sec'] = percentile([run['summary']['ops_per_sec'] for run in runs], 50)
+    result['bytes_per_sec'] = percentile([run['summary']['bytes_per_sec'] for run in runs], 50)
+    return result
+
+
+def sweep(io_types, io_sizes, threads, patterns):
+    # writes first, so that reads don't hit unallocated (and so free) extents
+    order = dict((io_type, i) for i, io_type in enumerate(('write', 'readwrite', 'read')))
+    for io_type in sorted(io_types, key=lambda t: order.get(t, 0)):
+        for io_size in io_sizes:
+            for n in threads:
+                for pattern in patterns:
+                    yield {'io_type': io_type, 'io_size': io_size, 'threads': n, 'pattern': pattern}
+
+
+def compare(current, baseline, tolerance):
+    """ Returns [(case key, baseline ops/s, current ops/s, change)] and whether any case regressed """
+    previous = dict((case_key(case), case) for case in baseline['cases'])
+    rows = []
+    regressed = False
+    for case in current['cases']:
+        key = case_key(case)
+        if key not in previous or not previous[key]['ops_per_sec']:
+            continue
+        before = previous[key]['ops_per_sec']
+        change = (case['ops_per_sec'] - before) / float(before)
+        rows.append((key, before, case['ops_per_sec'], change))
+        if change < -tolerance:
+            regressed = True
+    return rows, regressed
+
+
+def print_case(case):
+    print "%-32s %10.1f ops/s %10.1f MB/s   p5 %10.1f  p50 %10.1f  p95 %10.1f ops/s" % (
+        case_key(case), case['ops_per_sec'], case['bytes_per_sec'] / 1024 ** 2,
+        percentile([run['summary']['ops_per_sec_p5'] for run in case['runs']], 50),
+        percentile([run['summary']['ops_per_sec_p50'] for run in case['runs']], 50),
+        percentile([run['summary']['ops_per_sec_p95'] for run in case['runs']], 50))
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.usage = "%prog [options] pool/image [pool/image ...]"
+    parser.add_option("-T", "--io-type", dest="io_types", default="write,read",
+                      help="Comma separated io types: write, read, readwrite (default: %default)")
+    parser.add_option("-s", "--io-size", dest="io_sizes", default="4K",
+                      help="Comma separated io sizes (default: %default)")
+    parser.add_option("-t", "--io-threads", dest="threads", default="16",
+                      help="Comma separated thread counts (default: %default)")
+    parser.add_option("-p", "--io-pattern", dest="patterns", default="seq",
+                      help="Comma separated patterns: seq, rand (default: %default)")
+    parser.add_option("--total", dest="total", default="1G",
+                      help="Bytes per bench (default: %default)")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3,
+                      help="Runs of each case, the median is reported (default: %default)")
+    parser.add_option("-o", "--output", dest="output",
+                      help="Write the results as JSON (default: rbd-bench-<time>.json)")
+    parser.add_option("--compare", dest="compare", metavar="FILE",
+                      help="Compare with a previous run and exit 1 if a case got slower")
+    parser.add_option("--tolerance", dest="tolerance", type="float", default=10,
+                      help="Slowdown in percent tolerated by --compare (default: %default)")
+    (options, images) = parser.parse_args()
+    if not images:
+        parser.error("no images given")
+
+    io_sizes = [to_bytes(size) for size in options.io_sizes.split(',')]
+    threads = [int(n) for n in options.threads.split(',')]
+    total = to_bytes(options.total)
+    result = {
+        'time': time.time(),
+        'host': socket.gethostname(),
+        'ceph_version': commands.getoutput('ceph --version 2>/dev/null').strip(),
+        'images': images,
+        'total': total,
+        'repeat': options.repeat,
+        'cases': [],
+    }
+
+    workers = ThreadPool(len(images))
+    for case in sweep(options.io_types.split(','), io_sizes, threads, options.patterns.split(',')):
+        case = run_case(workers, images, case, total, options.repeat)
+        result['cases'].append(case)
+        print_case(case)
+        sys.stdout.flush()
+
+    output = options.output or time.strftime('rbd-bench-%Y%m%d-%H%M%S.json')
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print "Results written to %s" % output
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        rows, regressed = compare(result, baseline, options.tolerance / 100.0)
+        print
+        print "Compared with %s (%s):" % (options.compare, baseline.get('ceph_version', '?'))
+        for key, before, after, change in rows:
+            flag = '  REGRESSION' if change < -options.tolerance / 100.0 else ''
+            print "%-32s %10.1f -> %10.1f ops/s %+6.1f%%%s" % (key, before, after, change * 100, flag)
+        if regressed:
+            sys.exit(1)
@@ -0,0 +1,47 @@
+from rbd_bench import compare, parse_bench, percentile, summarize, to_bytes
+
+
+def test_parse_bench():
+    luminous = '\n'.join([
+        'bench  type write io_size 4096 io_threads 16 bytes 1073741824 pattern sequential',
+        '  SEC       OPS   OPS/SEC   BYTES/SEC',
+        '    1     19376  19392.41  79431290.20',
+        '    2     39200  19608.10  80314016.00',
+        'elapsed:    13  ops:   262144  ops/sec: 19540.87  bytes/sec: 80039144.49',
+    ])
+    record = parse_bench(luminous)
+    assert record['ops'] == 262144
+    assert record['bytes_per_sec'] == 80039144.49
+    assert [s['ops_per_sec'] for s in record['samples']] == [19392.41, 19608.10]
+
+    nautilus = '\n'.join([
+        'bench  type read io_size 4194304 io_threads 16 bytes 1073741824 pattern random',
+        '  SEC       OPS   OPS/SEC   BYTES/SEC',
+        '    1        48    48.27   193 MiB/s',
+        'elapsed: 5   ops: 256   ops/sec: 50.1   bytes/sec: 200 MiB/s',
+    ])
+    record = parse_bench(nautilus)
+    assert record['bytes_per_sec'] == 200 * 1024 ** 2
+    assert record['samples'][0]['bytes_per_sec'] == 193 * 1024 ** 2
+    assert parse_bench('rbd: error opening image') is None
+
+
+def test_summarize():
+    def job(rates):
+        return {'elapsed': len(rates), 'ops_per_sec': sum(rates) / len(rates), 'bytes_per_sec': 0,
+                'samples': [{'sec': i + 1, 'ops_per_sec': r} for i, r in enumerate(rates)]}
+    summary = summarize([job([10, 20, 30]), job([10, 20]), {'image': 'x', 'error': ['failed']}])
+    assert summary['errors'] == 1
+    assert summary['ops_per_sec'] == 35
+    assert summary['ops_per_sec_p5'] == 20 and summary['ops_per_sec_p95'] == 40
+
+    baseline = {'cases': [{'io_type': 'write', 'io_size': 4096, 'threads': 16, 'pattern': 'rand',
+                           'ops_per_sec': 1000}]}
+    current = {'cases': [dict(baseline['cases'][0], ops_per_sec=850)]}
+    rows, regressed = compare(current, baseline, 0.1)
+    assert regressed and '%.2f' % rows[0][3] == '-0.15'
+    assert not compare(current, baseline, 0.2)[1]
+    # exact ranks are not rounded up to the next value
+    assert [percentile(range(1, 11), p) for p in (0, 10, 50, 90, 95, 100)] == [1, 1, 5, 9, 10, 10]
+    assert percentile([3, 1, 2, 4], 50) == 2 and percentile([], 50) == 0.0
+    assert to_bytes('4K') == 4096 and to_bytes('1G') == 2 ** 30 and to_bytes('512') == 512